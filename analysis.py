@@ -1,30 +1,483 @@
 #analysis.py - анализ данных и графики
 
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import datetime
+import numpy as np
+from storage import OPERATION_TYPES
+import utils
+from utils import date_to_ordinal, ordinal_to_date, to_minor, from_minor
+from instrumentation import timed
 
-class Analysis:
-    def plot_charts(self, operations, figure):
-        figure.clf()
-        ax = figure.add_subplot(111)
-        
-        categories = {}
-        for op in operations:
-            if op['operation_type'] == 'expense':
-                if op['category'] not in categories:
-                    categories[op['category']] = 0
-                categories[op['category']] -= op['amount']
-            else:
-                if op['category'] not in categories:
-                    categories[op['category']] = 0
-                categories[op['category']] += op['amount']
-        
+# Порядковый номер 1970-01-01: ordinal - EPOCH_ORDINAL = дни для datetime64[D]
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+INCOME = OPERATION_TYPES.index('income')
+EXPENSE = OPERATION_TYPES.index('expense')
+
+# Периоды отчётов; неделя обозначается датой своего понедельника
+PERIODS = ('day', 'week', 'month', 'year')
+PERIOD_UNITS = {'day': 'D', 'week': 'D', 'month': 'M', 'year': 'Y'}
+
+# Больше стольких изменений до ближайшего отчёта (импорт, загрузка) - суммы
+# пересчитываются по базе целиком, это быстрее построчного учёта
+ROLLUP_REBUILD_AFTER = 20000
+
+
+def week_start(date_text):
+    # Порядковый номер 1 (0001-01-01) - понедельник
+    ordinal = date_to_ordinal(date_text)
+    return ordinal_to_date(ordinal - (ordinal - 1) % 7)
+
+
+def minor_sums(keys, weights, size):
+    # np.bincount складывает в float64: для целых младших единиц это точно, пока
+    # суммы меньше 2**53 (90 трлн рублей при двух знаках), и намного быстрее np.add.at
+    return np.rint(np.bincount(keys, weights=weights, minlength=size)).astype(np.int64)
+
+
+def to_amounts(units):
+    # Массив младших единиц -> суммы числами, как у Database.get_category_totals
+    return (units / utils.AMOUNT_SCALE).tolist()
+
+
+def period_key(period, date_text):
+    if period == 'day':
+        return date_text
+    if period == 'month':
+        return date_text[:7]
+    if period == 'year':
+        return date_text[:4]
+    if period == 'week':
+        return week_start(date_text)
+    raise KeyError(period)
+
+
+class AnalyticsEngine:
+    # Векторные расчёты по столбцам операций: суммы со знаком (доход +, расход -),
+    # группировки через np.bincount по кодам категорий, месяцев и типов, топ и перцентили.
+    # Суммы - int64 младших единиц, итоги точные и переводятся в числа только на выходе.
+    # Столбцы копируются, поэтому движок не держит буферы массивов хранилища
+    def __init__(self, ids, amounts, categories, names, dates, types):
+        self.ids = ids
+        self.amounts = amounts
+        self.categories = categories
+        self.names = names
+        self.dates = dates
+        self.types = types
+        self.signed = np.where(types == INCOME, amounts, -amounts)
+        self.period_cache = {}
+
+    @classmethod
+    def from_store(cls, store):
+        columns = (
+            np.array(store.ids, dtype=np.int64),
+            np.array(store.amounts, dtype=np.int64),
+            np.array(store.categories, dtype=np.int64),
+            np.array(store.dates, dtype=np.int64),
+            np.array(store.types, dtype=np.int8),
+        )
+        if store.deleted:
+            alive = np.frombuffer(store.alive, dtype=np.bool_)
+            columns = tuple(column[alive] for column in columns)
+        ids, amounts, categories, dates, types = columns
+        return cls(ids, amounts, categories, list(store.category_names), dates, types)
+
+    @classmethod
+    def from_columns(cls, names, chunks):
+        # Порции столбцов базы SQLite (SQLiteDatabase.column_chunks): каждая порция
+        # переводится в массивы целиком, категории - кодами по списку names
+        codes = {name: code for code, name in enumerate(names)}
+        parts = ([], [], [], [], [])
+        for ids, amounts, categories, dates, types in chunks:
+            parts[0].append(np.array(ids, dtype=np.int64))
+            parts[1].append(np.array(amounts, dtype=np.int64))
+            parts[2].append(np.fromiter(map(codes.__getitem__, categories), dtype=np.int64, count=len(categories)))
+            parts[3].append(np.array(dates, dtype=np.int64))
+            parts[4].append(np.array(types, dtype=np.int8))
+        dtypes = (np.int64, np.int64, np.int64, np.int64, np.int8)
+        ids, amounts, categories, dates, types = (np.concatenate(part) if part else np.empty(0, dtype=dtype)
+                                                   for part, dtype in zip(parts, dtypes))
+        return cls(ids, amounts, categories, list(names), dates, types)
+
+    @classmethod
+    def from_rows(cls, rows):
+        # Произвольный список операций-словарей: по одному проходу на поле,
+        # даты разбираются сразу всем столбцом через datetime64
+        rows = rows if isinstance(rows, list) else list(rows)
+        codes = {}
+        count = len(rows)
+        ids = np.fromiter((op.get('id', 0) for op in rows), dtype=np.int64, count=count)
+        amounts = np.rint(np.fromiter((op['amount'] for op in rows), dtype=np.float64, count=count)
+                          * utils.AMOUNT_SCALE).astype(np.int64)
+        categories = np.fromiter((codes.setdefault(op['category'], len(codes)) for op in rows),
+                                 dtype=np.int64, count=count)
+        dates = np.array([op['date'] for op in rows], dtype='datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+        types = np.fromiter((OPERATION_TYPES.index(op['operation_type']) for op in rows),
+                            dtype=np.int8, count=count)
+        return cls(ids, amounts, categories, list(codes), dates, types)
+
+    @classmethod
+    @timed('analysis.engine')
+    def from_source(cls, source):
+        store = getattr(source, 'store', None)
+        if store is not None:
+            return cls.from_store(store)
+        if hasattr(source, 'column_chunks'):
+            return cls.from_columns(*source.column_chunks())
+        if hasattr(source, 'iter_rows'):
+            return cls.from_rows(source.iter_rows())
+        return cls.from_rows(source)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def by_type(self):
+        totals = minor_sums(self.types, self.amounts, len(OPERATION_TYPES))
+        return dict(zip(OPERATION_TYPES, to_amounts(totals)))
+
+    def by_category(self):
+        # Категории в порядке первого появления, как в исходном цикле по строкам
+        size = len(self.names)
+        totals = minor_sums(self.categories, self.signed, size)
+        counts = np.bincount(self.categories, minlength=size)
+        return {name: total for name, total, count in zip(self.names, to_amounts(totals), counts.tolist()) if count}
+
+    def period_index(self, period):
+        # Номер периода каждой операции от самого раннего периода и метки всех периодов диапазона
+        cached = self.period_cache.get(period)
+        if cached is not None:
+            return cached
+        unit = PERIOD_UNITS[period]
+        step = 7 if period == 'week' else 1
+        days = (self.dates - EPOCH_ORDINAL).astype('datetime64[D]')
+        if period == 'week':
+            # Порядковый номер 1 (0001-01-01) - понедельник
+            days = days - (self.dates - 1) % 7
+        periods = days.astype(f'datetime64[{unit}]')
+        if len(periods):
+            first = periods.min()
+            index = (periods - first).astype(np.int64) // step
+            count = int(index.max()) + 1
+            labels = np.datetime_as_string(first + np.arange(count) * step, unit=unit).tolist()
+        else:
+            index, labels = np.zeros(0, dtype=np.int64), []
+        self.period_cache[period] = index, labels
+        return index, labels
+
+    def by_month(self):
+        # {'ГГГГ-ММ': (доходы, расходы)} по возрастанию месяцев, пустые месяцы пропускаются
+        index, labels = self.period_index('month')
+        size = len(labels) * len(OPERATION_TYPES)
+        totals = minor_sums(index * len(OPERATION_TYPES) + self.types, self.amounts, size)
+        counts = np.bincount(index, minlength=len(labels))
+        totals = totals.reshape(len(labels), len(OPERATION_TYPES))
+        return {label: (income, expense) for label, (income, expense), count
+                in zip(labels, to_amounts(totals[:, [INCOME, EXPENSE]]), counts.tolist()) if count}
+
+    def category_month_matrix(self):
+        # Матрица сумм со знаком: строки - категории, столбцы - месяцы (по возрастанию, без пропусков)
+        index, labels = self.period_index('month')
+        width = len(labels)
+        matrix = minor_sums(self.categories * width + index, self.signed,
+                            len(self.names) * width).reshape(len(self.names), width)
+        return list(self.names), labels, matrix / utils.AMOUNT_SCALE
+
+    def mask(self, operation_type=None, category=None):
+        mask = np.ones(len(self), dtype=np.bool_)
+        if operation_type is not None:
+            mask &= self.types == OPERATION_TYPES.index(operation_type)
+        if category is not None:
+            if category not in self.names:
+                return np.zeros(len(self), dtype=np.bool_)
+            mask &= self.categories == self.names.index(category)
+        return mask
+
+    def top(self, n=10, operation_type=None, category=None):
+        # n крупнейших операций: [(id, категория, сумма)] по убыванию суммы
+        selected = np.flatnonzero(self.mask(operation_type, category))
+        if n <= 0 or not len(selected):
+            return []
+        amounts = self.amounts[selected]
+        if n < len(selected):
+            part = np.argpartition(amounts, -n)[-n:]
+            selected, amounts = selected[part], amounts[part]
+        order = np.argsort(-amounts, kind='stable')
+        return [(int(self.ids[pos]), self.names[self.categories[pos]], from_minor(int(self.amounts[pos])))
+                for pos in selected[order]]
+
+    def percentiles(self, q=(50, 90, 99), operation_type=None, category=None):
+        amounts = self.amounts[self.mask(operation_type, category)]
+        if not len(amounts):
+            return {}
+        return dict(zip(q, to_amounts(np.percentile(amounts, q))))
+
+
+class CategoryChart:
+    # График по категориям с постоянными осями и столбцами: при изменении сумм
+    # меняются только высоты и цвета, пересоздание - только при смене набора категорий
+    def __init__(self, figure, blit=False):
+        self.figure = figure
+        self.blit = blit
+        self.ax = figure.add_subplot(111)
+        self.ax.set_title('Распределение финансов по категориям')
+        self.ax.set_xlabel('Категории')
+        self.ax.set_ylabel('Сумма')
+        self.labels = []
+        self.bars = None
+        self.background = None
+        self.ylim = None
+        if blit:
+            figure.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def update(self, categories):
         labels = list(categories.keys())
         values = list(categories.values())
-        
-        ax.bar(labels, values, color=['green' if v > 0 else 'red' for v in values])
-        ax.set_title('Распределение финансов по категориям')
-        ax.set_xlabel('Категории')
-        ax.set_ylabel('Сумма')
-        
+        colors = ['green' if v > 0 else 'red' for v in values]
+
+        if labels != self.labels or self.bars is None:
+            self.rebuild(labels, values, colors)
+            self.figure.canvas.draw_idle()
+            return
+
+        for bar, value, color in zip(self.bars, values, colors):
+            bar.set_height(value)
+            bar.set_color(color)
+        self.fit_ylim(values)
+        self.redraw()
+
+    def rebuild(self, labels, values, colors):
+        if self.bars is not None:
+            self.bars.remove()
+        positions = range(len(labels))
+        self.bars = self.ax.bar(positions, values, color=colors, animated=self.blit)
+        self.ax.set_xticks(positions, labels)
+        self.ax.set_xlim(-0.5, len(labels) - 0.5)
+        self.labels = labels
+        self.fit_ylim(values, force=True)
+
+    def fit_ylim(self, values, force=False):
+        # Пересчёт пределов по значениям без relim(), который обходит все столбцы.
+        # Пределы меняются, только если данные вышли за них или заметно сжались
+        low = min(0, min(values, default=0))
+        high = max(0, max(values, default=0))
+        if low == high:
+            high = low + 1
+        current_low, current_high = self.ax.get_ylim()
+        if force or low < current_low or high > current_high or (high - low) * 2 < current_high - current_low:
+            pad = (high - low) * 0.05
+            self.ax.set_ylim(low - pad if low < 0 else low, high + pad if high > 0 else high)
+
+    @timed('analysis.chart_redraw')
+    def redraw(self):
+        # Блиттинг возможен, только если масштаб осей не изменился с последней полной отрисовки
+        canvas = self.figure.canvas
+        ylim = self.ax.get_ylim()
+        if not self.blit or self.background is None or ylim != self.ylim:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        for bar in self.bars:
+            self.ax.draw_artist(bar)
+        canvas.blit(self.ax.bbox)
+
+    def on_draw(self, event):
+        self.background = self.figure.canvas.copy_from_bbox(self.ax.bbox)
+        self.ylim = self.ax.get_ylim()
+        if self.bars is not None:
+            for bar in self.bars:
+                self.ax.draw_artist(bar)
+
+
+class Rollups:
+    # Предварительные суммы по (период, категория, тип) для дней, недель, месяцев и лет.
+    # Строятся один раз векторно по базе, затем обновляются слушателем на каждое
+    # добавление, изменение и удаление. Изменения копятся до ближайшего отчёта,
+    # отчёты обходят только периоды, не строки
+    def __init__(self, periods=PERIODS, rebuild_after=ROLLUP_REBUILD_AFTER):
+        self.periods = periods
+        self.rebuild_after = rebuild_after
+        self.db = None
+        self.clear()
+
+    def clear(self):
+        # cube[период][ключ][категория] и totals[период][ключ] - [доходы, расходы, число операций],
+        # суммы - целые младшие единицы
+        self.cube = {period: {} for period in self.periods}
+        self.totals = {period: {} for period in self.periods}
+        self.pending = []
+        self.stale = False
+
+    @timed('analysis.rollups_build')
+    def build(self, source):
+        self.clear()
+        engine = AnalyticsEngine.from_source(source)
+        width = len(engine.names) * len(OPERATION_TYPES)
+        cells = engine.categories * len(OPERATION_TYPES) + engine.types
+        for period in self.periods:
+            index, labels = engine.period_index(period)
+            keys = index * width + cells
+            sums = minor_sums(keys, engine.amounts, len(labels) * width).tolist()
+            counts = np.bincount(keys, minlength=len(labels) * width).tolist()
+            cube = self.cube[period]
+            totals = self.totals[period]
+            for key in [key for key, count in enumerate(counts) if count]:
+                label_index, cell = divmod(key, width)
+                category, operation_type = divmod(cell, len(OPERATION_TYPES))
+                label = labels[label_index]
+                entry = cube.setdefault(label, {}).setdefault(engine.names[category], [0, 0, 0])
+                total = totals.setdefault(label, [0, 0, 0])
+                column = 0 if operation_type == INCOME else 1
+                entry[column] += sums[key]
+                entry[2] += counts[key]
+                total[column] += sums[key]
+                total[2] += counts[key]
+
+    def attach(self, db):
+        self.build(db)
+        self.db = db
+        db.add_listener(self.on_change)
+
+    def detach(self):
+        if self.db is not None:
+            self.db.remove_listener(self.on_change)
+            self.db = None
+
+    def on_change(self, event, operation_id, old, new):
+        if event == 'reset':
+            self.clear()
+            self.stale = self.db is not None
+            return
+        if self.stale:
+            return
+        if event == 'import':
+            # Порция импорта (storage.ImportBatch): строки разворачиваются, только если
+            # их немного, иначе кубы перестраиваются при ближайшем отчёте
+            if len(self.pending) + len(new) > self.rebuild_after and self.db is not None:
+                self.pending = []
+                self.stale = True
+                return
+            self.pending.extend((None, new.row(pos)) for pos in range(len(new)))
+            return
+        self.pending.append((old, new))
+        if len(self.pending) > self.rebuild_after and self.db is not None:
+            self.pending = []
+            self.stale = True
+
+    @timed('analysis.rollups_refresh')
+    def refresh(self):
+        if self.stale:
+            self.build(self.db)
+            return
+        pending = self.pending
+        self.pending = []
+        for old, new in pending:
+            if old is not None:
+                self.account(old, -1)
+            if new is not None:
+                self.account(new, 1)
+
+    def account(self, row, sign):
+        column = 0 if row['operation_type'] == 'income' else 1
+        amount = to_minor(row['amount']) * sign
+        category = row['category']
+        for period in self.periods:
+            label = period_key(period, row['date'])
+            categories = self.cube[period].setdefault(label, {})
+            entry = categories.setdefault(category, [0, 0, 0])
+            entry[column] += amount
+            entry[2] += sign
+            if not entry[2]:
+                del categories[category]
+            total = self.totals[period].setdefault(label, [0, 0, 0])
+            total[column] += amount
+            total[2] += sign
+            if not total[2]:
+                del self.totals[period][label]
+                del self.cube[period][label]
+
+    def trend(self, period='month', start=None, end=None):
+        # [(период, доходы, расходы)] по возрастанию; start/end - метки периодов включительно
+        self.refresh()
+        return [(label, from_minor(income), from_minor(expense))
+                for label, (income, expense, count) in sorted(self.totals[period].items())
+                if (start is None or label >= start) and (end is None or label <= end)]
+
+    def category_totals(self, period, label):
+        # Суммы со знаком по категориям за один период
+        self.refresh()
+        return {category: from_minor(income - expense)
+                for category, (income, expense, count) in self.cube[period].get(label, {}).items()}
+
+    def category_matrix(self, period='month'):
+        # (категории, периоды, матрица сумм со знаком: строка на категорию, столбец на период)
+        self.refresh()
+        cube = self.cube[period]
+        labels = sorted(cube)
+        categories = {}
+        for label in labels:
+            for category in cube[label]:
+                categories.setdefault(category, len(categories))
+        matrix = [[0.0] * len(labels) for _ in categories]
+        for column, label in enumerate(labels):
+            for category, (income, expense, count) in cube[label].items():
+                matrix[categories[category]][column] = from_minor(income - expense)
+        return list(categories), labels, matrix
+
+
+class TrendChart:
+    # Доходы и расходы по периодам двумя линиями; линии живут между перерисовками
+    def __init__(self, figure):
+        self.figure = figure
+        self.ax = figure.add_subplot(111)
+        self.ax.set_ylabel('Сумма')
+        self.income, = self.ax.plot([], [], color='green', marker='o', label='Доходы')
+        self.expense, = self.ax.plot([], [], color='red', marker='o', label='Расходы')
+        self.ax.legend(loc='upper left')
+        self.ax.tick_params(axis='x', labelrotation=30)
+        self.labels = None
+
+    def update(self, trend, title):
+        labels = [label for label, income, expense in trend]
+        positions = range(len(labels))
+        self.income.set_data(positions, [income for label, income, expense in trend])
+        self.expense.set_data(positions, [expense for label, income, expense in trend])
+        if labels != self.labels:
+            # Подписи прореживаются, чтобы длинный ряд дней не слился в сплошную полосу
+            step = max(1, len(labels) // 8)
+            self.ax.set_xticks(positions[::step], labels[::step])
+            self.labels = labels
+        self.ax.set_title(title)
+        self.ax.set_xlim(-0.5, max(len(labels), 1) - 0.5)
+        self.ax.relim()
+        self.ax.autoscale_view(scalex=False)
+        self.figure.canvas.draw_idle()
+
+
+class Analysis:
+    def __init__(self):
+        self.chart = None
+
+    @timed('analysis.category_totals')
+    def category_totals(self, operations):
+        # База данных хранит суммы по категориям, пересчёт нужен только для произвольного списка
+        if hasattr(operations, 'get_category_totals'):
+            return operations.get_category_totals()
+        return AnalyticsEngine.from_source(operations).by_category()
+
+    @timed('analysis.plot_charts')
+    def plot_charts(self, operations, figure, blit=False):
+        if not isinstance(self.chart, CategoryChart) or self.chart.figure is not figure:
+            figure.clf()
+            self.chart = CategoryChart(figure, blit=blit)
+
+        self.chart.update(self.category_totals(operations))
+
+        return figure
+
+    @timed('analysis.plot_trend')
+    def plot_trend(self, rollups, period, figure, title=''):
+        if not isinstance(self.chart, TrendChart) or self.chart.figure is not figure:
+            figure.clf()
+            self.chart = TrendChart(figure)
+
+        self.chart.update(rollups.trend(period), title)
+
         return figure
@@ -0,0 +1,128 @@
+#generate.py - синтетическая база операций для замеров: одинаковая при одинаковом seed
+#
+#   python benchmarks/generate.py 1000000 /tmp/ledger.csv --seed 1
+#
+# Формат файла - по расширению (.csv, .json, .ndjson/.jsonl), как у экспорта программы
+
+import argparse
+import datetime
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import CSV_FIELDS, NDJSON_EXTENSIONS, write_csv, write_json, write_ndjson
+
+DEFAULT_SEED = 20240101
+DEFAULT_START = datetime.date(2015, 1, 1)
+DEFAULT_YEARS = 10
+
+# Расходы: категория -> (вес, медиана суммы, разброс логнормального распределения, комментарии).
+# Веса примерно как в выписке по карте: много мелких покупок, редкие крупные платежи
+EXPENSES = {
+    'Продукты': (30, 900, 0.8, ['Пятёрочка', 'Магнит', 'Перекрёсток', 'ВкусВилл', 'рынок', 'Лента, закупка на неделю']),
+    'Кафе': (12, 450, 0.6, ['кофе с собой', 'обед в столовой', 'Шоколадница', 'доставка пиццы', 'бизнес-ланч']),
+    'Транспорт': (14, 60, 0.5, ['метро', 'автобус', 'такси до вокзала', 'электричка', 'Тройка, пополнение']),
+    'Автомобиль': (4, 2500, 0.7, ['бензин АИ-95', 'мойка', 'парковка', 'шиномонтаж', 'ОСАГО']),
+    'ЖКХ': (3, 5200, 0.3, ['квартплата', 'электроэнергия', 'вывоз мусора', 'капремонт', 'водоснабжение']),
+    'Связь': (3, 550, 0.3, ['Мобилка', 'домашний интернет', 'мобильный интернет, доп. пакет']),
+    'Здоровье': (3, 1400, 0.9, ['аптека', 'стоматолог', 'анализы', 'витамины', 'приём терапевта']),
+    'Одежда': (3, 3200, 0.8, ['куртка', 'обувь', 'детские вещи', 'распродажа']),
+    'Развлечения': (4, 900, 0.8, ['кино', 'концерт', 'подписка на музыку', 'книги', 'театр']),
+    'Дом': (3, 1700, 1.0, ['хозтовары', 'ремонт смесителя', 'посуда', 'лампочки', 'мебель']),
+    'Подарки': (2, 2500, 0.8, ['день рождения', 'Новый год', 'цветы', 'свадьба друзей']),
+    'Образование': (1, 6000, 0.6, ['курсы английского', 'учебники', 'кружок для ребёнка']),
+    'Путешествия': (1, 18000, 0.9, ['билеты на поезд', 'гостиница', 'авиабилеты', 'экскурсия']),
+}
+# Доходы: категория -> (вес, медиана, разброс, комментарии)
+INCOMES = {
+    'Зарплата': (10, 65000, 0.2, ['зарплата за месяц', 'премия', 'зарплата']),
+    'Аванс': (8, 30000, 0.2, ['аванс']),
+    'Подработка': (3, 8000, 0.7, ['фриланс, перевод текста', 'репетиторство', 'консультация']),
+    'Кэшбэк': (4, 300, 0.8, ['кэшбэк по карте', 'бонусы']),
+    'Проценты': (2, 900, 0.5, ['проценты по вкладу', 'остаток на счёте']),
+    'Возврат': (1, 1500, 0.9, ['возврат товара', 'возврат налога']),
+}
+# Доля доходов среди операций
+INCOME_SHARE = 0.12
+# Доля комментариев с номером чека или заказа, как в банковских выписках
+NUMBERED_SHARE = 0.2
+GENERATE_CHUNK_SIZE = 10000
+
+
+class LedgerGenerator:
+    # Поток операций в порядке дат; при одном seed и count всегда один и тот же
+    def __init__(self, seed=DEFAULT_SEED, start=DEFAULT_START, years=DEFAULT_YEARS):
+        self.seed = seed
+        self.start = start.toordinal()
+        self.days = (datetime.date(start.year + years, start.month, start.day).toordinal() - self.start)
+        self.kinds = [self.table(EXPENSES, 'expense'), self.table(INCOMES, 'income')]
+
+    @staticmethod
+    def table(categories, operation_type):
+        names = list(categories)
+        weights = [categories[name][0] for name in names]
+        return operation_type, names, weights, categories
+
+    def rows(self, count):
+        # Даты равномерно покрывают период по возрастанию, без списка на count элементов.
+        # Категории выбираются порциями: rng.choices на порцию намного быстрее, чем на строку
+        rng = random.Random(self.seed)
+        date_text = {}
+        number = 0
+        while number < count:
+            size = min(GENERATE_CHUNK_SIZE, count - number)
+            incomes = sum(rng.random() < INCOME_SHARE for _ in range(size))
+            picked = [(kind, category) for kind in self.kinds
+                      for category in rng.choices(kind[1], kind[2], k=incomes if kind[0] == 'income' else size - incomes)]
+            rng.shuffle(picked)
+            for (operation_type, names, weights, categories), category in picked:
+                weight, median, spread, comments = categories[category]
+                comment = rng.choice(comments)
+                if rng.random() < NUMBERED_SHARE:
+                    comment = f"{comment}, чек {rng.randrange(1, 100000)}"
+                day = number * self.days // count
+                number += 1
+                text = date_text.get(day)
+                if text is None:
+                    text = date_text[day] = datetime.date.fromordinal(self.start + day).isoformat()
+                yield {
+                    'id': number,
+                    'amount': round(rng.lognormvariate(0, spread) * median, 2),
+                    'category': category,
+                    'date': text,
+                    'comment': comment,
+                    'operation_type': operation_type,
+                }
+
+
+def generate_rows(count, seed=DEFAULT_SEED, years=DEFAULT_YEARS):
+    return LedgerGenerator(seed, years=years).rows(count)
+
+
+def write_ledger(filename, count, seed=DEFAULT_SEED, years=DEFAULT_YEARS):
+    rows = generate_rows(count, seed, years)
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        write_csv(filename, (tuple(row[field] for field in CSV_FIELDS) for row in rows))
+    elif extension in NDJSON_EXTENSIONS:
+        write_ndjson(filename, rows)
+    else:
+        write_json(filename, rows, indent=None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетическая база операций")
+    parser.add_argument('count', type=int)
+    parser.add_argument('filename')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS)
+    args = parser.parse_args(argv)
+    write_ledger(args.filename, args.count, args.seed, args.years)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
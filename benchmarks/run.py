@@ -0,0 +1,241 @@
+#run.py - замеры основных операций на синтетической базе, результаты в JSON для сравнения коммитов
+#
+#   python benchmarks/run.py                                  # 10k и 100k строк
+#   python benchmarks/run.py --sizes 1000000 --output new.json
+#   python benchmarks/run.py --compare old.json --output new.json
+#
+# Для каждого размера база генерируется generate.py с одним и тем же seed,
+# каждый замер - лучшее время из --repeat повторов
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import islice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate import DEFAULT_SEED, write_ledger
+from models import Operation
+from storage import Database
+from utils import validate_date
+
+DEFAULT_SIZES = (10000, 100000)
+DEFAULT_REPEAT = 3
+# add_operation и проверка дат замеряются не больше чем на стольких строках
+ROW_LIMIT = 100000
+# Отношение новое/старое время, начиная с которого сравнение помечает замедление
+SLOWER_RATIO = 1.2
+FASTER_RATIO = 1 / SLOWER_RATIO
+# Пакетный импорт: база делится на столько выписок
+BULK_FILES = 10
+
+
+class Bench:
+    # Замеры одного размера базы: файлы импорта лежат во временной папке,
+    # база после импорта CSV общая для замеров, которые её не меняют
+    def __init__(self, size, seed, folder, repeat):
+        self.size = size
+        self.folder = folder
+        self.repeat = repeat
+        self.results = []
+        self.csv_path = self.path('ledger.csv')
+        self.json_path = self.path('ledger.json')
+        write_ledger(self.csv_path, size, seed)
+        write_ledger(self.json_path, size, seed)
+        self.bulk_folder = self.path('statements')
+        os.mkdir(self.bulk_folder)
+        for number in range(BULK_FILES):
+            write_ledger(os.path.join(self.bulk_folder, f"{number:02}.csv"), size // BULK_FILES, seed + number)
+        self.db = None
+
+    def path(self, name):
+        return os.path.join(self.folder, f"{self.size}-{name}")
+
+    def measure(self, case, function, rows=None, setup=None):
+        # function(состояние из setup) замеряется repeat раз, setup в замер не входит
+        best = None
+        value = None
+        for _ in range(self.repeat):
+            state = setup() if setup is not None else None
+            start = time.perf_counter()
+            value = function(state)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        rows = self.size if rows is None else rows
+        self.results.append({
+            'case': case,
+            'size': self.size,
+            'rows': rows,
+            'seconds': best,
+            'rows_per_second': rows / best if best else None,
+        })
+        print(f"{case:<24} {self.size:>10} {best * 1000:12.2f} мс", flush=True)
+        return value
+
+    def run(self):
+        self.bench_storage()
+        self.bench_queries()
+        self.bench_analysis()
+        self.bench_table()
+        return self.results
+
+    def bench_storage(self):
+        count = min(self.size, ROW_LIMIT)
+        operations = [Operation(100.0 + number % 1000, f"Категория {number % 20}", '2024-05-17',
+                                f"комментарий {number}", 'expense' if number % 8 else 'income')
+                      for number in range(count)]
+
+        def add(db):
+            for operation in operations:
+                db.add_operation(operation)
+        self.measure('add_operation', add, count, setup=Database)
+
+        def import_file(method, path):
+            def run(db):
+                if not method(db, path):
+                    raise Exception(f"Импорт {path} не удался")
+                return db
+            return run
+        self.db = self.measure('import_csv', import_file(Database.import_from_csv, self.csv_path), setup=Database)
+        self.measure('import_json', import_file(Database.import_from_json, self.json_path), setup=Database)
+
+        # Папка выписок: разбор в текущем процессе и в пуле процессов по числу ядер
+        from bulk_import import import_statements
+        rows = BULK_FILES * (self.size // BULK_FILES)
+        self.measure('bulk_import_serial', lambda db: import_statements(db, [self.bulk_folder], workers=1),
+                     rows, setup=Database)
+        self.measure('bulk_import_parallel', lambda db: import_statements(db, [self.bulk_folder]),
+                     rows, setup=Database)
+
+        for case, method, name in (('export_csv', Database.export_to_csv, 'export.csv'),
+                                   ('export_json', Database.export_to_json, 'export.json'),
+                                   ('export_snapshot', Database.export_to_snapshot, 'export.fpsnap')):
+            path = self.path(name)
+            self.measure(case, lambda state: method(self.db, path))
+
+        snapshot_path = self.path('export.fpsnap')
+        self.measure('load_snapshot', lambda db: db.load(snapshot_path), setup=Database)
+        self.measure('balance', lambda state: (self.db.get_balance(), self.db.get_type_totals()), rows=1)
+
+        # Снимок для фонового чтения и первая правка после него (копирование общих столбцов);
+        # правка записывает в строку те же значения, база для остальных замеров не меняется
+        self.measure('snapshot', lambda state: self.db.snapshot())
+        first = next(iter(self.db.operations))
+        self.measure('edit_after_snapshot',
+                     lambda state: self.db.update(first['id'], amount=first['amount'], comment=first['comment']),
+                     rows=1, setup=self.db.snapshot)
+
+    def bench_queries(self):
+        db = self.db
+        dates = [op['date'] for op in islice(db.operations, ROW_LIMIT)]
+        self.measure('validate_date', lambda state: all(map(validate_date, dates)), len(dates))
+        year = dates[len(dates) // 2][:4]
+        self.measure('query_year', lambda state: sum(1 for op in db.query(f"{year}-01-01", f"{year}-12-31")))
+        self.measure('search_index', lambda state: db.store.search_index(),
+                     setup=lambda: setattr(db.store, 'text_index', None))
+        self.measure('search', lambda state: len(db.search('продукты пятёр')))
+
+    def bench_analysis(self):
+        from analysis import AnalyticsEngine, Analysis, Rollups
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        db = self.db
+        rows = [op.to_dict() for op in db.operations]
+        # Analysis.plot_charts: суммы по категориям для произвольного списка операций и отрисовка
+        self.measure('category_totals', lambda state: Analysis().category_totals(rows))
+
+        def plot(figure):
+            Analysis().plot_charts(rows, figure)
+            figure.canvas.draw()
+        self.measure('plot_charts', plot, setup=lambda: FigureCanvasAgg(Figure(figsize=(5, 4), dpi=100)).figure)
+        self.measure('engine_by_month', lambda state: AnalyticsEngine.from_store(db.store).by_month())
+        self.measure('rollups_build', lambda rollups: rollups.build(db), setup=Rollups)
+
+    def bench_table(self):
+        # Первая порция таблицы: с экраном - настоящий FinPlannerApp.update_table,
+        # без экрана - только чтение строк и значения ячеек
+        import gui
+        db = self.db
+        if os.environ.get('DISPLAY') or sys.platform in ('win32', 'darwin'):
+            app = gui.FinPlannerApp(self.path('gui.json'))
+            while app.loading:
+                app.root.update()
+            app.db = db
+
+            def populate(state):
+                app.update_table()
+                app.root.update_idletasks()
+            self.measure('update_table', populate, gui.TABLE_PAGE_SIZE)
+            app.root.destroy()
+            return
+
+        def page(state):
+            rows = islice(db.get_all_operations().iter_after(None), gui.TABLE_PAGE_SIZE)
+            return [gui.FinPlannerApp.table_values(None, op) for op in rows]
+        self.measure('table_page', page, gui.TABLE_PAGE_SIZE)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(baseline, results):
+    # Таблица "было/стало" по совпадающим (замер, размер)
+    old = {(entry['case'], entry['size']): entry['seconds'] for entry in baseline['results']}
+    print(f"\nСравнение с {baseline.get('commit')} ({baseline.get('date')})")
+    for entry in results:
+        before = old.get((entry['case'], entry['size']))
+        if before is None:
+            continue
+        ratio = entry['seconds'] / before if before else float('inf')
+        mark = 'медленнее' if ratio >= SLOWER_RATIO else 'быстрее' if ratio <= FASTER_RATIO else ''
+        print(f"{entry['case']:<24} {entry['size']:>10} {before * 1000:12.2f} -> "
+              f"{entry['seconds'] * 1000:12.2f} мс  x{ratio:.2f} {mark}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры FinPlanner на синтетической базе")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="размеры базы через запятую, от 10000 до 10000000")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--output', help="файл JSON с результатами")
+    parser.add_argument('--compare', help="файл JSON прошлого запуска")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='finplanner-bench-') as folder:
+        for size in (int(size) for size in args.sizes.split(',')):
+            results.extend(Bench(size, args.seed, folder, args.repeat).run())
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            compare(json.load(file), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#startup.py - время запуска: импорт модулей окна и командной строки с разбивкой -X importtime
+#
+#   python benchmarks/startup.py            # замер и сравнение с бюджетом
+#   python benchmarks/startup.py --write    # замер и перезапись benchmarks/startup.txt
+#
+# Код завершения 1, если время импорта превышает бюджет: тяжёлый модуль снова
+# загружается при старте. Разбивка в startup.txt показывает, какой именно
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARTIFACT = os.path.join(ROOT, 'benchmarks', 'startup.txt')
+RUNS = 7
+# Сколько самых долгих модулей (по времени вместе с вложенными) показывать в разбивке
+TOP_MODULES = 15
+
+# Точка входа -> (код запуска, бюджет в мс на импорт без старта интерпретатора)
+ENTRY_POINTS = {
+    'gui': ("import gui", 150),
+    'cli': ("import cli", 60),
+}
+# Модули, которых не должно быть среди загруженных при старте
+FORBIDDEN = {
+    'gui': ('matplotlib', 'numpy', 'analysis'),
+    'cli': ('tkinter', 'matplotlib', 'numpy', 'analysis'),
+}
+
+
+def run(code, *options):
+    return subprocess.run([sys.executable, *options, '-c', code], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+
+
+def import_times(code):
+    # [(модуль, собственное время мкс, вместе с вложенными мкс)] в порядке загрузки
+    modules = []
+    for line in run(code, '-X', 'importtime').stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, total, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(own), int(total)))
+    return modules
+
+
+def wall_time(code):
+    # Лучшее время процесса целиком: интерпретатор плюс импорт
+    best = None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        run(code)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def measure():
+    baseline = wall_time("pass")
+    report = []
+    failures = []
+    for name, (code, budget) in ENTRY_POINTS.items():
+        modules = import_times(code)
+        imported = {module for module, own, total in modules}
+        top = [entry for entry in modules if entry[0] == code.split()[-1]]
+        import_ms = top[-1][2] / 1000 if top else 0.0
+        wall = wall_time(code)
+        report.append(f"[{name}] {code}")
+        report.append(f"  импорт: {import_ms:.1f} мс (бюджет {budget} мс), "
+                      f"процесс: {wall:.1f} мс, пустой интерпретатор: {baseline:.1f} мс")
+        for module, own, total in sorted(modules, key=lambda entry: -entry[2])[:TOP_MODULES]:
+            report.append(f"  {total / 1000:8.1f} {own / 1000:8.1f}  {module}")
+        if import_ms > budget:
+            failures.append(f"{name}: импорт {import_ms:.1f} мс больше бюджета {budget} мс")
+        loaded = [module for module in FORBIDDEN[name]
+                  if any(entry == module or entry.startswith(module + '.') for entry in imported)]
+        if loaded:
+            failures.append(f"{name}: при старте загружены {', '.join(loaded)}")
+        report.append('')
+    return report, failures
+
+
+def main(argv):
+    report, failures = measure()
+    text = "\n".join(["# Время запуска (python benchmarks/startup.py --write)",
+                      "# столбцы: мс вместе с вложенными, мс собственные, модуль", ""] + report)
+    print(text)
+    if '--write' in argv:
+        with open(ARTIFACT, 'w', encoding='utf-8') as file:
+            file.write(text + "\n")
+    for failure in failures:
+        print(f"Превышен бюджет запуска: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+#bulk_import.py - пакетный импорт выписок: много файлов или папка, разбор в параллельных процессах
+
+import os
+from models import ImportResult
+from storage import parse_file, IMPORT_CHUNK_SIZE, NDJSON_EXTENSIONS
+from instrumentation import timed, stats
+
+STATEMENT_EXTENSIONS = ('.csv', '.json') + NDJSON_EXTENSIONS
+# Меньше стольких байт на все файлы - разбор в текущем процессе: запуск пула и передача
+# порций обходятся дороже, чем разбор нескольких небольших выписок
+PARALLEL_MIN_BYTES = 4 << 20
+
+
+def expand_paths(paths):
+    # Файлы - в заданном порядке, содержимое папок (со вложенными) - по имени.
+    # Порядок файлов определяет порядок строк и выдачу id, поэтому он не зависит от ФС
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        found = []
+        for folder, subfolders, names in os.walk(path):
+            subfolders.sort()
+            found.extend(os.path.join(folder, name) for name in names
+                         if name.lower().endswith(STATEMENT_EXTENSIONS))
+        files.extend(sorted(found))
+    return files
+
+
+def parse_statement(filename, chunk_size=IMPORT_CHUNK_SIZE):
+    # Выполняется в процессе пула: разбор и проверка файла целиком, в родительский
+    # процесс возвращаются готовые порции (ImportBatch) и итог с ошибочными строками
+    result = ImportResult(filename)
+    try:
+        batches = list(parse_file(filename, result, chunk_size))
+    except Exception as e:
+        batches = []
+        result.message = str(e)
+    return batches, result
+
+
+def total_size(filenames):
+    size = 0
+    for filename in filenames:
+        try:
+            size += os.path.getsize(filename)
+        except OSError:
+            pass
+    return size
+
+
+def parse_statements(filenames, workers=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None, mp_context=None):
+    # Итератор (порции, итог) по файлам в исходном порядке, независимо от того, какой
+    # процесс закончил раньше: следующий файл добавляется в базу, пока остальные разбираются.
+    # progress(разобрано файлов, всего) вызывается по мере готовности
+    workers = min(workers or os.cpu_count() or 1, len(filenames))
+    total = len(filenames)
+    if workers <= 1 or total_size(filenames) < PARALLEL_MIN_BYTES:
+        for done, filename in enumerate(filenames, 1):
+            parsed = parse_statement(filename, chunk_size)
+            if progress is not None:
+                progress(done, total)
+            yield parsed
+        return
+    # multiprocessing загружается только для параллельного разбора: это десятки мс при запуске
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        futures = [executor.submit(parse_statement, filename, chunk_size) for filename in filenames]
+        try:
+            for done, future in enumerate(futures, 1):
+                parsed = future.result()
+                if progress is not None:
+                    progress(done, total)
+                yield parsed
+        finally:
+            # Прерванный обход (ошибка, отмена) не ждёт разбора оставшихся файлов
+            for future in futures:
+                future.cancel()
+
+
+@timed('bulk.import_statements')
+def import_statements(db, paths, workers=None, strict=False, chunk_size=IMPORT_CHUNK_SIZE, progress=None,
+                      duplicates='keep'):
+    # Каждый файл добавляется целиком или не добавляется (как при импорте одного файла),
+    # id выдаются по порядку файлов и строк - как при последовательном импорте тех же файлов.
+    # Повторы ищутся по базе вместе с уже добавленными файлами: пересекающиеся выписки
+    # одного счёта за соседние периоды не задваивают общие операции
+    results = []
+    for batches, result in parse_statements(expand_paths(paths), workers, chunk_size, progress):
+        results.append(apply_statement(db, batches, result, strict, duplicates))
+    return results
+
+
+def apply_statement(db, batches, result, strict=False, duplicates='keep'):
+    if result.message:
+        # Файл не прочитан (нет файла, испорченный JSON): в базу ничего не добавляется
+        print(f"Ошибка при импорте {result.filename}: {result.message}")
+        return result
+    db.import_batches(batches, result, strict, duplicates)
+    stats.count('bulk.files')
+    return result
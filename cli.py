@@ -0,0 +1,250 @@
+#cli.py - командная строка без графического интерфейса: python -m finplanner <команда>
+
+import argparse
+import json
+import os
+import sys
+from contextlib import contextmanager, redirect_stdout
+from storage import Database, build_batches, extract_fields, parse_file, SNAPSHOT_EXTENSIONS, DUPLICATE_POLICIES
+from models import ImportResult
+from instrumentation import stats
+from utils import set_amount_digits, to_minor, from_minor, format_amount, MAX_AMOUNT_DIGITS
+
+# Коды завершения: 2 - ошибка в аргументах (так завершается argparse)
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+# Импорт прошёл, но часть строк файла отклонена
+EXIT_PARTIAL = 3
+
+REPORT_PERIODS = ('day', 'week', 'month', 'year', 'category')
+# Журнал базы и журнал прерванного уплотнения рядом со снимком (journal.Journal)
+LEDGER_JOURNALS = ('.journal', '.journal.1')
+
+
+def is_sqlite_path(path):
+    # sqlite3 импортируется только для баз .db/.sqlite
+    from sqlite_storage import is_sqlite_path
+    return is_sqlite_path(path)
+
+
+class Ledger:
+    # База, с которой работает команда: файл SQLite или снимок с журналом, как в окне программы.
+    # Закрывается после команды: журнал сбрасывается на диск, фоновое уплотнение дожидается
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.journal = None
+
+    def __enter__(self):
+        if is_sqlite_path(self.path):
+            from sqlite_storage import SQLiteDatabase
+            self.db = SQLiteDatabase(self.path)
+        else:
+            from journal import Journal
+            self.db = Database()
+            self.journal = Journal(self.db, self.path)
+            if not self.journal.open():
+                raise Exception(f"Не удалось открыть {self.path}")
+        return self.db
+
+    def __exit__(self, *exc_info):
+        if self.journal is not None:
+            self.journal.maybe_compact()
+            if self.journal.compaction is not None:
+                self.journal.compaction.join()
+            self.journal.close()
+        elif self.db is not None:
+            self.db.close()
+
+
+def is_ledger_path(path):
+    # База программы со своим журналом (data.json и data.json.journal): читается через Ledger,
+    # иначе правки после последнего снимка потерялись бы
+    return any(os.path.exists(path + suffix) for suffix in LEDGER_JOURNALS)
+
+
+@contextmanager
+def open_source(path):
+    # Исходный файл конвертации: база SQLite, база с журналом, двоичный снимок
+    # или файл импорта (id нумеруются заново)
+    if is_sqlite_path(path) or is_ledger_path(path):
+        with Ledger(path) as db:
+            yield db
+        return
+    db = Database()
+    if path.lower().endswith(SNAPSHOT_EXTENSIONS):
+        if not db.load(path):
+            raise Exception(f"Не удалось прочитать {path}")
+    else:
+        result = ImportResult(path)
+        db.import_batches(parse_file(path, result), result)
+        if not result:
+            raise Exception(result.summary())
+    yield db
+
+
+def import_files(db, paths, strict=False, workers=None, duplicates='merge'):
+    # Каждый файл принимается целиком или не принимается; итог - по каждому файлу.
+    # Папки раскрываются, файлы разбираются параллельно в процессах (bulk_import.py)
+    from bulk_import import import_statements
+    results = import_statements(db, paths, workers, strict, duplicates=duplicates)
+    if not results:
+        print("Не найдено файлов для импорта")
+        return EXIT_ERROR
+    code = EXIT_OK
+    for result in results:
+        print(f"{result.filename}:\n{result.summary()}")
+        if not result:
+            code = EXIT_ERROR
+        elif result.errors and code == EXIT_OK:
+            code = EXIT_PARTIAL
+    return code
+
+
+def write_table(out, header, rows, as_json=False):
+    if as_json:
+        json.dump([dict(zip(header, row)) for row in rows], out, ensure_ascii=False, indent=2)
+        out.write('\n')
+        return
+    out.write('\t'.join(header) + '\n')
+    for row in rows:
+        out.write('\t'.join(format_amount(value) if isinstance(value, float) else str(value)
+                            for value in row) + '\n')
+
+
+def command_import(args, out):
+    with Ledger(args.data) as db:
+        return import_files(db, args.files, args.strict, args.jobs, args.duplicates)
+
+
+def command_export(args, out):
+    with Ledger(args.data) as db:
+        if not db.export(args.file):
+            return EXIT_ERROR
+        print(f"Экспортировано операций: {len(db.operations)} в {args.file}")
+    return EXIT_OK
+
+
+def command_balance(args, out):
+    with Ledger(args.data) as db:
+        if args.start is None and args.end is None and args.category is None:
+            totals = db.get_type_totals()
+            income, expense = totals['income'], totals['expense']
+        else:
+            # Суммирование в младших единицах: без накопления ошибки float
+            totals = {'income': 0, 'expense': 0}
+            for row in db.query(args.start, args.end, args.category):
+                totals[row['operation_type']] += to_minor(row['amount'])
+            income, expense = from_minor(totals['income']), from_minor(totals['expense'])
+    write_table(out, ('income', 'expense', 'balance'), [(income, expense, income - expense)], args.json)
+    return EXIT_OK
+
+
+def command_report(args, out):
+    with Ledger(args.data) as db:
+        if args.period == 'category':
+            rows = list(db.get_category_totals().items())
+            header = ('category', 'total')
+        else:
+            # numpy нужен только отчётам по периодам
+            from analysis import Rollups
+            rollups = Rollups(periods=(args.period,))
+            rollups.build(db)
+            rows = [(label, income, expense, income - expense)
+                    for label, income, expense in rollups.trend(args.period, args.start, args.end)]
+            header = ('period', 'income', 'expense', 'balance')
+    write_table(out, header, rows, args.json)
+    return EXIT_OK
+
+
+def command_convert(args, out):
+    with open_source(args.source) as source:
+        if is_sqlite_path(args.target):
+            from sqlite_storage import SQLiteDatabase
+            target = SQLiteDatabase(args.target)
+            try:
+                result = ImportResult(args.source)
+                records = enumerate(source.iter_rows(), 1)
+                target.import_batches(build_batches(records, extract_fields, result), result, strict=True)
+            finally:
+                target.close()
+            if not result:
+                return EXIT_ERROR
+        elif not source.export(args.target):
+            return EXIT_ERROR
+    print(f"{args.source} -> {args.target}")
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='finplanner', description="Финансовый планировщик без окна")
+    parser.add_argument('-d', '--data', default='data.json',
+                        help="файл базы: data.json (снимок с журналом), .fpsnap или .db/.sqlite")
+    parser.add_argument('--stats', metavar='FILE', help="записать замеры времени и счётчики в JSON")
+    parser.add_argument('--profile', metavar='FILE', help="записать профиль cProfile (.prof) всей команды")
+    parser.add_argument('--amount-digits', type=int, choices=range(MAX_AMOUNT_DIGITS + 1), metavar='N',
+                        help="знаков после запятой в суммах (по умолчанию 2, копейки)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('import', help="импорт файлов CSV, JSON, NDJSON или папок с ними в базу")
+    command.add_argument('files', nargs='+')
+    command.add_argument('-j', '--jobs', type=int, help="процессов разбора (по умолчанию - число ядер)")
+    command.add_argument('--strict', action='store_true', help="отменить файл при любой ошибочной строке")
+    command.add_argument('--duplicates', choices=DUPLICATE_POLICIES, default='merge',
+                         help="строки, совпадающие с операциями базы: merge - пропустить столько, "
+                              "сколько их уже есть, skip - пропустить все, keep - добавить")
+    command.set_defaults(handler=command_import)
+
+    command = commands.add_parser('export', help="экспорт базы; формат по расширению файла")
+    command.add_argument('file')
+    command.set_defaults(handler=command_export)
+
+    command = commands.add_parser('balance', help="доходы, расходы и баланс")
+    command.add_argument('--start', help="с даты ГГГГ-ММ-ДД включительно")
+    command.add_argument('--end', help="по дату ГГГГ-ММ-ДД включительно")
+    command.add_argument('--category')
+    command.add_argument('--json', action='store_true')
+    command.set_defaults(handler=command_balance)
+
+    command = commands.add_parser('report', help="доходы и расходы по периодам или суммы по категориям")
+    command.add_argument('--period', choices=REPORT_PERIODS, default='month')
+    command.add_argument('--start', help="с метки периода включительно, например 2024-01")
+    command.add_argument('--end', help="по метку периода включительно")
+    command.add_argument('--json', action='store_true')
+    command.set_defaults(handler=command_report)
+
+    command = commands.add_parser('convert', help="перевод файла из формата в формат без открытия базы")
+    command.add_argument('source')
+    command.add_argument('target')
+    command.set_defaults(handler=command_convert)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+    if args.amount_digits is not None:
+        set_amount_digits(args.amount_digits)
+    if args.stats:
+        stats.enabled = True
+    if args.profile:
+        stats.start_profile()
+    # Сообщения хранилища ("Ошибка при ...") уходят в stderr, в stdout - только результат команды
+    with redirect_stdout(sys.stderr):
+        try:
+            return args.handler(args, out)
+        except KeyboardInterrupt:
+            return EXIT_ERROR
+        except Exception as e:
+            print(f"Ошибка: {str(e)}")
+            return EXIT_ERROR
+        finally:
+            if args.profile:
+                stats.stop_profile(args.profile)
+            if args.stats:
+                stats.dump(args.stats)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
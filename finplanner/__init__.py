@@ -0,0 +1 @@
+#finplanner - запуск без окна: python -m finplanner <команда>
@@ -0,0 +1,6 @@
+#__main__.py - точка входа python -m finplanner
+
+import sys
+from cli import main
+
+sys.exit(main())
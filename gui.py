@@ -1,31 +1,161 @@
 #gui.py - графический интерфейс
 
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.pyplot as plt
-import datetime
-from storage import Database
-from models import Operation
-from analysis import Analysis
-from utils import validate_date
+from itertools import islice
+from storage import Database, parse_csv, parse_file, DUPLICATE_POLICIES
+from models import Operation, ImportResult
+from tasks import TaskRunner
+from bulk_import import expand_paths, parse_statements, apply_statement
+from journal import Journal
+from sqlite_storage import SQLiteDatabase, is_sqlite_path
+from utils import validate_date, to_minor, from_minor, format_amount
+from instrumentation import timed, span, error, stats
+
+# Таблица заполняется порциями: видимое окно плюс запас, остальное - при прокрутке
+TABLE_PAGE_SIZE = 100
+TABLE_PRELOAD_THRESHOLD = 0.9
+# Поиск запускается, когда ввод в поле поиска затих на столько миллисекунд
+SEARCH_DELAY_MS = 150
+# Окно диагностики обновляет таблицу замеров с этим интервалом
+DIAGNOSTICS_REFRESH_MS = 1000
+# Размер области графика; matplotlib и numpy загружаются при первом построении графика
+CHART_SIZE = (5, 4)
+CHART_DPI = 100
+
+# Виды графика: None - суммы по категориям, иначе доходы и расходы по периодам
+CHART_VIEWS = {
+    "По категориям": None,
+    "По дням": 'day',
+    "По неделям": 'week',
+    "По месяцам": 'month',
+    "По годам": 'year',
+}
 
 class FinPlannerApp:
-    def __init__(self):
+    def __init__(self, ledger_path="data.json"):
         self.root = tk.Tk()
         self.root.title("Финансовый планировщик")
-        self.db = Database()
+        # Файл .db/.sqlite открывается как база SQLite, иначе - снимок JSON с журналом
+        if is_sqlite_path(ledger_path):
+            self.db = SQLiteDatabase(ledger_path)
+        else:
+            self.db = Database()
+        self.tasks = TaskRunner(self.root)
         self.create_widgets()
-        self.figure = plt.Figure(figsize=(5, 4), dpi=100)
-        self.canvas = FigureCanvasTkAgg(self.figure, master=self.root)
-        self.canvas.get_tk_widget().pack(side=tk.BOTTOM, fill=tk.BOTH, expand=True)
+        self.balance_label = ttk.Label(self.root)
+        self.balance_label.pack(pady=10)
+        self.update_balance()
+        # График, анализ и суммы по периодам создаются при первом построении графика
+        self.figure = None
+        self.canvas = None
+        self.analysis = None
+        self.rollups = None
+
+        # Изменения помечают части окна устаревшими, перерисовка - один раз в простое
+        self.dirty = set()
+        self.refresh_pending = False
+
+        # Данные прошлых сессий: снимок и журнал изменений после него (SQLite хранит всё сам).
+        # Они читаются в фоне, окно появляется сразу
+        self.journal = None
+        self.loading = False
+        # Снимок или журнал не прочитаны: правки некуда записать, изменение базы отключено
+        self.load_failed = False
+        self.importing = False
+        if isinstance(self.db, Database):
+            self.load_ledger(ledger_path)
+        self.schedule_refresh('table', 'balance', 'chart')
+
+    def load_ledger(self, ledger_path):
+        # Снимок и журнал загружаются в отдельную базу, которая подменяет пустую по готовности;
+        # до этого добавление, изменение и удаление операций недоступны
+        @timed('gui.load')
+        def job(task):
+            db = Database()
+            journal = Journal(db, ledger_path)
+            if not journal.open():
+                raise Exception(f"Не удалось прочитать {ledger_path}")
+            return db, journal
+
+        self.loading = True
+        task = self.tasks.submit(
+            "Загрузка данных",
+            job,
+            self.finish_loading,
+            on_error=self.fail_loading,
+            on_finish=self.finish_task
+        )
+        self.task_label.config(text=task.title)
+
+    def finish_loading(self, loaded):
+        self.db, self.journal = loaded
+        self.loading = False
+        if self.rollups is not None:
+            self.rollups.detach()
+            self.rollups.attach(self.db)
+        self.schedule_refresh('table', 'balance', 'chart')
+
+    def fail_loading(self, error):
+        # Новый журнал поверх нечитаемого снимка при уплотнении заменил бы его пустой базой,
+        # поэтому база остаётся только для просмотра до перезапуска
+        self.loading = False
+        self.load_failed = True
+        messagebox.showwarning("Предупреждение", f"Не удалось загрузить сохранённые данные: {str(error)}\n"
+                                                 "Изменения не будут сохранены, поэтому правка отключена")
+
+    def check_loaded(self):
+        if self.loading:
+            messagebox.showwarning("Предупреждение", "Дождитесь загрузки данных")
+            return False
+        if self.load_failed:
+            messagebox.showwarning("Предупреждение", "Сохранённые данные не загружены, правка отключена")
+            return False
+        if self.importing:
+            # Импорт идёт в копии базы, которая затем подменит базу: правка сейчас потерялась бы
+            messagebox.showwarning("Предупреждение", "Дождитесь завершения импорта")
+            return False
+        return True
 
     def create_widgets(self):
         main_frame = ttk.Frame(self.root)
         main_frame.pack(fill=tk.BOTH, expand=True)
 
-        self.tree = ttk.Treeview(main_frame, columns=("ID", "Сумма", "Категория", "Дата", "Тип", "Комментарий"), show="headings")
-        self.tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        filter_frame = ttk.Frame(main_frame)
+        filter_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+
+        ttk.Label(filter_frame, text="Период с:").pack(side=tk.LEFT, padx=5)
+        self.filter_start_entry = ttk.Entry(filter_frame, width=12)
+        self.filter_start_entry.pack(side=tk.LEFT)
+        ttk.Label(filter_frame, text="по:").pack(side=tk.LEFT, padx=5)
+        self.filter_end_entry = ttk.Entry(filter_frame, width=12)
+        self.filter_end_entry.pack(side=tk.LEFT)
+        ttk.Button(filter_frame, text="Показать", command=self.apply_date_filter).pack(side=tk.LEFT, padx=5)
+        ttk.Button(filter_frame, text="Сбросить", command=self.reset_date_filter).pack(side=tk.LEFT, padx=5)
+        # (начало, конец) периода таблицы; None - вся база
+        self.table_filter = None
+
+        ttk.Label(filter_frame, text="Поиск:").pack(side=tk.LEFT, padx=5)
+        self.search_entry = ttk.Entry(filter_frame, width=24)
+        self.search_entry.pack(side=tk.LEFT)
+        self.search_entry.bind("<KeyRelease>", self.on_search_key)
+        self.table_search = None
+        self.search_pending = None
+
+        table_frame = ttk.Frame(main_frame)
+        table_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+        self.tree = ttk.Treeview(table_frame, columns=("ID", "Сумма", "Категория", "Дата", "Тип", "Комментарий"), show="headings")
+        self.tree_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_table_scroll)
+        self.tree_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.table_source = None
+        self.table_cursor = None
+        self.table_exhausted = True
+        self.table_loading = False
 
         self.tree.heading("ID", text="ID")
         self.tree.heading("Сумма", text="Сумма")
@@ -44,8 +174,37 @@ class FinPlannerApp:
         ttk.Button(button_frame, text="Экспорт JSON", command=self.export_to_json).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Импорт CSV", command=self.import_from_csv).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Импорт JSON", command=self.import_from_json).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Импорт выписок", command=self.import_statements).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Импорт папки", command=self.import_folder).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Диагностика", command=self.diagnostics_window).pack(side=tk.LEFT, padx=5)
+
+        self.chart_view = tk.StringVar(value=next(iter(CHART_VIEWS)))
+        chart_view_box = ttk.Combobox(button_frame, textvariable=self.chart_view, values=list(CHART_VIEWS),
+                                      state="readonly", width=14)
+        chart_view_box.pack(side=tk.RIGHT, padx=5)
+        chart_view_box.bind("<<ComboboxSelected>>", lambda event: self.schedule_refresh('chart'))
+        ttk.Label(button_frame, text="График:").pack(side=tk.RIGHT)
+
+        # Повторы при импорте: merge - пропускать строки, уже учтённые в базе (пересекающиеся
+        # выписки), skip - пропускать все совпадения, keep - добавлять всё как есть
+        self.duplicate_policy = tk.StringVar(value='merge')
+        ttk.Combobox(button_frame, textvariable=self.duplicate_policy, values=list(DUPLICATE_POLICIES),
+                     state="readonly", width=6).pack(side=tk.RIGHT, padx=5)
+        ttk.Label(button_frame, text="Повторы:").pack(side=tk.RIGHT)
+
+        status_frame = ttk.Frame(main_frame)
+        status_frame.pack(side=tk.TOP, fill=tk.X, padx=5)
+
+        self.task_label = ttk.Label(status_frame, text="")
+        self.task_label.pack(side=tk.LEFT, padx=5)
+        self.task_progress = ttk.Progressbar(status_frame, mode='determinate', maximum=100)
+        self.task_progress.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.task_cancel_button = ttk.Button(status_frame, text="Отмена", command=self.tasks.cancel, state=tk.DISABLED)
+        self.task_cancel_button.pack(side=tk.LEFT, padx=5)
 
     def add_operation_window(self):
+        if not self.check_loaded():
+            return
         try:
             add_window = tk.Toplevel(self.root)
             add_window.title("Добавить операцию")
@@ -73,7 +232,8 @@ class FinPlannerApp:
 
             def confirm_add():
                 try:
-                    amount = float(amount_entry.get())
+                    # Введённый текст разбирается как десятичная запись, лишние знаки округляются
+                    amount = from_minor(to_minor(amount_entry.get()))
                     category = category_entry.get().strip()
                     date = date_entry.get()
                     comment = comment_entry.get()
@@ -92,10 +252,10 @@ class FinPlannerApp:
                         operation_type=operation_type.get()
                     )
                     
-                    if self.db.add_operation(operation):
-                        self.update_table()
-                        self.update_balance()
-                        self.plot_charts(self.db.get_all_operations())
+                    operation_id = self.db.add_operation(operation)
+                    if operation_id:
+                        self.table_insert(operation_id)
+                        self.schedule_refresh('balance', 'chart')
                         add_window.destroy()
                 except Exception as e:
                     messagebox.showerror("Ошибка", f"Не удалось добавить операцию: {str(e)}")
@@ -106,73 +266,299 @@ class FinPlannerApp:
             messagebox.showerror("Ошибка", f"Не удалось открыть окно добавления: {str(e)}")
 
     def validate_date(self, date_text):
-        try:
-            if date_text != datetime.datetime.strptime(date_text, "%Y-%m-%d").strftime('%Y-%m-%d'):
-                raise ValueError
-            return True
-        except ValueError:
-            return False
+        return validate_date(date_text)
 
+    def table_values(self, op):
+        return (
+            op['id'], 
+            format_amount(op['amount']),
+            op['category'], 
+            op['date'], 
+            op['operation_type'], 
+            op['comment']
+        )
+
+    @timed('gui.update_table')
     def update_table(self, operations=None):
         try:
-            for row in self.tree.get_children():
-                self.tree.delete(row)
-                
+            self.tree.delete(*self.tree.get_children())
+
+            # Без явного списка показываем всю базу (или выборку за период, если задан фильтр):
+            # курсор - id последней загруженной строки. Произвольный список обходится одним итератором
+            if operations is None and self.table_search is not None:
+                operations = self.db.search(self.table_search)
+                if self.table_filter is not None:
+                    start, end = self.table_filter
+                    operations = (op for op in operations
+                                  if (start is None or op['date'] >= start) and (end is None or op['date'] <= end))
+            elif operations is None and self.table_filter is not None:
+                operations = self.db.query(*self.table_filter)
             if operations is None:
-                operations = self.db.get_all_operations()
-                
-            for op in operations:
-                                self.tree.insert("", "end", iid=str(op['id']), values=(
-                    op['id'], 
-                    op['amount'], 
-                    op['category'], 
-                    op['date'], 
-                    op['operation_type'], 
-                    op['comment']
-                ))
+                self.table_source = None
+                self.table_cursor = None
+            else:
+                self.table_source = iter(operations)
+            self.table_exhausted = False
+            self.load_table_page()
         except Exception as e:
+            error('gui.update_table', e)
             messagebox.showerror("Ошибка", f"Не удалось обновить таблицу: {str(e)}")
 
-    def plot_charts(self, operations):
+    @timed('gui.table_page')
+    def load_table_page(self):
+        self.table_loading = False
+        if self.table_exhausted:
+            return
+        if self.table_source is None:
+            rows = islice(self.db.get_all_operations().iter_after(self.table_cursor), TABLE_PAGE_SIZE)
+        else:
+            rows = islice(self.table_source, TABLE_PAGE_SIZE)
+
+        loaded = 0
+        for op in rows:
+            self.table_cursor = op['id']
+            loaded += 1
+            iid = str(op['id'])
+            # Строка могла попасть в таблицу раньше (добавлена, пока порция дочитывалась)
+            if not self.tree.exists(iid):
+                self.tree.insert("", "end", iid=iid, values=self.table_values(op))
+        stats.count('gui.table_rows', loaded)
+        if loaded < TABLE_PAGE_SIZE:
+            self.table_exhausted = True
+
+    def apply_date_filter(self):
         try:
-            self.figure.clf()
-            ax = self.figure.add_subplot(111)
-            
-            categories = {}
-            for op in operations:
-                if op['operation_type'] == 'expense':
-                    if op['category'] not in categories:
-                        categories[op['category']] = 0
-                    categories[op['category']] -= op['amount']
-                else:
-                    if op['category'] not in categories:
-                        categories[op['category']] = 0
-                    categories[op['category']] += op['amount']
-            
-            labels = list(categories.keys())
-            values = list(categories.values())
-            
-            ax.bar(labels, values, color=['green' if v > 0 else 'red' for v in values])
-            ax.set_title('Распределение финансов по категориям')
-            ax.set_xlabel('Категории')
-            ax.set_ylabel('Сумма')
-            
-            self.canvas.draw()
+            # Пустое поле - открытая граница периода
+            start = self.filter_start_entry.get().strip() or None
+            end = self.filter_end_entry.get().strip() or None
+            for date in (start, end):
+                if date is not None and not self.validate_date(date):
+                    raise ValueError(f"Неверный формат даты: {date}")
+            self.table_filter = None if start is None and end is None else (start, end)
+            self.update_table()
         except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось применить фильтр: {str(e)}")
+
+    def on_search_key(self, event):
+        # Поиск по индексу, а не по таблице; запрос отправляется после паузы в наборе
+        if self.search_pending is not None:
+            self.root.after_cancel(self.search_pending)
+        self.search_pending = self.root.after(SEARCH_DELAY_MS, self.apply_search)
+
+    def apply_search(self):
+        self.search_pending = None
+        text = self.search_entry.get().strip()
+        search = text or None
+        if search != self.table_search:
+            self.table_search = search
+            self.update_table()
+
+    def reset_date_filter(self):
+        self.filter_start_entry.delete(0, tk.END)
+        self.filter_end_entry.delete(0, tk.END)
+        self.table_filter = None
+        self.update_table()
+
+    def on_table_scroll(self, first, last):
+        self.tree_scrollbar.set(first, last)
+        if not self.table_exhausted and not self.table_loading and float(last) >= TABLE_PRELOAD_THRESHOLD:
+            self.table_loading = True
+            self.root.after_idle(self.load_table_page)
+
+    def table_insert(self, operation_id):
+        # Новая строка базы: если таблица дочитана до конца, дописываем её сразу,
+        # иначе она придёт со следующей порцией
+        if self.table_source is not None:
+            self.update_table()
+            return
+        if self.table_exhausted:
+            op = self.db.get(operation_id)
+            self.tree.insert("", "end", iid=str(operation_id), values=self.table_values(op))
+            self.table_cursor = operation_id
+
+    def table_update(self, operation_id):
+        iid = str(operation_id)
+        if self.tree.exists(iid):
+            self.tree.item(iid, values=self.table_values(self.db.get(operation_id)))
+
+    def table_delete(self, operation_id):
+        iid = str(operation_id)
+        if not self.tree.exists(iid):
+            return
+        # Курсор всегда указывает на живую строку, чтобы следующая порция нашлась по индексу
+        if self.table_source is None and self.table_cursor == operation_id:
+            prev = self.tree.prev(iid)
+            self.table_cursor = self.tree.item(prev)['values'][0] if prev else None
+        self.tree.delete(iid)
+
+    def create_chart(self):
+        # Figure без pyplot: модуль pyplot и его менеджер окон приложению не нужны
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from analysis import Analysis
+        self.analysis = Analysis()
+        self.figure = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.root)
+        # Полная отрисовка холста выполняется отложенно, из draw_idle; замеряется сама отрисовка
+        self.canvas.draw = timed('gui.canvas_draw')(self.canvas.draw)
+        self.canvas.get_tk_widget().pack(side=tk.BOTTOM, fill=tk.BOTH, expand=True, before=self.balance_label)
+
+    @timed('gui.plot_charts')
+    def plot_charts(self, operations=None):
+        try:
+            # Пока данных нет, график не создаётся вовсе
+            if self.figure is None:
+                if not len(self.db.operations if operations is None else operations):
+                    return
+                self.create_chart()
+            # Графики по периодам строятся из сумм Rollups, без обхода операций
+            period = CHART_VIEWS[self.chart_view.get()]
+            if operations is None and period is not None:
+                if self.rollups is None:
+                    # Суммы строятся по текущей базе и дальше следят за её изменениями
+                    from analysis import Rollups
+                    self.rollups = Rollups()
+                    self.rollups.attach(self.db)
+                self.analysis.plot_trend(self.rollups, period, self.figure,
+                                         f"Доходы и расходы: {self.chart_view.get().lower()}")
+                return
+            # Без явного списка берём готовые суммы по категориям из базы
+            if operations is None:
+                operations = self.db
+            self.analysis.plot_charts(operations, self.figure)
+        except Exception as e:
+            error('gui.plot_charts', e)
             messagebox.showerror("Ошибка", f"Не удалось построить график: {str(e)}")
 
+    @timed('gui.update_balance')
     def update_balance(self):
         try:
-            operations = self.db.get_all_operations()
-            income = sum(op['amount'] for op in operations if op['operation_type'] == 'income')
-            expense = sum(op['amount'] for op in operations if op['operation_type'] == 'expense')
-            balance = income - expense
-            
-            self.balance_label = ttk.Label(self.root, text=f"Баланс: {balance}")
-            self.balance_label.pack(pady=10)
+            balance = self.db.get_balance()
+            self.balance_label.config(text=f"Баланс: {format_amount(balance)}")
         except Exception as e:
+            error('gui.update_balance', e)
             messagebox.showerror("Ошибка", f"Не удалось обновить баланс: {str(e)}")
 
+    def schedule_refresh(self, *parts):
+        self.dirty.update(parts)
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            self.root.after_idle(self.flush_refresh)
+
+    @timed('gui.refresh')
+    def flush_refresh(self):
+        dirty = self.dirty
+        self.dirty = set()
+        self.refresh_pending = False
+        if 'table' in dirty:
+            self.update_table()
+        if 'balance' in dirty:
+            self.update_balance()
+        if 'chart' in dirty:
+            self.plot_charts()
+        if self.journal is not None:
+            self.journal.flush()
+            self.journal.maybe_compact()
+
+    def run_task(self, title, job, on_done, error_message):
+        # Файловые операции выполняются в фоновом потоке; job получает Task
+        # и не должен обращаться к виджетам, on_done вызывается в главном потоке
+        task = self.tasks.submit(
+            title,
+            job,
+            on_done,
+            on_error=lambda e: self.task_failed(title, error_message, e),
+            on_progress=self.show_task_progress,
+            on_finish=self.finish_task
+        )
+        if task is None:
+            messagebox.showwarning("Предупреждение", "Дождитесь завершения текущей операции")
+            return None
+        self.task_label.config(text=title)
+        self.task_progress.config(value=0)
+        self.task_cancel_button.config(state=tk.NORMAL)
+        return task
+
+    def run_import(self, title, job, on_done, error_message):
+        # Импорт меняет копию базы (import_copy), до подмены правка базы запрещена
+        if self.run_task(title, job, on_done, error_message) is not None:
+            self.importing = True
+
+    def task_failed(self, title, error_message, e):
+        error(f"gui.task: {title}", e)
+        messagebox.showerror("Ошибка", f"{error_message}: {str(e)}")
+
+    def show_task_progress(self, task, done, total):
+        if total:
+            self.task_progress.config(value=100 * done / total)
+
+    def finish_task(self, task):
+        self.importing = False
+        self.task_label.config(text=f"{task.title}: отменено" if task.cancelled else "")
+        self.task_progress.config(value=0)
+        self.task_cancel_button.config(state=tk.DISABLED)
+
+    def export_job(self, method, filename):
+        # Экспорт читает снимок базы, поэтому правки во время записи файла ему не мешают.
+        # method - имя метода экспорта: снимок может быть и Database, и SQLiteDatabase
+        snapshot = self.db.snapshot()
+
+        def job(task):
+            try:
+                if not getattr(snapshot, method)(filename, progress=task.progress):
+                    task.check()
+                    raise Exception("Ошибка при записи файла")
+            finally:
+                # Соединение снимка SQLite открыто в этом потоке и здесь же закрывается
+                if not isinstance(snapshot, Database):
+                    snapshot.close()
+        return job
+
+    def import_job(self, apply):
+        # Разбор файла и добавление строк выполняются в фоне, в копии базы (import_copy):
+        # главный поток только подменяет базу готовой копией (finish_import).
+        # apply(копия, task) импортирует и возвращает результат
+        copy = self.db.import_copy()
+        db = self.db
+        journal = self.journal
+
+        def job(task):
+            try:
+                with span('gui.import_apply'):
+                    result = apply(copy, task)
+                    copy.prepare_indexes(db)
+                    if journal is not None:
+                        journal.prepare(copy.events)
+                return copy, result
+            finally:
+                # Соединение копии SQLite открыто в этом потоке и здесь же закрывается
+                if not isinstance(copy, Database):
+                    copy.close()
+        return job
+
+    def file_import_job(self, parse, filename):
+        duplicates = self.duplicate_policy.get()
+
+        def apply(copy, task):
+            result = ImportResult(filename)
+            return copy.import_batches(parse(filename, result, progress=task.progress), result,
+                                       duplicates=duplicates)
+        return self.import_job(apply)
+
+    @timed('gui.import_adopt')
+    def adopt_import(self, copy, accepted):
+        if accepted:
+            self.db.adopt(copy)
+            self.schedule_refresh('table', 'balance', 'chart')
+
+    def finish_import(self, imported, message):
+        copy, result = imported
+        self.adopt_import(copy, result)
+        if result:
+            messagebox.showinfo("Успех", f"{message}\n{result.summary()}")
+        else:
+            messagebox.showerror("Ошибка", f"Импорт отменён\n{result.summary()}")
+
     def run(self):
         try:
             self.root.mainloop()
@@ -183,12 +569,14 @@ class FinPlannerApp:
         try:
             if messagebox.askokcancel("Выход", "Хотите выйти из приложения?"):
                 try:
-                    if self.db.export_to_json("data.json"):
-                        messagebox.showinfo("Сохранение", "Данные успешно сохранены")
-                    else:
-                        raise Exception("Ошибка при сохранении данных")
+                    # Все изменения уже в журнале или в SQLite, при выходе остаётся только сбросить буфер
+                    if self.journal is not None:
+                        self.journal.close()
+                    elif not isinstance(self.db, Database):
+                        self.db.close()
                 except Exception as e:
                     messagebox.showwarning("Предупреждение", f"Не удалось сохранить данные: {str(e)}")
+                self.tasks.shutdown()
                 self.root.destroy()
         except Exception as e:
             messagebox.showerror("Ошибка", f"Произошла ошибка при закрытии: {str(e)}")
@@ -200,37 +588,29 @@ class FinPlannerApp:
                 filetypes=[("CSV файлы", "*.csv"), ("Все файлы", "*.*")]
             )
             if filename:
-                with open(filename, 'w', encoding='utf-8', newline='') as file:
-                    writer = csv.DictWriter(file, fieldnames=[
-                        'id', 'amount', 'category', 'date', 'operation_type', 'comment'
-                    ])
-                    writer.writeheader()
-                    writer.writerows(self.db.get_all_operations())
-                messagebox.showinfo("Успех", "Данные успешно экспортированы в CSV")
+                self.run_task(
+                    "Экспорт CSV",
+                    self.export_job('export_to_csv', filename),
+                    lambda result: messagebox.showinfo("Успех", "Данные успешно экспортированы в CSV"),
+                    "Не удалось экспортировать в CSV"
+                )
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось экспортировать в CSV: {str(e)}")
 
     def import_from_csv(self):
+        if not self.check_loaded():
+            return
         try:
             filename = filedialog.askopenfilename(
                 filetypes=[("CSV файлы", "*.csv"), ("Все файлы", "*.*")]
                             )
             if filename:
-                with open(filename, 'r', encoding='utf-8') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        operation = Operation(
-                            amount=float(row['amount']),
-                            category=row['category'],
-                            date=row['date'],
-                            comment=row['comment'],
-                            operation_type=row['operation_type']
-                        )
-                        self.db.add_operation(operation)
-                self.update_table()
-                self.update_balance()
-                self.plot_charts(self.db.get_all_operations())
-                messagebox.showinfo("Успех", "Данные успешно импортированы из CSV")
+                self.run_import(
+                    "Импорт CSV",
+                    self.file_import_job(parse_csv, filename),
+                    lambda parsed: self.finish_import(parsed, "Данные успешно импортированы из CSV"),
+                    "Не удалось импортировать из CSV"
+                )
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось импортировать из CSV: {str(e)}")
 
@@ -238,40 +618,100 @@ class FinPlannerApp:
         try:
             filename = filedialog.asksaveasfilename(
                 defaultextension=".json",
-                filetypes=[("JSON файлы", "*.json"), ("Все файлы", "*.*")]
+                filetypes=[("JSON файлы", "*.json"), ("NDJSON файлы", "*.ndjson *.jsonl"),
+                           ("Снимок базы", "*.fpsnap"), ("Все файлы", "*.*")]
             )
             if filename:
-                with open(filename, 'w', encoding='utf-8') as file:
-                    json.dump(self.db.operations, file, ensure_ascii=False, indent=4)
-                messagebox.showinfo("Успех", "Данные успешно экспортированы в JSON")
+                self.run_task(
+                    "Экспорт JSON",
+                    self.export_job('export', filename),
+                    lambda result: messagebox.showinfo("Успех", "Данные успешно экспортированы в JSON"),
+                    "Не удалось экспортировать в JSON"
+                )
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось экспортировать в JSON: {str(e)}")
 
     def import_from_json(self):
+        if not self.check_loaded():
+            return
         try:
             filename = filedialog.askopenfilename(
-                filetypes=[("JSON файлы", "*.json"), ("Все файлы", "*.*")]
+                filetypes=[("JSON файлы", "*.json *.ndjson *.jsonl"), ("Все файлы", "*.*")]
             )
             if filename:
-                with open(filename, 'r', encoding='utf-8') as file:
-                    data = json.load(file)
-                    for op in data:
-                        operation = Operation(
-                            amount=op['amount'],
-                            category=op['category'],
-                            date=op['date'],
-                            comment=op['comment'],
-                            operation_type=op['operation_type']
-                        )
-                        self.db.add_operation(operation)
-                self.update_table()
-                self.update_balance()
-                self.plot_charts(self.db.get_all_operations())
-                messagebox.showinfo("Успех", "Данные успешно импортированы из JSON")
+                self.run_import(
+                    "Импорт JSON",
+                    self.file_import_job(parse_file, filename),
+                    lambda parsed: self.finish_import(parsed, "Данные успешно импортированы из JSON"),
+                    "Не удалось импортировать из JSON"
+                )
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось импортировать из JSON: {str(e)}")
 
+    def import_statements(self):
+        if not self.check_loaded():
+            return
+        try:
+            filenames = filedialog.askopenfilenames(
+                filetypes=[("Выписки", "*.csv *.json *.ndjson *.jsonl"), ("Все файлы", "*.*")]
+            )
+            if filenames:
+                self.run_bulk_import(list(filenames))
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось импортировать выписки: {str(e)}")
+
+    def import_folder(self):
+        if not self.check_loaded():
+            return
+        try:
+            folder = filedialog.askdirectory()
+            if folder:
+                self.run_bulk_import([folder])
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось импортировать папку: {str(e)}")
+
+    def run_bulk_import(self, paths):
+        # Файлы разбираются параллельно в процессах (spawn: форк процесса с Tk и рабочими
+        # потоками небезопасен), готовые порции добавляются в копию базы в фоновом потоке
+        import multiprocessing
+        filenames = expand_paths(paths)
+        if not filenames:
+            messagebox.showwarning("Предупреждение", "Не найдено файлов CSV или JSON")
+            return
+        duplicates = self.duplicate_policy.get()
+
+        def apply(copy, task):
+            with span('gui.import_parse'):
+                parsed = list(parse_statements(filenames, progress=task.progress,
+                                               mp_context=multiprocessing.get_context('spawn')))
+            return [apply_statement(copy, batches, result, duplicates=duplicates) for batches, result in parsed]
+
+        self.run_import(
+            f"Импорт выписок: {len(filenames)}",
+            self.import_job(apply),
+            self.finish_bulk_import,
+            "Не удалось импортировать выписки"
+        )
+
+    def finish_bulk_import(self, imported):
+        copy, results = imported
+        self.adopt_import(copy, any(result.added for result in results))
+        added = sum(result.added for result in results)
+        skipped = sum(result.duplicates for result in results)
+        failed = [result for result in results if not result]
+        lines = [f"Файлов: {len(results)}, добавлено операций: {added}, пропущено повторов: {skipped}"]
+        for result in results:
+            if result.errors or result.duplicates or not result:
+                status = "" if result else " (файл не импортирован)"
+                lines.append(f"{os.path.basename(result.filename)}{status}:\n{result.summary(limit=3)}")
+        if failed:
+            messagebox.showwarning("Импорт выписок", "\n".join(lines))
+        else:
+            messagebox.showinfo("Импорт выписок", "\n".join(lines))
+
     def edit_operation(self):
+        if not self.check_loaded():
+            return
         try:
             selected = self.tree.selection()
             if not selected:
@@ -280,7 +720,7 @@ class FinPlannerApp:
             
             item = self.tree.item(selected[0])
             operation_id = item['values'][0]
-            operation = next((op for op in self.db.operations if op['id'] == operation_id), None)
+            operation = self.db.get(operation_id)
             
             if not operation:
                 messagebox.showwarning("Предупреждение", "Операция не найдена")
@@ -291,7 +731,7 @@ class FinPlannerApp:
             
             ttk.Label(edit_window, text="Сумма:").grid(row=0, column=0, padx=5, pady=5)
             amount_entry = ttk.Entry(edit_window)
-            amount_entry.insert(0, operation['amount'])
+            amount_entry.insert(0, format_amount(operation['amount']))
             amount_entry.grid(row=0, column=1, padx=5, pady=5)
             
             ttk.Label(edit_window, text="Категория:").grid(row=1, column=0, padx=5, pady=5)
@@ -316,7 +756,8 @@ class FinPlannerApp:
 
             def save_changes():
                 try:
-                    amount = float(amount_entry.get())
+                    # Введённый текст разбирается как десятичная запись, лишние знаки округляются
+                    amount = from_minor(to_minor(amount_entry.get()))
                     category = category_entry.get().strip()
                     date = date_entry.get()
                     comment = comment_entry.get()
@@ -328,18 +769,18 @@ class FinPlannerApp:
                         raise ValueError("Категория не может быть пустой")
                     
                     # Обновляем операцию в базе данных
-                    for op in self.db.operations:
-                        if op['id'] == operation_id:
-                            op['amount'] = amount
-                            op['category'] = category
-                            op['date'] = date
-                            op['comment'] = comment
-                            op['operation_type'] = operation_type.get()
-                            break
+                    if not self.db.update(
+                        operation_id,
+                        amount=amount,
+                        category=category,
+                        date=date,
+                        comment=comment,
+                        operation_type=operation_type.get()
+                    ):
+                        raise Exception("Операция не найдена")
                     
-                    self.update_table()
-                    self.update_balance()
-                    self.plot_charts(self.db.get_all_operations())
+                    self.table_update(operation_id)
+                    self.schedule_refresh('balance', 'chart')
                     edit_window.destroy()
                 except Exception as e:
                     messagebox.showerror("Ошибка", f"Не удалось сохранить изменения: {str(e)}")
@@ -350,6 +791,8 @@ class FinPlannerApp:
             messagebox.showerror("Ошибка", f"Не удалось открыть окно редактирования: {str(e)}")
 
     def delete_operation(self):
+        if not self.check_loaded():
+            return
         try:
             selected = self.tree.selection()
             if not selected:
@@ -360,13 +803,99 @@ class FinPlannerApp:
             operation_id = item['values'][0]
             
             if messagebox.askyesno("Подтверждение", "Действительно удалить операцию?"):
-                self.db.operations = [op for op in self.db.operations if op['id'] != operation_id]
-                self.update_table()
-                self.update_balance()
-                self.plot_charts(self.db.get_all_operations())
+                self.db.delete(operation_id)
+                self.table_delete(operation_id)
+                self.schedule_refresh('balance', 'chart')
                 
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось удалить операцию: {str(e)}")
 
+    def diagnostics_window(self):
+        # Замеры горячих мест (instrumentation.stats): время вызовов, счётчики и ошибки.
+        # Сбор и профилирование cProfile включаются здесь же, без перезапуска
+        try:
+            window = tk.Toplevel(self.root)
+            window.title("Диагностика")
+
+            controls = ttk.Frame(window)
+            controls.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+            enabled = tk.BooleanVar(value=stats.enabled)
+            ttk.Checkbutton(controls, text="Собирать замеры", variable=enabled,
+                            command=lambda: setattr(stats, 'enabled', enabled.get())).pack(side=tk.LEFT, padx=5)
+
+            tree = ttk.Treeview(window, columns=("Вызовов", "Всего, мс", "Среднее, мс", "Макс, мс"), height=16)
+            tree.heading("#0", text="Замер")
+            for column in ("Вызовов", "Всего, мс", "Среднее, мс", "Макс, мс"):
+                tree.heading(column, text=column)
+                tree.column(column, width=100, anchor=tk.E)
+            tree.column("#0", width=260)
+            tree.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5)
+
+            # Внизу - последние ошибки, а после профилирования - его сводка до сброса
+            text = tk.Text(window, height=12, wrap=tk.NONE)
+            text.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5, pady=5)
+            profile_summary = []
+
+            def show():
+                data = stats.snapshot()
+                tree.delete(*tree.get_children())
+                spans = tree.insert("", "end", text="Время", open=True)
+                for name, entry in data['spans'].items():
+                    tree.insert(spans, "end", text=name, values=(
+                        entry['count'], f"{entry['total_ms']:.1f}", f"{entry['mean_ms']:.2f}", f"{entry['max_ms']:.1f}"
+                    ))
+                counters = tree.insert("", "end", text="Счётчики", open=True)
+                for name, value in data['counters'].items():
+                    tree.insert(counters, "end", text=name, values=(value,))
+                errors = tree.insert("", "end", text="Ошибки", open=True)
+                for name, value in data['errors'].items():
+                    tree.insert(errors, "end", text=name, values=(value,))
+                recent = "\n".join(f"{entry['name']}: {entry['message']}" for entry in data['recent_errors'])
+                if not profile_summary and text.get("1.0", "end-1c") != recent:
+                    text.delete("1.0", tk.END)
+                    text.insert(tk.END, recent)
+
+            def refresh():
+                if window.winfo_exists():
+                    show()
+                    window.after(DIAGNOSTICS_REFRESH_MS, refresh)
+
+            def reset():
+                stats.reset()
+                profile_summary.clear()
+                show()
+
+            def save_json():
+                filename = filedialog.asksaveasfilename(
+                    parent=window, defaultextension=".json",
+                    filetypes=[("JSON файлы", "*.json"), ("Все файлы", "*.*")]
+                )
+                if filename:
+                    stats.dump(filename)
+
+            def toggle_profile():
+                if not stats.profiling:
+                    stats.start_profile()
+                    profile_button.config(text="Остановить профилирование")
+                    return
+                profile_button.config(text="Профилирование")
+                filename = filedialog.asksaveasfilename(
+                    parent=window, title="Сохранить профиль (Отмена - только сводка)", defaultextension=".prof",
+                    filetypes=[("Профиль cProfile", "*.prof"), ("Все файлы", "*.*")]
+                )
+                profile_summary[:] = [stats.stop_profile(filename or None)]
+                text.delete("1.0", tk.END)
+                text.insert(tk.END, profile_summary[0])
+
+            ttk.Button(controls, text="Сбросить", command=reset).pack(side=tk.LEFT, padx=5)
+            ttk.Button(controls, text="Сохранить JSON", command=save_json).pack(side=tk.LEFT, padx=5)
+            profile_button = ttk.Button(controls, text="Остановить профилирование" if stats.profiling else "Профилирование",
+                                        command=toggle_profile)
+            profile_button.pack(side=tk.LEFT, padx=5)
+            refresh()
+
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть окно диагностики: {str(e)}")
+
     def run(self):
         self.root.mainloop()
\ No newline at end of file
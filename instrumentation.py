@@ -0,0 +1,152 @@
+#instrumentation.py - замеры горячих мест: время вызовов, счётчики, ошибки и профилирование cProfile
+
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+# Сбор включается переменной окружения, ключом командной строки или из окна диагностики
+ENV_VARIABLE = 'FINPLANNER_STATS'
+# Сколько последних ошибок хранить с текстом
+ERROR_HISTORY = 50
+PROFILE_LINES = 30
+
+
+class Stats:
+    # Выключенный сбор стоит одной проверки флага на вызов. Включённый - два
+    # perf_counter и обновление записи под блокировкой: замеры идут и из фоновых задач
+    def __init__(self):
+        self.enabled = bool(os.environ.get(ENV_VARIABLE))
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # spans[имя] = [число вызовов, суммарное время, наибольшее время]
+            self.spans = {}
+            self.counters = {}
+            self.error_counts = {}
+            self.errors = deque(maxlen=ERROR_HISTORY)
+            self.started = time.time()
+
+    def add_span(self, name, elapsed):
+        with self.lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = [1, elapsed, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+                if elapsed > entry[2]:
+                    entry[2] = elapsed
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def error(self, name, error):
+        # Ошибки считаются всегда: их мало, а печать в консоль часто никто не видит
+        with self.lock:
+            self.error_counts[name] = self.error_counts.get(name, 0) + 1
+            self.errors.append((time.time(), name, f"{type(error).__name__}: {error}"))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'since': self.started,
+                'spans': {
+                    name: {
+                        'count': count,
+                        'total_ms': total * 1000,
+                        'mean_ms': total * 1000 / count,
+                        'max_ms': longest * 1000,
+                    }
+                    for name, (count, total, longest) in sorted(self.spans.items())
+                },
+                'counters': dict(sorted(self.counters.items())),
+                'errors': dict(sorted(self.error_counts.items())),
+                'recent_errors': [{'time': moment, 'name': name, 'message': message}
+                                  for moment, name, message in self.errors],
+            }
+
+    def dump(self, filename):
+        with open(filename, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file, ensure_ascii=False, indent=2)
+
+    @property
+    def profiling(self):
+        return self.profiler is not None
+
+    def start_profile(self):
+        # cProfile видит только поток, в котором включён (для окна - главный поток Tk)
+        if self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profile(self, filename=None):
+        # Останавливает профилирование; filename - файл .prof для pstats/snakeviz.
+        # Возвращает текстовую сводку самых долгих функций
+        profiler = self.profiler
+        if profiler is None:
+            return ''
+        profiler.disable()
+        self.profiler = None
+        if filename:
+            profiler.dump_stats(filename)
+        import pstats
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return text.getvalue()
+
+
+stats = Stats()
+
+
+def timed(name):
+    # Декоратор: время каждого вызова попадает в spans[name], когда сбор включён
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.add_span(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class span:
+    # with span('имя'): ... - то же для участка кода
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if stats.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            stats.add_span(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def count(name, value=1):
+    stats.count(name, value)
+
+
+def error(name, error):
+    stats.error(name, error)
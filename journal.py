@@ -0,0 +1,241 @@
+#journal.py - журнал операций: снимок базы плюс дописываемый журнал изменений
+
+import json
+import os
+import threading
+import time
+from snapshot import is_snapshot_path
+from storage import ImportBatch
+from instrumentation import timed, error, stats
+
+SYNC_EVERY = 100
+SYNC_INTERVAL = 1.0
+COMPACT_AFTER = 100000
+
+
+class Journal:
+    # Каждое изменение базы сразу дописывается строкой JSON в файл журнала.
+    # fsync выполняется пачками: раз в sync_every записей или раз в sync_interval секунд,
+    # и сразу после записи импорта (одна запись со столбцами всех строк файла).
+    # При запуске загружается снимок и поверх него проигрывается журнал; уплотнение
+    # пишет новый снимок в фоне и подменяет старый атомарным переименованием
+    def __init__(self, db, snapshot_path='data.json', sync_every=SYNC_EVERY,
+                 sync_interval=SYNC_INTERVAL, fsync=True, compact_after=COMPACT_AFTER):
+        self.db = db
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + '.journal'
+        self.rotated_path = self.journal_path + '.1'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.fsync = fsync
+        self.compact_after = compact_after
+        self.file = None
+        self.pending = 0
+        self.records = 0
+        self.last_sync = time.monotonic()
+        self.compaction = None
+        self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    @timed('journal.open')
+    def open(self):
+        # Снимок, затем журнал, оставшийся от прерванного уплотнения, затем текущий журнал
+        try:
+            if os.path.exists(self.snapshot_path):
+                if not self.db.load(self.snapshot_path):
+                    raise Exception(f"Не удалось прочитать {self.snapshot_path}")
+            for path in (self.rotated_path, self.journal_path):
+                if os.path.exists(path):
+                    self.records += self.replay(path)
+            if os.path.exists(self.rotated_path):
+                # Прошлое уплотнение не завершилось: дописываем снимок сейчас
+                self.write_snapshot(self.db.snapshot())
+            self.file = open(self.journal_path, 'a', encoding='utf-8')
+            self.db.add_listener(self.record)
+            return True
+        except Exception as e:
+            print(f"Ошибка при открытии журнала: {str(e)}")
+            error('journal.open', e)
+            return False
+
+    def replay(self, path):
+        # Проигрывание идемпотентно: add существующего id перезаписывает строку,
+        # update и delete отсутствующего id пропускаются. Поэтому повтор журнала,
+        # уже вошедшего в снимок, не меняет результат.
+        # Недописанная последняя строка (аварийное завершение посреди записи) отрезается,
+        # чтобы следующие записи не склеились с ней; ошибка в середине файла - повреждение
+        db = self.db
+        count = 0
+        offset = 0
+        with open(path, 'rb') as file:
+            for number, line in enumerate(file, 1):
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("строка не завершена")
+                    record = json.loads(line)
+                except ValueError:
+                    if file.read(1):
+                        raise Exception(f"Журнал {path} повреждён в строке {number}")
+                    break
+                offset += len(line)
+                count += 1
+                event = record.pop('op')
+                operation_id = record.pop('id', None)
+                store = db.store
+                if event == 'add':
+                    pos = store.find(operation_id)
+                    if pos is None:
+                        store.append(operation_id, record['amount'], record['category'], record['date'],
+                                     record['comment'], record['operation_type'])
+                    else:
+                        store.update(pos, record)
+                    db.next_id = max(db.next_id, operation_id + 1)
+                elif event == 'update':
+                    pos = store.find(operation_id)
+                    if pos is not None:
+                        store.update(pos, record)
+                elif event == 'delete':
+                    pos = store.find(operation_id)
+                    if pos is not None:
+                        store.remove(pos)
+                elif event == 'import':
+                    self.replay_import(operation_id, ImportBatch.from_columns(record))
+                elif event == 'reset':
+                    db.operations = []
+        if offset < os.path.getsize(path):
+            print(f"Журнал {path}: отброшена недописанная запись")
+            os.truncate(path, offset)
+        return count
+
+    def replay_import(self, first_id, batch):
+        # Строки импорта, уже попавшие в снимок, перезаписываются по одной, как add;
+        # если ни одной из них нет, порция добавляется целиком
+        db = self.db
+        store = db.store
+        ids = range(first_id, first_id + len(batch))
+        if any(store.find(operation_id) is not None for operation_id in ids):
+            for pos, operation_id in enumerate(ids):
+                row = batch.row(pos)
+                found = store.find(operation_id)
+                if found is None:
+                    store.append(operation_id, row['amount'], row['category'], row['date'],
+                                 row['comment'], row['operation_type'])
+                else:
+                    store.update(found, row)
+        else:
+            store.extend(batch, first_id)
+        db.next_id = max(db.next_id, first_id + len(batch))
+
+    def encode(self, event, operation_id, old, new):
+        if event == 'add':
+            record = {'op': event, 'id': operation_id}
+            record.update(new)
+        elif event == 'update':
+            record = {'op': event, 'id': operation_id}
+            record.update((key, value) for key, value in new.items() if old.get(key) != value)
+        elif event == 'delete':
+            record = {'op': event, 'id': operation_id}
+        elif event == 'import':
+            # Весь импорт - одна запись со столбцами порции вместо строки на операцию
+            if new.journal_line is not None:
+                return new.journal_line
+            record = {'op': event, 'id': operation_id}
+            record.update(new.columns())
+        else:
+            record = {'op': event}
+        return self.encoder.encode(record) + '\n'
+
+    def prepare(self, events):
+        # Записи импорта в копии базы (Database.import_copy) кодируются заранее, в потоке
+        # импорта: при подмене базы главному потоку остаётся дописать готовую строку
+        for event, operation_id, old, new in events:
+            if event == 'import':
+                new.journal_line = self.encode(event, operation_id, old, new)
+
+    def record(self, event, operation_id, old, new):
+        try:
+            self.file.write(self.encode(event, operation_id, old, new))
+            self.pending += 1
+            self.records += 1
+            stats.count('journal.records')
+            if (event == 'import' or self.pending >= self.sync_every
+                    or time.monotonic() - self.last_sync >= self.sync_interval):
+                self.sync()
+        except Exception as e:
+            print(f"Ошибка при записи в журнал: {str(e)}")
+            error('journal.record', e)
+
+    def flush(self):
+        # Передать записи ОС: переживает падение программы, но не отключение питания
+        if self.file is not None:
+            self.file.flush()
+
+    def sync(self):
+        if self.file is None:
+            return
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+            stats.count('journal.fsyncs')
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    @property
+    def compacting(self):
+        return self.compaction is not None and self.compaction.is_alive()
+
+    def maybe_compact(self):
+        if self.records >= self.compact_after and not self.compacting:
+            self.compact()
+
+    @timed('journal.compact')
+    def compact(self):
+        # Журнал переименовывается и начинается заново, снимок базы на этот момент
+        # пишется в фоне во временный файл и атомарно заменяет старый снимок
+        if self.compacting or os.path.exists(self.rotated_path):
+            return False
+        try:
+            self.sync()
+            self.file.close()
+            os.replace(self.journal_path, self.rotated_path)
+            self.file = open(self.journal_path, 'a', encoding='utf-8')
+            self.records = 0
+            snapshot = self.db.snapshot()
+            self.compaction = threading.Thread(target=self.write_snapshot, args=(snapshot,), daemon=True)
+            self.compaction.start()
+            return True
+        except Exception as e:
+            print(f"Ошибка при уплотнении журнала: {str(e)}")
+            error('journal.compact', e)
+            if self.file is None or self.file.closed:
+                self.file = open(self.journal_path, 'a', encoding='utf-8')
+            return False
+
+    @timed('journal.write_snapshot')
+    def write_snapshot(self, snapshot):
+        temp_path = self.snapshot_path + '.tmp'
+        try:
+            if is_snapshot_path(self.snapshot_path):
+                saved = snapshot.export_to_snapshot(temp_path)
+            else:
+                saved = snapshot.export_to_json(temp_path, indent=None)
+            if not saved:
+                raise Exception("Не удалось записать снимок")
+            with open(temp_path, 'rb') as file:
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            os.remove(self.rotated_path)
+        except Exception as e:
+            # Снимок не заменён (например, в Windows нельзя заменить файл, открытый через mmap):
+            # при следующем запуске журнал .1 будет проигран заново
+            print(f"Ошибка при записи снимка: {str(e)}")
+            error('journal.write_snapshot', e)
+
+    def close(self):
+        # Выход не ждёт фонового уплотнения: незаконченный снимок не подменяет старый,
+        # а переименованный журнал будет проигран при следующем запуске
+        if self.file is None:
+            return
+        self.db.remove_listener(self.record)
+        self.sync()
+        self.file.close()
+        self.file = None
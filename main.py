@@ -1,10 +1,13 @@
   #main.py - точка входа в приложение
 
+import sys
+import traceback
 from gui import FinPlannerApp
 
 if __name__ == "__main__":
     try:
-        app = FinPlannerApp()
+        # Необязательный аргумент - файл данных: data.json (по умолчанию) или база .db/.sqlite
+        app = FinPlannerApp(*sys.argv[1:2])
         app.root.protocol("WM_DELETE_WINDOW", app.on_closing)
         app.run()
     except Exception as e:
@@ -1,6 +1,8 @@
 #models.py - описание структуры данных
 
 class Operation:
+    __slots__ = ('amount', 'category', 'date', 'comment', 'operation_type')
+
     def __init__(self, amount, category, date, comment, operation_type):
         self.amount = amount
         self.category = category
@@ -16,3 +18,44 @@ class Operation:
             'comment': self.comment,
             'operation_type': self.operation_type
         }
+
+
+class ImportResult:
+    # Итог импорта файла: сколько строк добавлено, какие строки отклонены
+    # и сколько пропущено как повторы уже имеющихся операций (первые - для примера)
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.added = 0
+        self.errors = []
+        self.duplicates = 0
+        self.duplicate_rows = []
+        self.ok = False
+        self.message = ''
+
+    def __bool__(self):
+        return self.ok
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+    def add_duplicate(self, row, limit=10):
+        self.duplicates += 1
+        if len(self.duplicate_rows) < limit:
+            self.duplicate_rows.append(row)
+
+    def summary(self, limit=10):
+        lines = [f"Добавлено операций: {self.added}"]
+        if self.errors:
+            lines.append(f"Строк с ошибками: {len(self.errors)}")
+            lines.extend(f"  строка {line}: {message}" for line, message in self.errors[:limit])
+            if len(self.errors) > limit:
+                lines.append("  ...")
+        if self.duplicates:
+            lines.append(f"Пропущено повторов: {self.duplicates}")
+            lines.extend(f"  {row['date']} {row['category']} {row['amount']} {row['operation_type']} {row['comment']}"
+                         for row in self.duplicate_rows[:limit])
+            if self.duplicates > limit:
+                lines.append("  ...")
+        if self.message:
+            lines.append(self.message)
+        return "\n".join(lines)
@@ -0,0 +1,310 @@
+#snapshot.py - двоичный снимок базы: столбцы фиксированной ширины, чтение через mmap
+
+import mmap
+import operator
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import compress, islice
+from storage import ColumnStore, CommentColumn, OPERATION_TYPES, SNAPSHOT_EXTENSIONS, track_progress
+import utils
+
+MAGIC = b'FPSNAP\x00\x00'
+# Версия 2: суммы - целые младшие единицы, в заголовке - число знаков после запятой.
+# Версия 1 (суммы float) читается с переводом сумм в младшие единицы
+VERSION = 2
+FLAG_SORTED_IDS = 1
+ALIGNMENT = 8
+
+# Заголовок: сигнатура, версия, флаги, число строк, next_id, число категорий, знаков в суммах
+HEADER = struct.Struct('<8sIIqqqq')
+HEADER_V1 = struct.Struct('<8sIIqqq')
+
+# Разделы файла по порядку; смещение каждого записано в таблице после заголовка
+SECTIONS = (
+    ('ids', 'q'),
+    ('amounts', 'q'),
+    ('dates', 'i'),
+    ('categories', 'i'),
+    ('types', 'b'),
+    ('comment_offsets', 'q'),
+    ('comment_blob', 'B'),
+    ('category_income', 'q'),
+    ('category_expense', 'q'),
+    ('category_counts', 'q'),
+    ('name_offsets', 'q'),
+    ('name_blob', 'B'),
+)
+SECTIONS_V1 = tuple((name, 'd' if name in ('amounts', 'category_income', 'category_expense') else typecode)
+                    for name, typecode in SECTIONS)
+SECTION_TABLE = struct.Struct('<' + 'qq' * len(SECTIONS))
+
+
+def is_snapshot_path(path):
+    return str(path).lower().endswith(SNAPSHOT_EXTENSIONS)
+
+
+def little_endian(column):
+    # Файл всегда в порядке байт little-endian
+    if sys.byteorder == 'little' or column.itemsize == 1:
+        return column
+    column = array(column.typecode, column)
+    column.byteswap()
+    return column
+
+
+class MappedComments:
+    # Комментарии снимка: строка декодируется из общего блока при обращении.
+    # Изменённые и добавленные после загрузки строки хранятся отдельно
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+        self.count = len(offsets) - 1
+        self.changed = {}
+        self.extra = CommentColumn()
+
+    def __len__(self):
+        return self.count + len(self.extra)
+
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += len(self)
+        if pos >= self.count:
+            return self.extra[pos - self.count]
+        value = self.changed.get(pos)
+        if value is None:
+            value = str(self.blob[self.offsets[pos]:self.offsets[pos + 1]], 'utf-8')
+        return value
+
+    def __setitem__(self, pos, value):
+        if pos >= self.count:
+            self.extra[pos - self.count] = value
+        else:
+            self.changed[pos] = value
+
+    def __delitem__(self, index):
+        # Поддерживается только отрезание хвоста (del comments[length:]) при откате импорта
+        start = index.start
+        if start >= self.count:
+            del self.extra[start - self.count:]
+            return
+        self.count = start
+        self.extra = CommentColumn()
+        self.changed = {pos: value for pos, value in self.changed.items() if pos < start}
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self[pos]
+
+    def append(self, value):
+        self.extra.append(value)
+
+    def extend(self, values):
+        self.extra.extend(values)
+
+    def copy(self):
+        comments = MappedComments(self.offsets, self.blob)
+        comments.count = self.count
+        comments.changed = dict(self.changed)
+        comments.extra = self.extra.copy()
+        return comments
+
+
+class MappedIndex:
+    # Индекс id -> позиция для снимка с возрастающими id: двоичный поиск по столбцу
+    # в mmap вместо словаря на миллионы записей. Новые строки - в обычном словаре
+    def __init__(self, ids):
+        self.ids = ids
+        self.removed = set()
+        self.extra = {}
+
+    def get(self, operation_id, default=None):
+        pos = self.extra.get(operation_id)
+        if pos is not None:
+            return pos
+        pos = bisect_left(self.ids, operation_id)
+        if pos < len(self.ids) and self.ids[pos] == operation_id and operation_id not in self.removed:
+            return pos
+        return default
+
+    def __contains__(self, operation_id):
+        return self.get(operation_id) is not None
+
+    def __len__(self):
+        return len(self.ids) - len(self.removed) + len(self.extra)
+
+    def __setitem__(self, operation_id, pos):
+        self.extra[operation_id] = pos
+
+    def __delitem__(self, operation_id):
+        if operation_id in self.extra:
+            del self.extra[operation_id]
+        elif operation_id in self:
+            self.removed.add(operation_id)
+        else:
+            raise KeyError(operation_id)
+
+    def update(self, pairs):
+        self.extra.update(pairs)
+
+    def copy(self):
+        index = MappedIndex(self.ids)
+        index.removed = set(self.removed)
+        index.extra = dict(self.extra)
+        return index
+
+
+def write_snapshot(filename, store, next_id, progress=None):
+    # Пишутся только живые строки; разделы выравниваются по 8 байт. Файл пишется рядом
+    # (.tmp) и атомарно заменяет прежний: оборванная запись не портит старый снимок
+    if store.mapped is not None and os.path.exists(filename) and os.path.samefile(filename, store.mapped):
+        # Столбцы базы читаются из этого файла через mmap
+        raise ValueError(f"{filename}: база загружена из этого файла, снимок нельзя записать поверх него")
+    def live(column):
+        if not store.deleted:
+            return column
+        typecode = column.typecode if isinstance(column, array) else column.format
+        return array(typecode, compress(column, store.alive))
+
+    comments = compress(store.comments, store.alive) if store.deleted else iter(store.comments)
+    ids = live(store.ids)
+    rows = len(ids)
+    flags = FLAG_SORTED_IDS if all(map(operator.lt, ids, islice(ids, 1, None))) else 0
+
+    comment_offsets = array('q', [0])
+    comment_chunks = []
+    size = 0
+    for comment in track_progress(comments, rows, progress):
+        data = comment.encode('utf-8')
+        size += len(data)
+        comment_offsets.append(size)
+        comment_chunks.append(data)
+
+    name_offsets = array('q', [0])
+    name_chunks = []
+    size = 0
+    for name in store.category_names:
+        data = name.encode('utf-8')
+        size += len(data)
+        name_offsets.append(size)
+        name_chunks.append(data)
+
+    income = array('q', (totals[0] for totals in store.category_totals))
+    expense = array('q', (totals[1] for totals in store.category_totals))
+    counts = array('q', store.category_counts)
+
+    sections = {
+        'ids': ids,
+        'amounts': live(store.amounts),
+        'dates': live(store.dates),
+        'categories': live(store.categories),
+        'types': live(store.types),
+        'comment_offsets': comment_offsets,
+        'comment_blob': comment_chunks,
+        'category_income': income,
+        'category_expense': expense,
+        'category_counts': counts,
+        'name_offsets': name_offsets,
+        'name_blob': name_chunks,
+    }
+
+    temp_path = filename + '.tmp'
+    try:
+        write_sections(temp_path, sections, store, flags, rows, next_id)
+        os.replace(temp_path, filename)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_sections(filename, sections, store, flags, rows, next_id):
+    with open(filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, flags, rows, next_id, len(store.category_names), utils.AMOUNT_DIGITS))
+        table_position = file.tell()
+        file.write(b'\x00' * SECTION_TABLE.size)
+        table = []
+        for name, typecode in SECTIONS:
+            file.write(b'\x00' * (-file.tell() % ALIGNMENT))
+            start = file.tell()
+            data = sections[name]
+            if isinstance(data, list):
+                for chunk in data:
+                    file.write(chunk)
+            elif isinstance(data, memoryview):
+                # Столбец загруженного снимка: уже в порядке байт файла
+                file.write(data.cast('B'))
+            else:
+                file.write(little_endian(data))
+            table.extend((start, file.tell() - start))
+        file.seek(table_position)
+        file.write(SECTION_TABLE.pack(*table))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def read_snapshot(filename):
+    # Файл отображается в память, числовые столбцы - memoryview поверх него,
+    # комментарии декодируются по требованию. Возвращает (хранилище, next_id)
+    with open(filename, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, flags, rows, next_id, category_count = HEADER_V1.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{filename}: не является снимком базы")
+    if version == VERSION:
+        header, layout = HEADER, SECTIONS
+        digits = HEADER.unpack_from(mapped, 0)[-1]
+    elif version == 1:
+        header, layout = HEADER_V1, SECTIONS_V1
+        digits = None
+    else:
+        raise ValueError(f"{filename}: неподдерживаемая версия снимка {version}")
+    table = SECTION_TABLE.unpack_from(mapped, header.size)
+    view = memoryview(mapped)
+    sections = {}
+    for number, (name, typecode) in enumerate(layout):
+        start, length = table[2 * number], table[2 * number + 1]
+        section = view[start:start + length]
+        if typecode != 'B':
+            section = section.cast(typecode)
+            if sys.byteorder != 'little':
+                section = little_endian(array(typecode, section))
+        sections[name] = section
+
+    store = ColumnStore()
+    store.ids = sections['ids']
+    store.amounts = sections['amounts']
+    store.dates = sections['dates']
+    store.categories = sections['categories']
+    store.types = sections['types']
+    store.comments = MappedComments(sections['comment_offsets'], sections['comment_blob'])
+    offsets = sections['name_offsets']
+    names = sections['name_blob']
+    store.category_names = [str(names[offsets[code]:offsets[code + 1]], 'utf-8')
+                            for code in range(category_count)]
+    store.category_codes = {name: code for code, name in enumerate(store.category_names)}
+    store.category_counts = list(sections['category_counts'])
+    store.alive = bytearray(b'\x01') * rows
+    store.mapped = os.path.abspath(filename)
+    # Числовые столбцы - memoryview только для чтения: копируются перед первым изменением
+    store.shared = {'ids', 'amounts', 'dates', 'types', 'categories'}
+    if digits is None:
+        # Старый снимок: суммы переводятся в младшие единицы, итоги пересчитываются точно
+        store.amounts = array('q', map(utils.to_minor, store.amounts))
+        store.type_totals, store.category_totals, store.category_counts = store.recompute_totals()
+    else:
+        if digits != utils.AMOUNT_DIGITS:
+            # Снимок записан с другим числом знаков: столбец сумм копируется с переводом
+            store.amounts = array('q', (utils.rescale_minor(units, digits) for units in store.amounts))
+        store.category_totals = [[utils.rescale_minor(income, digits), utils.rescale_minor(expense, digits)]
+                                 for income, expense
+                                 in zip(sections['category_income'], sections['category_expense'])]
+        store.type_totals = [sum(totals[code] for totals in store.category_totals)
+                             for code in range(len(OPERATION_TYPES))]
+    if flags & FLAG_SORTED_IDS:
+        store.index = MappedIndex(store.ids)
+    else:
+        store.index = {operation_id: pos for pos, operation_id in enumerate(store.ids)}
+    return store, next_id
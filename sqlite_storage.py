@@ -0,0 +1,698 @@
+#sqlite_storage.py - хранение операций в SQLite
+
+import sqlite3
+from collections.abc import Sequence
+from models import ImportResult
+from instrumentation import timed, error, stats
+import utils
+from utils import to_minor, from_minor, format_minor
+from storage import (
+    ColumnStore, FIELDS, CSV_FIELDS, OPERATION_TYPES, IMPORT_CHUNK_SIZE,
+    ordinal_to_date, date_to_ordinal, track_progress, write_json, write_ndjson, write_csv,
+    export_by_extension, parse_csv, parse_json, parse_ndjson, TextIndex, SearchView,
+    FingerprintIndex, fingerprint, filter_duplicates
+)
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+FETCH_SIZE = 1000
+# Столбцы для векторных расчётов (analysis.py) читаются порциями по столько строк
+COLUMN_CHUNK_SIZE = 65536
+# julianday(ГГГГ-ММ-ДД) - JULIAN_OFFSET = порядковый номер даты, как date.toordinal()
+JULIAN_OFFSET = 1721424.5
+
+# Суммы - целые младшие единицы валюты (utils.to_minor), SUM по ним точный
+OPERATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY,
+    amount INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    date TEXT NOT NULL,
+    comment TEXT NOT NULL DEFAULT '',
+    operation_type TEXT NOT NULL CHECK (operation_type IN ('income', 'expense'))
+)
+"""
+
+# Суммы по категориям поддерживаются триггерами, чтобы баланс и график
+# не требовали просмотра всей таблицы
+TOTALS_TABLE = """
+CREATE TABLE IF NOT EXISTS category_totals (
+    category TEXT PRIMARY KEY,
+    first_id INTEGER NOT NULL,
+    income INTEGER NOT NULL DEFAULT 0,
+    expense INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+SCHEMA = OPERATIONS_TABLE + ";" + TOTALS_TABLE + """;
+-- Число знаков после запятой, с которым записаны суммы (amount_digits)
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value
+);
+
+CREATE TRIGGER IF NOT EXISTS operations_delete AFTER DELETE ON operations BEGIN
+    UPDATE category_totals SET
+        income = income - (CASE WHEN OLD.operation_type = 'income' THEN OLD.amount ELSE 0 END),
+        expense = expense - (CASE WHEN OLD.operation_type = 'expense' THEN OLD.amount ELSE 0 END),
+        count = count - 1
+    WHERE category = OLD.category;
+END;
+
+CREATE TRIGGER IF NOT EXISTS operations_update AFTER UPDATE OF amount, category, operation_type ON operations BEGIN
+    UPDATE category_totals SET
+        income = income - (CASE WHEN OLD.operation_type = 'income' THEN OLD.amount ELSE 0 END),
+        expense = expense - (CASE WHEN OLD.operation_type = 'expense' THEN OLD.amount ELSE 0 END),
+        count = count - 1
+    WHERE category = OLD.category;
+    INSERT INTO category_totals (category, first_id) VALUES (NEW.category, NEW.id)
+        ON CONFLICT (category) DO NOTHING;
+    UPDATE category_totals SET
+        income = income + (CASE WHEN NEW.operation_type = 'income' THEN NEW.amount ELSE 0 END),
+        expense = expense + (CASE WHEN NEW.operation_type = 'expense' THEN NEW.amount ELSE 0 END),
+        count = count + 1
+    WHERE category = NEW.category;
+END;
+"""
+
+# Индексы и триггер вставки пересоздаются после массового импорта: построить индекс
+# по готовой таблице быстрее, чем обновлять его на каждой строке
+INDEXES = {
+    'operations_date': "CREATE INDEX IF NOT EXISTS operations_date ON operations(date)",
+    'operations_category': "CREATE INDEX IF NOT EXISTS operations_category ON operations(category)",
+}
+
+INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS operations_insert AFTER INSERT ON operations BEGIN
+    INSERT INTO category_totals (category, first_id) VALUES (NEW.category, NEW.id)
+        ON CONFLICT (category) DO NOTHING;
+    UPDATE category_totals SET
+        income = income + (CASE WHEN NEW.operation_type = 'income' THEN NEW.amount ELSE 0 END),
+        expense = expense + (CASE WHEN NEW.operation_type = 'expense' THEN NEW.amount ELSE 0 END),
+        count = count + 1
+    WHERE category = NEW.category;
+END
+"""
+
+SELECT_FIELDS = "SELECT " + ", ".join(FIELDS) + " FROM operations"
+TRIGGERS = ('operations_insert', 'operations_delete', 'operations_update')
+
+
+def is_sqlite_path(path):
+    return str(path).lower().endswith(SQLITE_EXTENSIONS)
+
+
+def row_to_dict(cursor, row):
+    # Первое поле - amount: наружу сумма выдаётся числом, как у storage.Database
+    row = dict(zip(FIELDS, row))
+    row['amount'] = from_minor(row['amount'])
+    return row
+
+
+def upgrade_schema(connection):
+    # Файлы прежних версий хранили суммы REAL: таблицы пересоздаются с целыми младшими
+    # единицами, итоги по категориям пересчитываются. Файл, записанный с другим числом
+    # знаков, переводится в текущее (если цифры не теряются). Триггеры и индексы
+    # после этого создаются заново
+    tables = {name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'operations' not in tables:
+        return
+    kind = next(kind for cid, name, kind, *rest in connection.execute("PRAGMA table_info(operations)")
+                if name == 'amount')
+    digits = None
+    if 'settings' in tables:
+        row = connection.execute("SELECT value FROM settings WHERE name = 'amount_digits'").fetchone()
+        digits = None if row is None else int(row[0])
+    if kind.upper() != 'REAL' and digits in (None, utils.AMOUNT_DIGITS):
+        return
+    with connection:
+        connection.execute("BEGIN")
+        for name in TRIGGERS:
+            connection.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for name in INDEXES:
+            connection.execute(f"DROP INDEX IF EXISTS {name}")
+        if kind.upper() == 'REAL':
+            connection.execute("ALTER TABLE operations RENAME TO operations_real")
+            connection.execute("ALTER TABLE category_totals RENAME TO category_totals_real")
+            connection.execute(OPERATIONS_TABLE)
+            connection.execute(TOTALS_TABLE)
+            connection.execute(
+                "INSERT INTO operations (id, amount, category, date, comment, operation_type) "
+                "SELECT id, CAST(ROUND(amount * ?) AS INTEGER), category, date, comment, operation_type "
+                "FROM operations_real", (utils.AMOUNT_SCALE,)
+            )
+            connection.execute(
+                "INSERT INTO category_totals (category, first_id, income, expense, count) "
+                "SELECT t.category, t.first_id, "
+                "COALESCE(SUM(CASE WHEN o.operation_type = 'income' THEN o.amount END), 0), "
+                "COALESCE(SUM(CASE WHEN o.operation_type = 'expense' THEN o.amount END), 0), COUNT(o.id) "
+                "FROM category_totals_real t LEFT JOIN operations o ON o.category = t.category "
+                "GROUP BY t.category"
+            )
+            connection.execute("DROP TABLE operations_real")
+            connection.execute("DROP TABLE category_totals_real")
+        elif digits < utils.AMOUNT_DIGITS:
+            factor = 10 ** (utils.AMOUNT_DIGITS - digits)
+            connection.execute("UPDATE operations SET amount = amount * ?", (factor,))
+            connection.execute("UPDATE category_totals SET income = income * ?, expense = expense * ?",
+                               (factor, factor))
+        else:
+            factor = 10 ** (digits - utils.AMOUNT_DIGITS)
+            if connection.execute("SELECT COUNT(*) FROM operations WHERE amount % ? != 0", (factor,)).fetchone()[0]:
+                raise ValueError(f"Суммы записаны с точностью {digits} знаков, задано {utils.AMOUNT_DIGITS}")
+            connection.execute("UPDATE operations SET amount = amount / ?", (factor,))
+            connection.execute("UPDATE category_totals SET income = income / ?, expense = expense / ?",
+                               (factor, factor))
+
+
+def row_fingerprint(amount, row):
+    # amount - в младших единицах, остальные поля - из строки таблицы
+    return fingerprint(amount, date_to_ordinal(row['date']), row['category'],
+                       OPERATION_TYPES.index(row['operation_type']), row['comment'])
+
+
+def normalize_fields(fields):
+    # Проверка и приведение полей операции к виду, в котором они хранятся в таблице
+    values = {}
+    for key, value in fields.items():
+        if key == 'amount':
+            values[key] = to_minor(value)
+        elif key == 'date':
+            values[key] = ordinal_to_date(date_to_ordinal(value))
+        elif key == 'operation_type':
+            if value not in OPERATION_TYPES:
+                raise ValueError(f"Неизвестный тип операции: {value}")
+            values[key] = value
+        elif key == 'category':
+            values[key] = str(value)
+        elif key == 'comment':
+            values[key] = '' if value is None else str(value)
+        else:
+            raise KeyError(key)
+    return values
+
+
+class SQLiteOperationsView(Sequence):
+    # Операции таблицы в порядке id (выборки query - в порядке дат);
+    # строки читаются курсором порциями по FETCH_SIZE
+    def __init__(self, db, where='', params=(), order='id'):
+        self.db = db
+        self.where = where
+        self.params = params
+        self.order = order
+
+    def __len__(self):
+        if not self.where:
+            return self.db.count
+        return self.db.raw("SELECT COUNT(*) FROM operations" + self.where, self.params)[0][0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            rows = self.db.conn.execute(
+                SELECT_FIELDS + self.where + " ORDER BY " + self.order + " LIMIT ? OFFSET ?",
+                self.params + (max(0, stop - start), start)
+            ).fetchall()
+            return rows[::step]
+        if index < 0:
+            index += len(self)
+        row = self.db.conn.execute(
+            SELECT_FIELDS + self.where + " ORDER BY " + self.order + " LIMIT 1 OFFSET ?", self.params + (index,)
+        ).fetchone()
+        if row is None:
+            raise IndexError("Индекс операции вне диапазона")
+        return row
+
+    def __iter__(self):
+        return self.fetch(SELECT_FIELDS + self.where + " ORDER BY " + self.order, self.params)
+
+    def iter_after(self, operation_id=None):
+        where = self.where + (" AND " if self.where else " WHERE ") + "id > ?"
+        return self.fetch(SELECT_FIELDS + where + " ORDER BY id", self.params + (operation_id or 0,))
+
+    def fetch(self, sql, params):
+        cursor = self.db.conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+
+class SQLiteDatabase:
+    # Тот же интерфейс, что у storage.Database, но данные живут в файле SQLite:
+    # при открытии ничего не загружается, фильтры и суммы считает сам SQLite
+    def __init__(self, path, connect=True):
+        self.path = path
+        self.connection = None
+        # Снимок (snapshot): соединение держит транзакцию чтения и видит файл на момент открытия
+        self.pinned = False
+        self.listeners = []
+        self.count = 0
+        self.next_id = 1
+        self.text_index = None
+        # Отпечатки операций для поиска повторов при импорте - в памяти, строятся по запросу
+        self.fingerprints = None
+        if connect:
+            self.conn
+
+    @property
+    def conn(self):
+        # Соединение создаётся в том потоке, который первым обратился к базе
+        if self.connection is None:
+            connection = sqlite3.connect(self.path)
+            if not self.pinned:
+                # Схему переводит и настройки пишет только соединение-писатель: снимок
+                # открывает файл, который писатель уже подготовил, и ничего в нём не меняет
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                upgrade_schema(connection)
+                connection.executescript(SCHEMA)
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('amount_digits', ?)",
+                                       (utils.AMOUNT_DIGITS,))
+                for index in INDEXES.values():
+                    connection.execute(index)
+                connection.execute(INSERT_TRIGGER)
+            connection.row_factory = row_to_dict
+            if self.pinned:
+                # В режиме WAL первое чтение транзакции фиксирует версию файла до её конца:
+                # число строк и все запросы снимка видят одно и то же состояние
+                connection.execute("BEGIN")
+            self.connection = connection
+            self.count, max_id = self.raw(
+                "SELECT (SELECT COALESCE(SUM(count), 0) FROM category_totals), "
+                "(SELECT COALESCE(MAX(id), 0) FROM operations)"
+            )[0]
+            self.next_id = max_id + 1
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def notify(self, event, operation_id, old, new):
+        for listener in self.listeners:
+            listener(event, operation_id, old, new)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    @property
+    def operations(self):
+        return SQLiteOperationsView(self)
+
+    def get_all_operations(self):
+        return self.operations
+
+    def snapshot(self):
+        # Соединение снимка откроется в том потоке, где снимок будет использован (sqlite3
+        # не передаёт соединения между потоками), и закрывается вызывающим через close()
+        snapshot = SQLiteDatabase(self.path, connect=False)
+        snapshot.pinned = True
+        return snapshot
+
+    def import_copy(self):
+        # Отдельное соединение-писатель для импорта в фоновом потоке (см. storage.Database.import_copy);
+        # открывается в потоке импорта, закрывается вызывающим через close()
+        copy = SQLiteDatabase(self.path, connect=False)
+        copy.events = []
+        copy.add_listener(lambda *event: copy.events.append(event))
+        return copy
+
+    def prepare_indexes(self, like):
+        if like.fingerprints is not None:
+            self.fingerprint_index()
+        if like.text_index is not None:
+            self.search_index()
+
+    def adopt(self, copy):
+        # Строки импорта уже в файле: базе остаётся принять счётчики и индексы копии
+        self.count = copy.count
+        self.next_id = copy.next_id
+        self.fingerprints = copy.fingerprints
+        self.text_index = copy.text_index
+        for event in copy.events:
+            self.notify(*event)
+
+    def total(self):
+        # Число операций; у снимка сначала открывается соединение, иначе count ещё 0
+        self.conn
+        return self.count
+
+    @timed('sqlite.add_operation')
+    def add_operation(self, operation):
+        try:
+            values = normalize_fields(operation.to_dict())
+            # id выдаётся явно, как при импорте: иначе SQLite повторил бы id удалённой последней строки
+            conn = self.conn
+            operation_id = self.next_id
+            with conn:
+                conn.execute(
+                    "INSERT INTO operations (id, amount, category, date, comment, operation_type) "
+                    "VALUES (:id, :amount, :category, :date, :comment, :operation_type)",
+                    dict(values, id=operation_id)
+                )
+            self.count += 1
+            self.next_id = operation_id + 1
+            if self.text_index is not None:
+                self.text_index.add(operation_id, values['category'], values['comment'])
+            if self.fingerprints is not None:
+                self.fingerprints.add(row_fingerprint(values['amount'], values))
+            if self.listeners:
+                self.notify('add', operation_id, None, self.get(operation_id))
+            return operation_id
+        except Exception as e:
+            print(f"Ошибка при добавлении операции: {str(e)}")
+            error('sqlite.add_operation', e)
+            return False
+
+    def get(self, operation_id):
+        return self.conn.execute(SELECT_FIELDS + " WHERE id = ?", (operation_id,)).fetchone()
+
+    @timed('sqlite.update')
+    def update(self, operation_id, **fields):
+        try:
+            if 'id' in fields:
+                raise KeyError("Поле id нельзя изменить")
+            values = normalize_fields(fields)
+            old = self.get(operation_id)
+            if old is None:
+                raise KeyError(f"Операция {operation_id} не найдена")
+            if values:
+                assignments = ", ".join(f"{key} = :{key}" for key in values)
+                with self.conn:
+                    self.conn.execute(f"UPDATE operations SET {assignments} WHERE id = :id",
+                                      dict(values, id=operation_id))
+            new = self.get(operation_id)
+            if self.text_index is not None:
+                self.text_index.update(operation_id, old['category'], old['comment'], new['category'], new['comment'])
+            if self.fingerprints is not None:
+                self.fingerprints.remove(row_fingerprint(to_minor(old['amount']), old))
+                self.fingerprints.add(row_fingerprint(to_minor(new['amount']), new))
+            if self.listeners:
+                self.notify('update', operation_id, old, new)
+            return True
+        except Exception as e:
+            print(f"Ошибка при изменении операции: {str(e)}")
+            error('sqlite.update', e)
+            return False
+
+    @timed('sqlite.delete')
+    def delete(self, operation_id):
+        try:
+            old = self.get(operation_id)
+            if old is None:
+                raise KeyError(f"Операция {operation_id} не найдена")
+            with self.conn:
+                self.conn.execute("DELETE FROM operations WHERE id = ?", (operation_id,))
+            self.count -= 1
+            if self.text_index is not None:
+                self.text_index.remove(operation_id, old['category'], old['comment'])
+            if self.fingerprints is not None:
+                self.fingerprints.remove(row_fingerprint(to_minor(old['amount']), old))
+            if self.listeners:
+                self.notify('delete', operation_id, old, None)
+            return True
+        except Exception as e:
+            print(f"Ошибка при удалении операции: {str(e)}")
+            error('sqlite.delete', e)
+            return False
+
+    def query(self, start=None, end=None, category=None, operation_type=None):
+        # Фильтр по периоду (даты включительно), категории и типу; выполняется в SQLite
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(ordinal_to_date(date_to_ordinal(start)))
+        if end is not None:
+            conditions.append("date <= ?")
+            params.append(ordinal_to_date(date_to_ordinal(end)))
+        if category is not None:
+            conditions.append("category = ?")
+            params.append(category)
+        if operation_type is not None:
+            conditions.append("operation_type = ?")
+            params.append(operation_type)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return SQLiteOperationsView(self, where, tuple(params), order='date, id')
+
+    def search_index(self):
+        # Индекс поиска - в памяти, как у storage.Database; строится одним проходом по таблице
+        if self.text_index is None:
+            text_index = TextIndex()
+            for operation_id, category, comment in self.fetch_raw(
+                    "SELECT id, category, comment FROM operations ORDER BY id"):
+                text_index.add(operation_id, category, comment)
+            self.text_index = text_index
+        return self.text_index
+
+    def search(self, text):
+        return SearchView(self.search_index().search(text), self.get)
+
+    def fingerprint_index(self):
+        if self.fingerprints is None:
+            fingerprints = FingerprintIndex()
+            for amount, category, date, comment, operation_type in self.fetch_raw(
+                    "SELECT amount, category, date, comment, operation_type FROM operations"):
+                fingerprints.add(fingerprint(amount, date_to_ordinal(date), category,
+                                             OPERATION_TYPES.index(operation_type), comment))
+            self.fingerprints = fingerprints
+        return self.fingerprints
+
+    def fetch_raw(self, sql, params=()):
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def get_type_totals(self):
+        income, expense = self.raw(
+            "SELECT COALESCE(SUM(income), 0), COALESCE(SUM(expense), 0) FROM category_totals"
+        )[0]
+        return {'income': from_minor(income), 'expense': from_minor(expense)}
+
+    def get_balance(self):
+        income, expense = self.raw(
+            "SELECT COALESCE(SUM(income), 0), COALESCE(SUM(expense), 0) FROM category_totals"
+        )[0]
+        return from_minor(income - expense)
+
+    def get_category_totals(self):
+        rows = self.raw(
+            "SELECT category, income, expense FROM category_totals WHERE count > 0 ORDER BY first_id"
+        )
+        return {category: from_minor(income - expense) for category, income, expense in rows}
+
+    def column_chunks(self, size=COLUMN_CHUNK_SIZE):
+        # (категории в порядке первого появления, итератор порций) для analysis.AnalyticsEngine.
+        # Порция - кортежи столбцов (id, суммы, категории, порядковые номера дат, коды типов):
+        # даты и типы переводит сам SQLite, словари строк не создаются
+        names = [name for name, in self.raw("SELECT category FROM category_totals ORDER BY first_id")]
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(
+            "SELECT id, amount, category, CAST(julianday(date) - ? AS INTEGER), "
+            "CASE operation_type WHEN 'income' THEN ? ELSE ? END FROM operations ORDER BY id",
+            (JULIAN_OFFSET, OPERATION_TYPES.index('income'), OPERATION_TYPES.index('expense'))
+        )
+
+        def chunks():
+            while True:
+                rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                yield tuple(zip(*rows))
+        return names, chunks()
+
+    def check_totals(self):
+        # Сверка таблицы сумм с полным пересчётом по operations; суммы целые и должны совпадать точно
+        expected = {
+            category: (income, expense, count)
+            for category, income, expense, count in self.raw(
+                "SELECT category, "
+                "SUM(CASE WHEN operation_type = 'income' THEN amount ELSE 0 END), "
+                "SUM(CASE WHEN operation_type = 'expense' THEN amount ELSE 0 END), COUNT(*) "
+                "FROM operations GROUP BY category"
+            )
+        }
+        actual = {
+            category: (income, expense, count)
+            for category, income, expense, count in self.raw(
+                "SELECT category, income, expense, count FROM category_totals WHERE count > 0"
+            )
+        }
+        return expected == actual
+
+    def raw(self, sql, params=()):
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        return cursor.execute(sql, params).fetchall()
+
+    @timed('sqlite.import_batches')
+    def import_batches(self, batches, result, strict=False, duplicates='keep'):
+        # Весь файл - одна транзакция; каждая порция вставляется одним executemany.
+        # Триггер вставки на время импорта снимается, суммы по категориям берутся
+        # из порций. Если первая порция не меньше таблицы, снимаются и индексы.
+        # Отпечатки добавленных строк попадают в индекс повторов только после COMMIT
+        conn = self.conn
+        next_id = self.next_id
+        rebuild = None
+        added = []
+        imported = []
+        try:
+            if duplicates != 'keep':
+                batches = filter_duplicates(batches, self.fingerprint_index(), duplicates, result)
+            with conn:
+                conn.execute("BEGIN")
+                conn.execute("DROP TRIGGER operations_insert")
+                for batch in batches:
+                    count = len(batch)
+                    if rebuild is None:
+                        rebuild = count >= self.count
+                        if rebuild:
+                            for name in INDEXES:
+                                conn.execute(f"DROP INDEX {name}")
+                    conn.executemany(
+                        "INSERT INTO operations (id, amount, category, date, comment, operation_type) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        zip(
+                            range(next_id, next_id + count),
+                            batch.amounts,
+                            batch.categories,
+                            map(ordinal_to_date, batch.dates),
+                            batch.comments,
+                            (OPERATION_TYPES[code] for code in batch.types)
+                        )
+                    )
+                    self.add_totals(batch, next_id)
+                    if self.fingerprints is not None:
+                        added.append(batch.fingerprints if batch.fingerprints is not None
+                                     else batch.row_fingerprints())
+                    if self.listeners:
+                        imported.append((next_id, batch))
+                    next_id += count
+                    result.added += count
+                if strict and result.errors:
+                    raise ValueError(f"Строк с ошибками: {len(result.errors)}, импорт отменён")
+                if rebuild:
+                    for index in INDEXES.values():
+                        conn.execute(index)
+                conn.execute(INSERT_TRIGGER)
+            result.ok = True
+        except Exception as e:
+            result.added = 0
+            result.duplicates = 0
+            result.duplicate_rows = []
+            result.ok = False
+            result.message = str(e)
+            print(f"Ошибка при импорте: {str(e)}")
+            error('sqlite.import_batches', e)
+            return result
+        self.next_id = next_id
+        for keys in added:
+            for key in keys:
+                self.fingerprints.add(key)
+        self.count += result.added
+        stats.count('sqlite.rows_imported', result.added)
+        # Индекс поиска дочитает новые строки при следующем построении
+        self.text_index = None
+        # Слушатели получают по событию 'import' на порцию: первый id и сама порция
+        for batch_id, batch in imported:
+            self.notify('import', batch_id, None, batch)
+        return result
+
+    def add_totals(self, batch, first_id):
+        # То же, что делает триггер вставки, но одной командой на категорию порции
+        # Коды категорий в порции выдаются в порядке первого появления
+        first = {name: first_id + batch.category_codes.index(code)
+                 for code, name in enumerate(batch.category_names)}
+        self.conn.executemany(
+            "INSERT INTO category_totals (category, first_id, income, expense, count) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (category) DO UPDATE SET "
+            "income = income + excluded.income, expense = expense + excluded.expense, "
+            "count = count + excluded.count",
+            (
+                (category, first[category],
+                 amount if code == 0 else 0, amount if code == 1 else 0, count)
+                for (category, code), (amount, count) in batch.totals.items()
+            )
+        )
+
+    def import_from_csv(self, filename, chunk_size=IMPORT_CHUNK_SIZE, strict=False, progress=None,
+                         duplicates='keep'):
+        result = ImportResult(filename)
+        return self.import_batches(parse_csv(filename, result, chunk_size, progress), result, strict, duplicates)
+
+    def import_from_json(self, filename, chunk_size=IMPORT_CHUNK_SIZE, strict=False, progress=None,
+                         duplicates='keep'):
+        result = ImportResult(filename)
+        return self.import_batches(parse_json(filename, result, chunk_size, progress), result, strict, duplicates)
+
+    def import_from_ndjson(self, filename, chunk_size=IMPORT_CHUNK_SIZE, strict=False, progress=None,
+                         duplicates='keep'):
+        result = ImportResult(filename)
+        return self.import_batches(parse_ndjson(filename, result, chunk_size, progress), result, strict, duplicates)
+
+    def iter_rows(self):
+        return iter(self.operations)
+
+    @timed('sqlite.export_to_json')
+    def export_to_json(self, filename, progress=None, indent=4):
+        try:
+            write_json(filename, track_progress(self.iter_rows(), self.total(), progress), indent)
+            return True
+        except Exception as e:
+            print(f"Ошибка при экспорте в JSON: {str(e)}")
+            error('sqlite.export_to_json', e)
+            return False
+
+    @timed('sqlite.export_to_ndjson')
+    def export_to_ndjson(self, filename, progress=None):
+        try:
+            write_ndjson(filename, track_progress(self.iter_rows(), self.total(), progress))
+            return True
+        except Exception as e:
+            print(f"Ошибка при экспорте в NDJSON: {str(e)}")
+            error('sqlite.export_to_ndjson', e)
+            return False
+
+    @timed('sqlite.export_to_csv')
+    def export_to_csv(self, filename, progress=None):
+        try:
+            rows = ((row[0], format_minor(row[1])) + row[2:] for row in self.fetch_raw(
+                "SELECT " + ", ".join(CSV_FIELDS) + " FROM operations ORDER BY id"))
+            write_csv(filename, track_progress(rows, self.total(), progress))
+            return True
+        except Exception as e:
+            print(f"Ошибка при экспорте в CSV: {str(e)}")
+            error('sqlite.export_to_csv', e)
+            return False
+
+    @timed('sqlite.export_to_snapshot')
+    def export_to_snapshot(self, filename, progress=None):
+        # Двоичный снимок пишется из колоночного хранилища, поэтому строки сначала собираются в него
+        try:
+            from snapshot import write_snapshot
+            store = ColumnStore()
+            for row in track_progress(self.iter_rows(), self.total(), progress):
+                store.append(row['id'], row['amount'], row['category'], row['date'],
+                             row['comment'], row['operation_type'])
+            write_snapshot(filename, store, self.next_id)
+            return True
+        except Exception as e:
+            print(f"Ошибка при записи снимка: {str(e)}")
+            error('sqlite.export_to_snapshot', e)
+            return False
+
+    def export(self, filename, progress=None):
+        return export_by_extension(self, filename, progress)
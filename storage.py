@@ -3,80 +3,1620 @@
 import json
 import csv
 import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import partial
+from heapq import merge
+from itertools import chain, compress, islice
+from collections.abc import Mapping, Sequence
+from models import ImportResult
+from instrumentation import timed, error, stats
+from utils import date_to_ordinal, ordinal_to_date, to_minor, from_minor, format_minor
+
+# Порядок полей совпадает с Operation.to_dict() + id, как в data/2.json
+FIELDS = ('amount', 'category', 'date', 'comment', 'operation_type', 'id')
+CSV_FIELDS = ('id', 'amount', 'category', 'date', 'operation_type', 'comment')
+OPERATION_TYPES = ('income', 'expense')
+
+# Уплотнение хранилища после удалений: когда удалённых строк больше четверти
+COMPACT_MIN_DELETED = 1024
+COMPACT_RATIO = 4
+
+# Столбцы, которые копия хранилища (снимок базы) делит с исходным до первого изменения
+SHARED_COLUMNS = ('ids', 'amounts', 'dates', 'types', 'categories', 'alive')
+# Комментарии делятся между копиями кусками по 2**COMMENT_CHUNK_BITS строк
+COMMENT_CHUNK_BITS = 12
+COMMENT_CHUNK = 1 << COMMENT_CHUNK_BITS
+COMMENT_CHUNK_MASK = COMMENT_CHUNK - 1
+# Поле строки -> столбец, который меняет его правка
+FIELD_COLUMNS = {'amount': 'amounts', 'category': 'categories', 'date': 'dates', 'operation_type': 'types'}
+
+# Как часто (в строках) сообщать о прогрессе длинных операций
+PROGRESS_STEP = 10000
+
+# Импорт разбирает файл порциями и добавляет каждую порцию в хранилище целиком
+IMPORT_CHUNK_SIZE = 50000
+
+# JSON читается и пишется потоково, блоками по JSON_READ_SIZE символов
+JSON_READ_SIZE = 1 << 16
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+# Двоичный снимок базы (snapshot.py), открывается через mmap
+SNAPSHOT_EXTENSIONS = ('.fpsnap',)
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Поиск: слова комментариев и категорий без учёта регистра, ё = е
+TOKEN = re.compile(r'\w+')
+TOKEN_CACHE_SIZE = 1 << 16
+SEARCH_BISECT_RATIO = 16
+
+# Повторы при импорте: keep - добавлять всё, skip - пропускать строки, которые уже есть
+# в базе, merge - объединять как мультимножества: из k одинаковых строк файла добавляются
+# только те, которых в базе меньше k (повторный импорт той же выписки ничего не добавляет)
+DUPLICATE_POLICIES = ('keep', 'skip', 'merge')
+
+
+def track_progress(items, total, progress):
+    # progress(сделано, всего) вызывается каждые PROGRESS_STEP элементов и в конце
+    if progress is None:
+        yield from items
+        return
+    done = 0
+    for item in items:
+        yield item
+        done += 1
+        if done % PROGRESS_STEP == 0:
+            progress(done, total)
+    progress(done, total)
+
+
+def normalize_comment(comment):
+    # Регистр, ё/е и пробелы в комментариях выписок разных банков не различаются
+    return ' '.join(comment.casefold().replace('ё', 'е').split())
+
+
+def fingerprint(amount, date, category, operation_type, comment):
+    # Отпечаток операции для поиска повторов: amount - в младших единицах, date - порядковый
+    # номер дня, operation_type - код.
+    # Хранится хеш, а не кортеж: индекс на миллионы строк занимает в разы меньше памяти.
+    # Хеш строк зависит от запуска, поэтому индекс не сохраняется, а строится заново
+    return hash((amount, date, category, operation_type, normalize_comment(comment)))
+
+
+def extract_fields(op):
+    return op['amount'], op['category'], op['date'], op.get('comment'), op['operation_type']
+
+
+class ImportBatch:
+    # Порция проверенных строк импорта в колоночном виде. Категории - коды внутри порции
+    # и список их имён; коды хранилища выдаются при добавлении один раз на имя.
+    # Суммы - целые младшие единицы (utils.to_minor), по (категория, тип) считаются сразу
+    def __init__(self):
+        self.amounts = array('q')
+        self.dates = array('i')
+        self.types = array('b')
+        self.category_codes = array('i')
+        self.category_names = []
+        self.category_index = {}
+        self.comments = []
+        self.totals = {}
+        # Отпечатки строк, если их уже посчитал отбор повторов
+        self.fingerprints = None
+        # Запись журнала для этой порции, закодированная заранее (journal.Journal.prepare)
+        self.journal_line = None
+
+    @property
+    def categories(self):
+        names = self.category_names
+        return [names[code] for code in self.category_codes]
+
+    def __getstate__(self):
+        # Порции передаются из процессов разбора (bulk_import.py): комментарии - одной
+        # строкой через '\0', это в разы быстрее, чем список из миллиона строк
+        state = self.__dict__.copy()
+        del state['category_index']
+        comments = '\0'.join(self.comments)
+        if comments.count('\0') == len(self.comments) - 1:
+            state['comments'] = comments
+        return state
+
+    def __setstate__(self, state):
+        comments = state['comments']
+        if isinstance(comments, str):
+            state['comments'] = comments.split('\0')
+        self.__dict__.update(state)
+        self.category_index = {name: code for code, name in enumerate(self.category_names)}
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def row_fingerprints(self):
+        names = self.category_names
+        return list(map(fingerprint, self.amounts, self.dates,
+                        (names[code] for code in self.category_codes), self.types, self.comments))
+
+    @classmethod
+    def from_columns(cls, columns):
+        # Порция из столбцов записи журнала (columns): суммы по (категория, тип) пересчитываются
+        batch = cls()
+        batch.amounts = array('q', columns['amounts'])
+        batch.dates = array('i', columns['dates'])
+        batch.types = array('b', columns['types'])
+        batch.category_codes = array('i', columns['codes'])
+        batch.category_names = list(columns['categories'])
+        batch.category_index = {name: code for code, name in enumerate(batch.category_names)}
+        batch.comments = list(columns['comments'])
+        if not len(batch.amounts) == len(batch.dates) == len(batch.types) == len(batch.category_codes) \
+                == len(batch.comments):
+            raise ValueError("Столбцы порции разной длины")
+        batch.count_totals()
+        return batch
+
+    def columns(self):
+        # Порция одним словарем списков: так она пишется в журнал (journal.py)
+        return {
+            'amounts': self.amounts.tolist(),
+            'dates': self.dates.tolist(),
+            'types': self.types.tolist(),
+            'categories': self.category_names,
+            'codes': self.category_codes.tolist(),
+            'comments': self.comments,
+        }
+
+    def count_totals(self):
+        names = self.category_names
+        totals = self.totals = {}
+        for code, amount, operation_type in zip(self.category_codes, self.amounts, self.types):
+            key = (names[code], operation_type)
+            entry = totals.get(key)
+            if entry is None:
+                totals[key] = [amount, 1]
+            else:
+                entry[0] += amount
+                entry[1] += 1
+
+    def row(self, pos):
+        return {
+            'amount': from_minor(self.amounts[pos]),
+            'category': self.category_names[self.category_codes[pos]],
+            'date': ordinal_to_date(self.dates[pos]),
+            'comment': self.comments[pos],
+            'operation_type': OPERATION_TYPES[self.types[pos]],
+        }
+
+    def subset(self, positions):
+        # Порция только из строк positions. Коды категорий нумеруются заново в порядке
+        # первого появления, как в add: в порции нет имён без строк
+        batch = ImportBatch()
+        batch.amounts = array('q', map(self.amounts.__getitem__, positions))
+        batch.dates = array('i', map(self.dates.__getitem__, positions))
+        batch.types = array('b', map(self.types.__getitem__, positions))
+        batch.comments = list(map(self.comments.__getitem__, positions))
+        names = self.category_names
+        index = batch.category_index
+        codes = batch.category_codes
+        totals = batch.totals
+        for pos, amount, operation_type in zip(positions, batch.amounts, batch.types):
+            category = names[self.category_codes[pos]]
+            code = index.get(category)
+            if code is None:
+                code = index[category] = len(batch.category_names)
+                batch.category_names.append(category)
+            codes.append(code)
+            entry = totals.get((category, operation_type))
+            if entry is None:
+                totals[(category, operation_type)] = [amount, 1]
+            else:
+                entry[0] += amount
+                entry[1] += 1
+        return batch
+
+    def add(self, amount, category, date, comment, operation_type):
+        amount = to_minor(amount)
+        date = date_to_ordinal(date)
+        if operation_type not in OPERATION_TYPES:
+            raise ValueError(f"Неизвестный тип операции: {operation_type}")
+        operation_type = OPERATION_TYPES.index(operation_type)
+        # Категория - всегда строка, как в ColumnStore.encode: число 5 из JSON и "5" - одна категория
+        category = '' if category is None else str(category)
+        if not category:
+            raise ValueError("Категория не может быть пустой")
+
+        code = self.category_index.get(category)
+        if code is None:
+            code = self.category_index[category] = len(self.category_names)
+            self.category_names.append(category)
+
+        self.amounts.append(amount)
+        self.dates.append(date)
+        self.types.append(operation_type)
+        self.category_codes.append(code)
+        self.comments.append('' if comment is None else str(comment))
+        totals = self.totals.get((category, operation_type))
+        if totals is None:
+            self.totals[(category, operation_type)] = [amount, 1]
+        else:
+            totals[0] += amount
+            totals[1] += 1
+
+
+class FingerprintIndex:
+    # Мультимножество отпечатков операций базы: отпечаток -> число таких операций
+    def __init__(self):
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def count(self, key):
+        return self.counts.get(key, 0)
+
+    def add(self, key):
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def remove(self, key):
+        left = self.counts[key] - 1
+        if left:
+            self.counts[key] = left
+        else:
+            del self.counts[key]
+
+
+def filter_duplicates(batches, index, policy, result):
+    # Отбор повторов по индексу отпечатков базы, O(1) на строку. Для каждого отпечатка
+    # запоминается, сколько таких операций было в базе до импорта; добавленные порции
+    # пополняют индекс, но на решение по следующим строкам файла не влияют
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError(f"Неизвестный режим повторов: {policy}")
+    if policy == 'keep':
+        yield from batches
+        return
+    seen = {}
+    for batch in batches:
+        keys = batch.row_fingerprints()
+        keep = []
+        for pos, key in enumerate(keys):
+            state = seen.get(key)
+            if state is None:
+                state = seen[key] = [index.count(key), 0]
+            state[1] += 1
+            if state[0] and (policy == 'skip' or state[1] <= state[0]):
+                result.add_duplicate(batch.row(pos))
+            else:
+                keep.append(pos)
+        if len(keep) < len(keys):
+            batch = batch.subset(keep)
+            keys = [keys[pos] for pos in keep]
+        batch.fingerprints = keys
+        if len(batch):
+            yield batch
+
+
+def build_batches(records, extract, result, chunk_size=IMPORT_CHUNK_SIZE):
+    # records - пары (номер строки, запись), extract(запись) возвращает поля amount,
+    # category, date, comment, operation_type. Ошибочные строки пропускаются
+    # и записываются в result, остальные собираются в порции по chunk_size
+    batch = ImportBatch()
+    add = batch.add
+    size = 0
+    for line, record in records:
+        try:
+            add(*extract(record))
+            size += 1
+        except KeyError as e:
+            result.add_error(line, f"нет поля {e}")
+        except IndexError:
+            result.add_error(line, "не хватает столбцов")
+        except (ValueError, TypeError) as e:
+            result.add_error(line, str(e))
+        if size >= chunk_size:
+            yield batch
+            batch = ImportBatch()
+            add = batch.add
+            size = 0
+    if size:
+        yield batch
+
+
+def parse_csv(filename, result, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    # Потоковое чтение CSV порциями; прогресс - по позиции в байтовом буфере файла
+    total = os.path.getsize(filename)
+    with open(filename, 'r', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        try:
+            columns = [header.index(name)
+                       for name in ('amount', 'category', 'date', 'comment', 'operation_type')]
+        except ValueError:
+            raise ValueError(f"В заголовке CSV нет нужных столбцов: {header}")
+
+        def records():
+            for count, row in enumerate(reader, 1):
+                if progress is not None and count % PROGRESS_STEP == 0:
+                    progress(file.buffer.tell(), total)
+                if row:
+                    yield reader.line_num, row
+
+        def extract(row):
+            return [row[column] for column in columns]
+
+        yield from build_batches(records(), extract, result, chunk_size)
+    if progress is not None:
+        progress(total, total)
+
+
+def iter_json_array(file):
+    # Элементы JSON-массива по одному, без загрузки всего файла в память
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def skip():
+        nonlocal buffer, pos, eof
+        # Пропуск пробелов с дочитыванием, пока в буфере не появится значащий символ
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                return
+            chunk = file.read(JSON_READ_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+    skip()
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError("Ожидался JSON-массив операций")
+    pos += 1
+    skip()
+    if buffer[pos:pos + 1] == ']':
+        return
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = file.read(JSON_READ_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        pos = end
+        skip()
+        separator = buffer[pos:pos + 1]
+        pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError("Ошибка формата JSON: ожидалась ',' или ']'")
+        skip()
+
+
+def parse_json(filename, result, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    # Потоковый разбор JSON-массива (формат data/2.json)
+    total = os.path.getsize(filename)
+    with open(filename, 'r', encoding='utf-8') as file:
+        def records():
+            for count, op in enumerate(iter_json_array(file), 1):
+                if progress is not None and count % PROGRESS_STEP == 0:
+                    progress(file.buffer.tell(), total)
+                yield count, op
+
+        yield from build_batches(records(), extract_fields, result, chunk_size)
+    if progress is not None:
+        progress(total, total)
+
+
+def parse_ndjson(filename, result, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    # NDJSON: одна операция на строку; строка с неверным JSON считается ошибочной
+    total = os.path.getsize(filename)
+    with open(filename, 'r', encoding='utf-8') as file:
+        def records():
+            for line, text in enumerate(file, 1):
+                if progress is not None and line % PROGRESS_STEP == 0:
+                    progress(file.buffer.tell(), total)
+                if text.strip():
+                    yield line, text
+
+        def extract(text):
+            return extract_fields(json.loads(text))
+
+        yield from build_batches(records(), extract, result, chunk_size)
+    if progress is not None:
+        progress(total, total)
+
+
+def parse_file(filename, result, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    # Формат определяется по расширению файла
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        parse = parse_csv
+    elif extension in NDJSON_EXTENSIONS:
+        parse = parse_ndjson
+    else:
+        parse = parse_json
+    return parse(filename, result, chunk_size, progress)
+
+
+def write_json(filename, rows, indent=4):
+    # Массив пишется по одной операции; indent=None - компактный вид без отступов
+    if indent is None:
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        newline = ''
+    else:
+        encoder = json.JSONEncoder(ensure_ascii=False, indent=indent)
+        newline = '\n' + ' ' * indent
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write('[')
+        first = True
+        for row in rows:
+            file.write(newline if first else ',' + newline)
+            first = False
+            text = encoder.encode(row)
+            file.write(text.replace('\n', newline) if newline else text)
+        if not first and newline:
+            file.write('\n')
+        file.write(']')
+
+
+def write_ndjson(filename, rows):
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    with open(filename, 'w', encoding='utf-8') as file:
+        for row in rows:
+            file.write(encoder.encode(row))
+            file.write('\n')
+
+
+def write_csv(filename, rows):
+    # rows - кортежи значений в порядке CSV_FIELDS
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_FIELDS)
+        writer.writerows(rows)
+
+
+def export_by_extension(db, filename, progress=None):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in SNAPSHOT_EXTENSIONS:
+        return db.export_to_snapshot(filename, progress)
+    if extension == '.csv':
+        return db.export_to_csv(filename, progress)
+    if extension in NDJSON_EXTENSIONS:
+        return db.export_to_ndjson(filename, progress)
+    return db.export_to_json(filename, progress)
+
+
+def tokenize(text):
+    return TOKEN.findall(text.casefold().replace('ё', 'е'))
+
+
+class TextIndex:
+    # Обратный индекс: слово -> упорядоченный массив id операций, в которых оно встречается
+    # (в комментарии или категории), плюс отсортированный словарь слов для поиска по префиксу.
+    # Массивы поддерживаются точными при добавлении, правке и удалении, поэтому поиск
+    # выдаёт строки по возрастанию id лениво, не собирая множества целиком
+    def __init__(self):
+        self.postings = {}
+        self.sorted_words = None
+        self.token_cache = {}
+        # Растёт при каждом изменении массивов: незаконченный поиск начинается заново
+        self.version = 0
+
+    def tokens(self, text):
+        tokens = self.token_cache.get(text)
+        if tokens is None:
+            tokens = frozenset(tokenize(text))
+            if len(self.token_cache) >= TOKEN_CACHE_SIZE:
+                self.token_cache.clear()
+            self.token_cache[text] = tokens
+        return tokens
+
+    def row_tokens(self, category, comment):
+        return self.tokens(category) | self.tokens(comment)
+
+    @property
+    def words(self):
+        if self.sorted_words is None:
+            self.sorted_words = sorted(self.postings)
+        return self.sorted_words
+
+    def add(self, operation_id, category, comment, tokens=None):
+        postings = self.postings
+        for token in self.row_tokens(category, comment) if tokens is None else tokens:
+            ids = postings.get(token)
+            if ids is None:
+                postings[token] = ids = array('q')
+                self.sorted_words = None
+            if not ids or ids[-1] < operation_id:
+                ids.append(operation_id)
+            else:
+                i = bisect_left(ids, operation_id)
+                if i == len(ids) or ids[i] != operation_id:
+                    ids.insert(i, operation_id)
+        self.version += 1
+
+    def remove(self, operation_id, category, comment, tokens=None):
+        postings = self.postings
+        for token in self.row_tokens(category, comment) if tokens is None else tokens:
+            ids = postings.get(token)
+            if ids is None:
+                continue
+            i = bisect_left(ids, operation_id)
+            if i < len(ids) and ids[i] == operation_id:
+                del ids[i]
+                if not ids:
+                    del postings[token]
+                    self.sorted_words = None
+        self.version += 1
+
+    def update(self, operation_id, old_category, old_comment, category, comment):
+        old = self.row_tokens(old_category, old_comment)
+        new = self.row_tokens(category, comment)
+        self.remove(operation_id, None, None, old - new)
+        self.add(operation_id, None, None, new - old)
+
+    def matches(self, prefix):
+        # Массивы id всех слов, начинающихся с prefix
+        words = self.words
+        i = bisect_left(words, prefix)
+        result = []
+        while i < len(words) and words[i].startswith(prefix):
+            result.append(self.postings[words[i]])
+            i += 1
+        return result
+
+    def search(self, text):
+        # Итератор id по возрастанию: каждое слово запроса - начало какого-то слова
+        # комментария или категории. Если индекс изменился во время обхода (добавление,
+        # правка, удаление), поиск повторяется с id после последнего выданного, поэтому
+        # id не повторяются и не пропускаются
+        prefixes = list(dict.fromkeys(tokenize(text)))
+        last = None
+        while prefixes:
+            version = self.version
+            for operation_id in self.search_after(prefixes, last):
+                yield operation_id
+                last = operation_id
+                if self.version != version:
+                    break
+            else:
+                return
+
+    def search_after(self, prefixes, last=None):
+        # Перебирается самая короткая группа массивов (с id больше last),
+        # вхождение в остальные проверяется по множеству или двоичным поиском
+        groups = [self.matches(prefix) for prefix in prefixes]
+        if not all(groups):
+            return iter(())
+        sizes = [sum(map(len, arrays)) for arrays in groups]
+        order = sorted(range(len(groups)), key=sizes.__getitem__)
+        driver = groups[order[0]]
+        if last is not None:
+            driver = [islice(ids, bisect_right(ids, last), None) for ids in driver]
+        ids = iter(driver[0]) if len(driver) == 1 else unique(merge(*driver))
+        for number in order[1:]:
+            arrays = groups[number]
+            if len(arrays) == 1 and sizes[order[0]] * SEARCH_BISECT_RATIO < sizes[number]:
+                # Группа намного больше перебираемой: двоичный поиск дешевле множества
+                ids = filter(partial(contains, arrays[0]), ids)
+            else:
+                ids = filter(set().union(*arrays).__contains__, ids)
+        return ids
+
+
+def unique(ids):
+    # Убирает повторы из упорядоченной последовательности
+    last = None
+    for operation_id in ids:
+        if operation_id != last:
+            last = operation_id
+            yield operation_id
+
+
+def contains(ids, operation_id):
+    # Вхождение id в упорядоченный массив
+    i = bisect_left(ids, operation_id)
+    return i < len(ids) and ids[i] == operation_id
+
+
+class SearchView(Sequence):
+    # Результат поиска: id читаются из индекса по мере обхода и запоминаются,
+    # строки берутся из базы по требованию. len() и индексация дочитывают результат
+    __slots__ = ('_ids', '_found', '_get')
+
+    def __init__(self, ids, get):
+        self._ids = ids
+        self._found = []
+        self._get = get
+
+    def found(self):
+        self._found.extend(self._ids)
+        return self._found
+
+    def iter_ids(self):
+        found = self._found
+        i = 0
+        while True:
+            if i == len(found):
+                operation_id = next(self._ids, None)
+                if operation_id is None:
+                    return
+                found.append(operation_id)
+            yield found[i]
+            i += 1
+
+    def __len__(self):
+        return len(self.found())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(operation_id) for operation_id in self.found()[index]]
+        return self._get(self.found()[index])
+
+    def __iter__(self):
+        for operation_id in self.iter_ids():
+            row = self._get(operation_id)
+            if row is not None:
+                yield row
+
+
+def own_column(column):
+    # Собственная изменяемая копия столбца: memoryview снимка или столбца, общего с копией хранилища
+    if isinstance(column, memoryview):
+        copy = array(column.format)
+        copy.frombytes(column.cast('B'))
+        return copy
+    if isinstance(column, bytearray):
+        return bytearray(column)
+    return array(column.typecode, column)
+
+
+class CommentColumn:
+    # Комментарии списками по COMMENT_CHUNK строк. Копия делит куски с исходным столбцом,
+    # и каждая сторона копирует кусок перед первой записью в него: снимок базы стоит
+    # одного списка ссылок на куски, правка после снимка - копии одного куска
+    __slots__ = ('chunks', 'owned', 'length')
+
+    def __init__(self, values=()):
+        self.chunks = []
+        # owned[номер] - кусок принадлежит только этому столбцу и меняется на месте
+        self.owned = bytearray()
+        self.length = 0
+        self.extend(values)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += self.length
+            if pos < 0:
+                raise IndexError(pos)
+        return self.chunks[pos >> COMMENT_CHUNK_BITS][pos & COMMENT_CHUNK_MASK]
+
+    def own(self, number):
+        if not self.owned[number]:
+            self.chunks[number] = list(self.chunks[number])
+            self.owned[number] = 1
+        return self.chunks[number]
+
+    def __setitem__(self, pos, value):
+        if pos < 0:
+            pos += self.length
+        if not 0 <= pos < self.length:
+            raise IndexError(pos)
+        self.own(pos >> COMMENT_CHUNK_BITS)[pos & COMMENT_CHUNK_MASK] = value
+
+    def __delitem__(self, index):
+        # Поддерживается только отрезание хвоста (del comments[length:]) при откате импорта
+        start = index.start
+        if start >= self.length:
+            return
+        number = start >> COMMENT_CHUNK_BITS
+        offset = start & COMMENT_CHUNK_MASK
+        if offset:
+            del self.own(number)[offset:]
+            number += 1
+        del self.chunks[number:]
+        del self.owned[number:]
+        self.length = start
+
+    def __iter__(self):
+        return chain.from_iterable(self.chunks)
+
+    def append(self, value):
+        if self.length & COMMENT_CHUNK_MASK:
+            self.own(len(self.chunks) - 1).append(value)
+        else:
+            self.chunks.append([value])
+            self.owned.append(1)
+        self.length += 1
+
+    def extend(self, values):
+        values = iter(values)
+        offset = self.length & COMMENT_CHUNK_MASK
+        if offset:
+            chunk = self.own(len(self.chunks) - 1)
+            chunk.extend(islice(values, COMMENT_CHUNK - offset))
+            self.length += len(chunk) - offset
+            if len(chunk) < COMMENT_CHUNK:
+                return
+        while True:
+            chunk = list(islice(values, COMMENT_CHUNK))
+            if not chunk:
+                return
+            self.chunks.append(chunk)
+            self.owned.append(1)
+            self.length += len(chunk)
+            if len(chunk) < COMMENT_CHUNK:
+                return
+
+    def copy(self):
+        column = CommentColumn()
+        column.chunks = list(self.chunks)
+        column.length = self.length
+        column.owned = bytearray(len(self.chunks))
+        self.owned = bytearray(len(self.chunks))
+        return column
+
+
+class ColumnStore:
+    # Колоночное хранилище: по типизированному массиву на поле, суммы - целые
+    # младшие единицы валюты, категории хранятся кодами словаря, комментарии - отдельным списком.
+    # Удаление помечает строку в alive, место освобождается при уплотнении.
+    # Суммы по типам и категориям поддерживаются при каждом изменении строки.
+    # Слушатели получают (событие, id, старая строка, новая строка) на add/update/delete;
+    # строки импорта Database.import_batches передаёт одним событием 'import' (порция ImportBatch).
+    # Индекс по датам (позиции, упорядоченные по дате) строится при первом запросе
+    # и поддерживается при одиночных изменениях; массовые сбрасывают его до следующего запроса.
+    # Копия (copy) делит столбцы с исходным хранилищем, пока одна из сторон их не изменит
+    def __init__(self):
+        self.ids = array('q')
+        self.amounts = array('q')
+        self.dates = array('i')
+        self.types = array('b')
+        self.categories = array('i')
+        self.comments = CommentColumn()
+        self.category_names = []
+        self.category_codes = {}
+        self.alive = bytearray()
+        self.index = {}
+        # Столбцы, общие с копией хранилища или отображённые из файла снимка:
+        # перед изменением копируются (writable)
+        self.shared = set()
+        # Файл снимка, из которого столбцы отображены в память (snapshot.read_snapshot)
+        self.mapped = None
+        self.deleted = 0
+        self.type_totals = [0] * len(OPERATION_TYPES)
+        self.category_totals = []
+        self.category_counts = []
+        self.listeners = []
+        self.date_keys = None
+        self.date_order = None
+        self.date_version = 0
+        self.text_index = None
+        # Отпечатки для поиска повторов при импорте; строятся при первом импорте с отбором
+        self.fingerprints = None
+
+    def __len__(self):
+        return len(self.ids) - self.deleted
+
+    def positions(self):
+        if not self.deleted:
+            return iter(range(len(self.ids)))
+        return compress(range(len(self.ids)), self.alive)
+
+    def find(self, operation_id):
+        return self.id_index().get(operation_id)
+
+    def id_index(self):
+        # Копия хранилища строит словарь id -> позиция при первом обращении
+        if self.index is None:
+            self.index = {self.ids[pos]: pos for pos in self.positions()}
+        return self.index
+
+    def date_index(self):
+        # (даты по возрастанию, позиции строк в том же порядке); удалённые после
+        # построения строки остаются в индексе и отсеиваются по alive
+        if self.date_order is None:
+            positions = self.positions() if self.deleted else range(len(self.ids))
+            order = array('q', sorted(positions, key=self.dates.__getitem__))
+            self.date_keys = array('i', map(self.dates.__getitem__, order))
+            self.date_order = order
+            self.date_version += 1
+        return self.date_keys, self.date_order
+
+    def index_date(self, pos):
+        # Внутри одной даты позиции идут по возрастанию, как после устойчивой сортировки
+        if self.date_order is not None:
+            date = self.dates[pos]
+            low = bisect_left(self.date_keys, date)
+            high = bisect_right(self.date_keys, date)
+            i = bisect_left(self.date_order, pos, low, high)
+            self.date_keys.insert(i, date)
+            self.date_order.insert(i, pos)
+            self.date_version += 1
+
+    def unindex_date(self, pos):
+        if self.date_order is not None:
+            date = self.dates[pos]
+            low = bisect_left(self.date_keys, date)
+            high = bisect_right(self.date_keys, date)
+            i = bisect_left(self.date_order, pos, low, high)
+            del self.date_keys[i]
+            del self.date_order[i]
+            self.date_version += 1
+
+    def reset_date_index(self):
+        self.date_keys = None
+        self.date_order = None
+        self.date_version += 1
+
+    def search_index(self):
+        # Обратный индекс строится при первом поиске и дальше поддерживается при изменениях
+        if self.text_index is None:
+            text_index = TextIndex()
+            names = self.category_names
+            for pos in self.positions():
+                text_index.add(self.ids[pos], names[self.categories[pos]], self.comments[pos])
+            self.text_index = text_index
+        return self.text_index
+
+    def row_fingerprint(self, pos):
+        return fingerprint(self.amounts[pos], self.dates[pos], self.category_names[self.categories[pos]],
+                           self.types[pos], self.comments[pos])
+
+    def fingerprint_index(self):
+        if self.fingerprints is None:
+            fingerprints = FingerprintIndex()
+            for pos in self.positions():
+                fingerprints.add(self.row_fingerprint(pos))
+            self.fingerprints = fingerprints
+        return self.fingerprints
+
+    def writable(self, names=SHARED_COLUMNS):
+        # Столбцы двоичного снимка - memoryview над файлом только для чтения, а столбцы,
+        # общие с копией хранилища, не меняются на месте ни одной из сторон:
+        # перед первым изменением столбец копируется в собственный массив
+        shared = self.shared
+        if shared:
+            for name in names:
+                if name in shared:
+                    setattr(self, name, own_column(getattr(self, name)))
+                    shared.discard(name)
+
+    def category_code(self, category):
+        code = self.category_codes.get(category)
+        if code is None:
+            code = len(self.category_names)
+            self.category_names.append(category)
+            self.category_codes[category] = code
+            self.category_totals.append([0] * len(OPERATION_TYPES))
+            self.category_counts.append(0)
+        return code
+
+    def account(self, pos, sign):
+        amount = self.amounts[pos] * sign
+        operation_type = self.types[pos]
+        category = self.categories[pos]
+        self.type_totals[operation_type] += amount
+        self.category_totals[category][operation_type] += amount
+        self.category_counts[category] += sign
+
+    def notify(self, event, operation_id, old, new):
+        for listener in self.listeners:
+            listener(event, operation_id, old, new)
+
+    def encode(self, key, value):
+        if key == 'amount':
+            return to_minor(value)
+        if key == 'date':
+            return date_to_ordinal(value)
+        if key == 'operation_type':
+            if value not in OPERATION_TYPES:
+                raise ValueError(f"Неизвестный тип операции: {value}")
+            return OPERATION_TYPES.index(value)
+        if key == 'category':
+            return self.category_code(str(value))
+        if key == 'comment':
+            return '' if value is None else str(value)
+        raise KeyError(key)
+
+    def append(self, operation_id, amount, category, date, comment, operation_type):
+        if operation_id in self.id_index():
+            raise ValueError(f"Операция с id {operation_id} уже существует")
+        self.writable()
+        # Сначала преобразуем все значения, чтобы ошибка не оставила строку наполовину записанной
+        amount = self.encode('amount', amount)
+        date = self.encode('date', date)
+        operation_type = self.encode('operation_type', operation_type)
+        comment = self.encode('comment', comment)
+        category = self.encode('category', category)
+        self.ids.append(operation_id)
+        self.amounts.append(amount)
+        self.dates.append(date)
+        self.types.append(operation_type)
+        self.categories.append(category)
+        self.comments.append(comment)
+        self.alive.append(1)
+        pos = len(self.ids) - 1
+        self.index[operation_id] = pos
+        self.index_date(pos)
+        if self.text_index is not None:
+            self.text_index.add(operation_id, self.category_names[category], comment)
+        if self.fingerprints is not None:
+            self.fingerprints.add(self.row_fingerprint(pos))
+        self.account(pos, 1)
+        if self.listeners:
+            self.notify('add', operation_id, None, self.row_dict(pos))
+        return pos
+
+    def extend(self, batch, first_id):
+        # Пакетное добавление порции импорта: расширение массивов без построчных вызовов
+        self.writable()
+        start = len(self.ids)
+        count = len(batch)
+        new_ids = range(first_id, first_id + count)
+        translate = [self.category_code(name) for name in batch.category_names]
+        codes = array('i', map(translate.__getitem__, batch.category_codes))
+        self.ids.extend(new_ids)
+        self.amounts.extend(batch.amounts)
+        self.dates.extend(batch.dates)
+        self.types.extend(batch.types)
+        self.categories.extend(codes)
+        self.comments.extend(batch.comments)
+        self.alive.extend(b'\x01' * count)
+        self.id_index().update(zip(new_ids, range(start, start + count)))
+        self.reset_date_index()
+        if self.text_index is not None:
+            add = self.text_index.add
+            for operation_id, category, comment in zip(new_ids, batch.categories, batch.comments):
+                add(operation_id, category, comment)
+        if self.fingerprints is not None:
+            keys = batch.fingerprints if batch.fingerprints is not None else batch.row_fingerprints()
+            for key in keys:
+                self.fingerprints.add(key)
+        for (category, operation_type), (amount, rows) in batch.totals.items():
+            code = self.category_codes[category]
+            self.type_totals[operation_type] += amount
+            self.category_totals[code][operation_type] += amount
+            self.category_counts[code] += rows
+
+    def batch(self, start, end):
+        # Строки с позиций start..end (только что добавленные, все живые) порцией импорта;
+        # коды категорий нумеруются в порядке первого появления, как в ImportBatch.add
+        batch = ImportBatch()
+        batch.amounts = self.amounts[start:end]
+        batch.dates = self.dates[start:end]
+        batch.types = self.types[start:end]
+        batch.comments = [self.comments[pos] for pos in range(start, end)]
+        names = self.category_names
+        index = batch.category_index
+        codes = batch.category_codes
+        for code in self.categories[start:end]:
+            name = names[code]
+            local = index.get(name)
+            if local is None:
+                local = index[name] = len(batch.category_names)
+                batch.category_names.append(name)
+            codes.append(local)
+        batch.count_totals()
+        return batch
+
+    def truncate(self, length):
+        # Откат до заданной физической длины (отмена незавершённого импорта)
+        self.writable()
+        self.reset_date_index()
+        self.text_index = None
+        self.fingerprints = None
+        index = self.id_index()
+        for pos in range(length, len(self.ids)):
+            if self.alive[pos]:
+                self.account(pos, -1)
+                del index[self.ids[pos]]
+            else:
+                self.deleted -= 1
+        del self.ids[length:]
+        del self.amounts[length:]
+        del self.dates[length:]
+        del self.types[length:]
+        del self.categories[length:]
+        del self.comments[length:]
+        del self.alive[length:]
+
+    def update(self, pos, fields):
+        # Все значения проверяются до записи, чтобы не изменить строку частично
+        encoded = [(key, self.encode(key, value)) for key, value in fields.items()]
+        self.writable([FIELD_COLUMNS[key] for key in fields if key in FIELD_COLUMNS])
+        old = self.row_dict(pos) if self.listeners else None
+        old_text = self.category_names[self.categories[pos]], self.comments[pos]
+        redate = 'date' in fields
+        if redate:
+            self.unindex_date(pos)
+        if self.fingerprints is not None:
+            self.fingerprints.remove(self.row_fingerprint(pos))
+        self.account(pos, -1)
+        for key, value in encoded:
+            if key == 'amount':
+                self.amounts[pos] = value
+            elif key == 'category':
+                self.categories[pos] = value
+            elif key == 'date':
+                self.dates[pos] = value
+            elif key == 'comment':
+                self.comments[pos] = value
+            elif key == 'operation_type':
+                self.types[pos] = value
+        self.account(pos, 1)
+        if redate:
+            self.index_date(pos)
+        if self.text_index is not None and ('category' in fields or 'comment' in fields):
+            self.text_index.update(self.ids[pos], *old_text,
+                                   self.category_names[self.categories[pos]], self.comments[pos])
+        if self.fingerprints is not None:
+            self.fingerprints.add(self.row_fingerprint(pos))
+        if self.listeners:
+            self.notify('update', self.ids[pos], old, self.row_dict(pos))
+
+    def remove(self, pos):
+        old = self.row_dict(pos) if self.listeners else None
+        self.writable(('alive',))
+        self.account(pos, -1)
+        del self.id_index()[self.ids[pos]]
+        self.alive[pos] = 0
+        self.deleted += 1
+        if self.text_index is not None:
+            self.text_index.remove(self.ids[pos], self.category_names[self.categories[pos]], self.comments[pos])
+        if self.fingerprints is not None:
+            self.fingerprints.remove(self.row_fingerprint(pos))
+        if self.listeners:
+            self.notify('delete', self.ids[pos], old, None)
+        if self.deleted >= COMPACT_MIN_DELETED and self.deleted * COMPACT_RATIO >= len(self.ids):
+            self.compact()
+
+    def compact(self):
+        if not self.deleted:
+            return
+        alive = self.alive
+        self.ids = array('q', compress(self.ids, alive))
+        self.amounts = array('q', compress(self.amounts, alive))
+        self.dates = array('i', compress(self.dates, alive))
+        self.types = array('b', compress(self.types, alive))
+        self.categories = array('i', compress(self.categories, alive))
+        self.comments = CommentColumn(compress(self.comments, alive))
+        self.alive = bytearray(b'\x01') * len(self.ids)
+        self.index = {operation_id: pos for pos, operation_id in enumerate(self.ids)}
+        self.shared = set()
+        self.mapped = None
+        self.deleted = 0
+        self.reset_date_index()
+
+    def get(self, pos, key):
+        if key == 'amount':
+            return from_minor(self.amounts[pos])
+        if key == 'category':
+            return self.category_names[self.categories[pos]]
+        if key == 'date':
+            return ordinal_to_date(self.dates[pos])
+        if key == 'comment':
+            return self.comments[pos]
+        if key == 'operation_type':
+            return OPERATION_TYPES[self.types[pos]]
+        if key == 'id':
+            return self.ids[pos]
+        raise KeyError(key)
+
+    def set(self, pos, key, value):
+        if key == 'id':
+            raise KeyError("Поле id нельзя изменить")
+        self.update(pos, {key: value})
+
+    def row_dict(self, pos):
+        return {
+            'amount': from_minor(self.amounts[pos]),
+            'category': self.category_names[self.categories[pos]],
+            'date': ordinal_to_date(self.dates[pos]),
+            'comment': self.comments[pos],
+            'operation_type': OPERATION_TYPES[self.types[pos]],
+            'id': self.ids[pos]
+        }
+
+    def csv_row(self, pos):
+        # Строка в порядке CSV_FIELDS; сумма - точная десятичная запись младших единиц
+        return (self.ids[pos], format_minor(self.amounts[pos]), self.category_names[self.categories[pos]],
+                ordinal_to_date(self.dates[pos]), OPERATION_TYPES[self.types[pos]], self.comments[pos])
+
+    def recompute_totals(self):
+        # Полный пересчёт сумм, для сверки с поддерживаемыми значениями
+        type_totals = [0] * len(OPERATION_TYPES)
+        category_totals = [[0] * len(OPERATION_TYPES) for _ in self.category_names]
+        category_counts = [0] * len(self.category_names)
+        for pos in self.positions():
+            amount = self.amounts[pos]
+            operation_type = self.types[pos]
+            category = self.categories[pos]
+            type_totals[operation_type] += amount
+            category_totals[category][operation_type] += amount
+            category_counts[category] += 1
+        return type_totals, category_totals, category_counts
+
+    def copy(self):
+        # Копия на текущий момент без копирования строк: столбцы становятся общими и
+        # копируются той стороной, которая первой их изменит, комментарии делятся кусками.
+        # Индекс id (кроме дешёвого MappedIndex снимка), индексы дат, текста и отпечатков
+        # копия строит сама при первом обращении
+        store = ColumnStore()
+        for name in SHARED_COLUMNS:
+            setattr(store, name, getattr(self, name))
+        self.shared = set(SHARED_COLUMNS)
+        store.shared = set(SHARED_COLUMNS)
+        store.comments = self.comments.copy()
+        store.mapped = self.mapped
+        store.category_names = list(self.category_names)
+        store.category_codes = dict(self.category_codes)
+        store.index = None if self.index is None or isinstance(self.index, dict) else self.index.copy()
+        store.deleted = self.deleted
+        store.type_totals = list(self.type_totals)
+        store.category_totals = [list(totals) for totals in self.category_totals]
+        store.category_counts = list(self.category_counts)
+        return store
+
+    def nbytes(self):
+        columns = (self.ids, self.amounts, self.dates, self.types, self.categories)
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+class OperationRow(Mapping):
+    # Легковесное представление строки хранилища, ведёт себя как dict операции.
+    # Позиция перепроверяется по id, поэтому строка переживает уплотнение
+    __slots__ = ('_store', '_pos', '_id')
+
+    def __init__(self, store, pos):
+        self._store = store
+        self._pos = pos
+        self._id = store.ids[pos]
+
+    @property
+    def pos(self):
+        store = self._store
+        pos = self._pos
+        if pos >= len(store.ids) or store.ids[pos] != self._id or not store.alive[pos]:
+            pos = store.find(self._id)
+            if pos is None:
+                raise KeyError(f"Операция {self._id} удалена")
+            self._pos = pos
+        return pos
+
+    def __getitem__(self, key):
+        return self._store.get(self.pos, key)
+
+    def __setitem__(self, key, value):
+        self._store.set(self.pos, key, value)
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def to_dict(self):
+        return self._store.row_dict(self.pos)
+
+    def __repr__(self):
+        return f"OperationRow({self.to_dict()!r})"
+
+
+class OperationsView(Sequence):
+    # Список операций поверх колоночного хранилища; строки создаются по требованию
+    __slots__ = ('_store',)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, index):
+        # После удалений логический индекс не совпадает с позицией в массивах: позиция
+        # находится пропуском удалённых строк (чтение хранилище не уплотняет)
+        store = self._store
+        if isinstance(index, slice):
+            indexes = range(len(store))[index]
+            if store.deleted:
+                positions = list(store.positions())
+                return [OperationRow(store, positions[i]) for i in indexes]
+            return [OperationRow(store, pos) for pos in indexes]
+        if index < 0:
+            index += len(store)
+        if not 0 <= index < len(store):
+            raise IndexError("Индекс операции вне диапазона")
+        if store.deleted:
+            index = next(islice(store.positions(), index, None))
+        return OperationRow(store, index)
+
+    def __iter__(self):
+        store = self._store
+        for pos in store.positions():
+            yield OperationRow(store, pos)
+
+    def iter_after(self, operation_id=None):
+        # Строки после операции с данным id (с начала, если id не задан);
+        # добавленные во время обхода строки тоже попадают в выдачу
+        store = self._store
+        pos = 0 if operation_id is None else store.find(operation_id) + 1
+        while pos < len(store.ids):
+            if store.alive[pos]:
+                yield OperationRow(store, pos)
+            pos += 1
+
+
+class DateRangeView(Sequence):
+    # Операции за период (даты - порядковые номера, включительно) в порядке дат,
+    # с необязательным отбором по коду категории и типа. Границы находятся
+    # двоичным поиском по индексу дат, строки читаются по требованию
+    __slots__ = ('_store', '_start', '_end', '_category', '_type')
+
+    def __init__(self, store, start=None, end=None, category=None, operation_type=None):
+        self._store = store
+        self._start = start
+        self._end = end
+        self._category = category
+        self._type = operation_type
+
+    @property
+    def filtered(self):
+        return self._category is not None or self._type is not None or self._store.deleted
+
+    def bounds(self):
+        keys, order = self._store.date_index()
+        low = 0 if self._start is None else bisect_left(keys, self._start)
+        high = len(keys) if self._end is None else bisect_right(keys, self._end)
+        return order, low, high
+
+    def matches(self, pos):
+        store = self._store
+        return (store.alive[pos]
+                and (self._category is None or store.categories[pos] == self._category)
+                and (self._type is None or store.types[pos] == self._type))
+
+    def __len__(self):
+        order, low, high = self.bounds()
+        if not self.filtered:
+            return max(0, high - low)
+        return sum(1 for i in range(low, high) if self.matches(order[i]))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if index >= 0 and not self.filtered:
+            order, low, high = self.bounds()
+            if low + index < high:
+                return OperationRow(self._store, order[low + index])
+        elif index >= 0:
+            for row in islice(self, index, index + 1):
+                return row
+        raise IndexError("Индекс операции вне диапазона")
+
+    def __iter__(self):
+        # Если индекс изменился во время обхода (добавление, правка, уплотнение),
+        # обход продолжается с текущей даты, уже выданные строки этой даты пропускаются
+        store = self._store
+        order, i, high = self.bounds()
+        version = store.date_version
+        date = None
+        seen = set()
+        while i < high:
+            if store.date_version != version:
+                keys, order = store.date_index()
+                version = store.date_version
+                i = bisect_left(keys, date) if date is not None else self.bounds()[1]
+                high = len(keys) if self._end is None else bisect_right(keys, self._end)
+                continue
+            pos = order[i]
+            i += 1
+            if not self.matches(pos):
+                continue
+            operation_id = store.ids[pos]
+            if store.dates[pos] != date:
+                date = store.dates[pos]
+                seen = set()
+            elif operation_id in seen:
+                continue
+            seen.add(operation_id)
+            yield OperationRow(store, pos)
+
 
 class Database:
     def __init__(self):
-        self.operations = []
+        self.store = ColumnStore()
         self.next_id = 1
 
+    @property
+    def operations(self):
+        return OperationsView(self.store)
+
+    @operations.setter
+    def operations(self, rows):
+        # Полная замена списка операций (строки копируются до пересоздания хранилища)
+        rows = [dict(row) for row in rows]
+        store = ColumnStore()
+        store.listeners = self.store.listeners
+        store.notify('reset', None, None, None)
+        for row in rows:
+            store.append(row['id'], row['amount'], row['category'], row['date'],
+                         row['comment'], row['operation_type'])
+        self.store = store
+        self.next_id = max(self.next_id, max(store.ids, default=0) + 1)
+
+    @timed('db.add_operation')
     def add_operation(self, operation):
         try:
-            operation_dict = operation.to_dict()
-            operation_dict['id'] = self.next_id
+            self.store.append(
+                self.next_id,
+                operation.amount,
+                operation.category,
+                operation.date,
+                operation.comment,
+                operation.operation_type
+            )
             self.next_id += 1
-            self.operations.append(operation_dict)
-            return True
+            return self.next_id - 1
         except Exception as e:
             print(f"Ошибка при добавлении операции: {str(e)}")
+            error('db.add_operation', e)
             return False
 
     def get_all_operations(self):
         return self.operations
 
-    def export_to_json(self, filename):
+    def snapshot(self):
+        # Копия базы на текущий момент для чтения из фонового потока. Стоит O(1) от числа
+        # строк (ColumnStore.copy): правки базы после снимка в копию не попадают
+        db = Database()
+        db.store = self.store.copy()
+        db.next_id = self.next_id
+        return db
+
+    def import_copy(self):
+        # Копия базы для импорта в фоновом потоке: строки добавляются в неё, главный поток
+        # только подменяет базу готовой копией (adopt). События копии копятся в events
+        # и передаются слушателям базы при подмене
+        copy = self.snapshot()
+        copy.events = []
+        copy.add_listener(lambda *event: copy.events.append(event))
+        return copy
+
+    def prepare_indexes(self, like):
+        # Индексы, которые уже есть у базы like, строятся заранее (в фоне, до подмены)
+        store = like.store
+        if store.text_index is not None:
+            self.store.search_index()
+        if store.date_order is not None:
+            self.store.date_index()
+
+    def adopt(self, copy):
+        # Подмена базы копией из import_copy после импорта; правки базы на время
+        # импорта запрещены, поэтому копия содержит всё, что было в базе
+        store = copy.store
+        store.listeners = self.store.listeners
+        self.store = store
+        self.next_id = copy.next_id
+        for event in copy.events:
+            store.notify(*event)
+
+    def query(self, start=None, end=None, category=None, operation_type=None):
+        # Операции за период (даты ГГГГ-ММ-ДД включительно, любая граница может
+        # отсутствовать) с отбором по категории и типу, в порядке дат
+        store = self.store
+        start = None if start is None else date_to_ordinal(start)
+        end = None if end is None else date_to_ordinal(end)
+        if operation_type is not None:
+            operation_type = store.encode('operation_type', operation_type)
+        if category is not None:
+            # Неизвестная категория даёт пустую выборку, а не новый код в словаре
+            category = store.category_codes.get(category, -1)
+        return DateRangeView(store, start, end, category, operation_type)
+
+    def search(self, text):
+        # Операции, где каждое слово запроса - начало слова комментария или категории
+        return SearchView(self.store.search_index().search(text), self.get)
+
+    # Суммы копятся целыми младшими единицами и переводятся в число один раз на выходе
+    def get_type_totals(self):
+        return dict(zip(OPERATION_TYPES, map(from_minor, self.store.type_totals)))
+
+    def get_balance(self):
+        income, expense = self.store.type_totals
+        return from_minor(income - expense)
+
+    def get_category_totals(self):
+        # Сумма по категории: доходы со знаком плюс, расходы со знаком минус
+        store = self.store
+        return {
+            name: from_minor(income - expense)
+            for name, (income, expense), count
+            in zip(store.category_names, store.category_totals, store.category_counts)
+            if count
+        }
+
+    def check_totals(self):
+        # Сверка поддерживаемых сумм с полным пересчётом; суммы целые, поэтому совпадать должны точно
+        type_totals, category_totals, category_counts = self.store.recompute_totals()
+        store = self.store
+        return (category_counts == store.category_counts and type_totals == store.type_totals
+                and category_totals == store.category_totals)
+
+    def get(self, operation_id):
+        pos = self.store.find(operation_id)
+        if pos is None:
+            return None
+        return OperationRow(self.store, pos)
+
+    @timed('db.update')
+    def update(self, operation_id, **fields):
         try:
-            with open(filename, 'w', encoding='utf-8') as file:
-                json.dump(self.operations, file, ensure_ascii=False, indent=4)
+            pos = self.store.find(operation_id)
+            if pos is None:
+                raise KeyError(f"Операция {operation_id} не найдена")
+            if 'id' in fields:
+                raise KeyError("Поле id нельзя изменить")
+            self.store.update(pos, fields)
+            return True
+        except Exception as e:
+            print(f"Ошибка при изменении операции: {str(e)}")
+            error('db.update', e)
+            return False
+
+    @timed('db.delete')
+    def delete(self, operation_id):
+        try:
+            pos = self.store.find(operation_id)
+            if pos is None:
+                raise KeyError(f"Операция {operation_id} не найдена")
+            self.store.remove(pos)
+            return True
+        except Exception as e:
+            print(f"Ошибка при удалении операции: {str(e)}")
+            error('db.delete', e)
+            return False
+
+    @timed('db.import_batches')
+    def import_batches(self, batches, result, strict=False, duplicates='keep'):
+        # Все порции файла добавляются вместе или не добавляются вовсе.
+        # В строгом режиме любая строка с ошибкой отменяет весь импорт.
+        # duplicates - что делать со строками, которые уже есть в базе (DUPLICATE_POLICIES)
+        store = self.store
+        start = len(store.ids)
+        next_id = self.next_id
+        try:
+            if duplicates != 'keep':
+                batches = filter_duplicates(batches, store.fingerprint_index(), duplicates, result)
+            for batch in batches:
+                store.extend(batch, self.next_id)
+                self.next_id += len(batch)
+                result.added += len(batch)
+            if strict and result.errors:
+                raise ValueError(f"Строк с ошибками: {len(result.errors)}, импорт отменён")
+            result.ok = True
+        except Exception as e:
+            store.truncate(start)
+            self.next_id = next_id
+            result.added = 0
+            result.duplicates = 0
+            result.duplicate_rows = []
+            result.ok = False
+            result.message = str(e)
+            print(f"Ошибка при импорте: {str(e)}")
+            error('db.import_batches', e)
+            return result
+        stats.count('db.rows_imported', result.added)
+        # Слушатели узнают о строках импорта только после того, как файл принят целиком,
+        # одним событием 'import' с первым id и порцией всех добавленных строк
+        if store.listeners and result.added:
+            store.notify('import', store.ids[start], None, store.batch(start, len(store.ids)))
+        return result
+
+    def add_listener(self, listener):
+        self.store.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.store.listeners.remove(listener)
+
+    @timed('db.load')
+    def load(self, filename):
+        # Восстановление базы из снимка с сохранением id операций: JSON-файл
+        # или двоичный снимок .fpsnap, который отображается в память без разбора
+        try:
+            if filename.lower().endswith(SNAPSHOT_EXTENSIONS):
+                from snapshot import read_snapshot
+                store, next_id = read_snapshot(filename)
+            else:
+                store = ColumnStore()
+                next_id = 1
+                with open(filename, 'r', encoding='utf-8') as file:
+                    for op in iter_json_array(file):
+                        store.append(op['id'], *extract_fields(op))
+                        next_id = max(next_id, op['id'] + 1)
+            store.listeners = self.store.listeners
+            self.store = store
+            self.next_id = next_id
+            if store.listeners:
+                store.notify('reset', None, None, None)
+                for pos in store.positions():
+                    store.notify('add', store.ids[pos], None, store.row_dict(pos))
+            return True
+        except Exception as e:
+            print(f"Ошибка при загрузке данных: {str(e)}")
+            error('db.load', e)
+            return False
+
+    def iter_rows(self):
+        store = self.store
+        return (store.row_dict(pos) for pos in store.positions())
+
+    @timed('db.export_to_json')
+    def export_to_json(self, filename, progress=None, indent=4):
+        try:
+            rows = track_progress(self.iter_rows(), len(self.store), progress)
+            write_json(filename, rows, indent)
             return True
         except Exception as e:
             print(f"Ошибка при экспорте в JSON: {str(e)}")
+            error('db.export_to_json', e)
             return False
 
-    def export_to_csv(self, filename):
+    @timed('db.export_to_ndjson')
+    def export_to_ndjson(self, filename, progress=None):
         try:
-            with open(filename, 'w', encoding='utf-8', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=[
-                    'id', 'amount', 'category', 'date', 'operation_type', 'comment'
-                ])
-                writer.writeheader()
-                writer.writerows(self.operations)
+            write_ndjson(filename, track_progress(self.iter_rows(), len(self.store), progress))
             return True
         except Exception as e:
-            print(f"Ошибка при экспорте в CSV: {str(e)}")
+            print(f"Ошибка при экспорте в NDJSON: {str(e)}")
+            error('db.export_to_ndjson', e)
             return False
 
-    def import_from_csv(self, filename):
+    @timed('db.export_to_csv')
+    def export_to_csv(self, filename, progress=None):
         try:
-            with open(filename, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    operation = Operation(
-                        amount=float(row['amount']),
-                        category=row['category'],
-                        date=row['date'],
-                        comment=row['comment'],
-                        operation_type=row['operation_type']
-                    )
-                    self.add_operation(operation)
+            store = self.store
+            positions = track_progress(store.positions(), len(store), progress)
+            write_csv(filename, map(store.csv_row, positions))
             return True
         except Exception as e:
-            print(f"Ошибка при импорте из CSV: {str(e)}")
+            print(f"Ошибка при экспорте в CSV: {str(e)}")
+            error('db.export_to_csv', e)
             return False
 
-    def import_from_json(self, filename):
+    @timed('db.export_to_snapshot')
+    def export_to_snapshot(self, filename, progress=None):
         try:
-            with open(filename, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                for op in data:
-                    operation = Operation(
-                        amount=op['amount'],
-                        category=op['category'],
-                        date=op['date'],
-                        comment=op['comment'],
-                        operation_type=op['operation_type']
-                    )
-                    self.add_operation(operation)
+            from snapshot import write_snapshot
+            write_snapshot(filename, self.store, self.next_id, progress)
             return True
         except Exception as e:
-            print(f"Ошибка при импорте из JSON: {str(e)}")
+            print(f"Ошибка при записи снимка: {str(e)}")
+            error('db.export_to_snapshot', e)
             return False
+
+    def export(self, filename, progress=None):
+        return export_by_extension(self, filename, progress)
+
+    def import_from_csv(self, filename, chunk_size=IMPORT_CHUNK_SIZE, strict=False, progress=None,
+                         duplicates='keep'):
+        result = ImportResult(filename)
+        return self.import_batches(parse_csv(filename, result, chunk_size, progress), result, strict, duplicates)
+
+    def import_from_json(self, filename, chunk_size=IMPORT_CHUNK_SIZE, strict=False, progress=None,
+                         duplicates='keep'):
+        result = ImportResult(filename)
+        return self.import_batches(parse_json(filename, result, chunk_size, progress), result, strict, duplicates)
+
+    def import_from_ndjson(self, filename, chunk_size=IMPORT_CHUNK_SIZE, strict=False, progress=None,
+                         duplicates='keep'):
+        result = ImportResult(filename)
+        return self.import_batches(parse_ndjson(filename, result, chunk_size, progress), result, strict, duplicates)
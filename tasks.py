@@ -0,0 +1,109 @@
+#tasks.py - фоновые задачи: выполнение в потоках, результаты - в главный поток через очередь
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+POLL_INTERVAL_MS = 50
+PROGRESS_INTERVAL = 0.1
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Task:
+    # Состояние одной фоновой задачи. Рабочий поток сообщает прогресс и проверяет отмену
+    # только через этот объект и никогда не обращается к виджетам Tk
+    def __init__(self, title, results):
+        self.title = title
+        self.results = results
+        self.cancel_event = threading.Event()
+        self.last_progress = 0.0
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check(self):
+        if self.cancel_event.is_set():
+            raise Cancelled(f"{self.title}: отменено")
+
+    def progress(self, done, total=None):
+        self.check()
+        now = time.monotonic()
+        if now - self.last_progress >= PROGRESS_INTERVAL or (total and done >= total):
+            self.last_progress = now
+            self.results.put(('progress', self, (done, total)))
+
+
+class TaskRunner:
+    # Пул рабочих потоков; одновременно выполняется не больше одной задачи,
+    # обработчики результатов вызываются в главном потоке из root.after
+    def __init__(self, root, workers=2):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='finplanner')
+        self.results = queue.Queue()
+        self.current = None
+        self.handlers = {}
+
+    @property
+    def busy(self):
+        return self.current is not None
+
+    def submit(self, title, job, on_done, on_error=None, on_progress=None, on_finish=None):
+        if self.busy:
+            return None
+        task = Task(title, self.results)
+        self.current = task
+        self.handlers[task] = (on_done, on_error, on_progress, on_finish)
+        self.executor.submit(self.run, task, job)
+        self.root.after(POLL_INTERVAL_MS, self.poll)
+        return task
+
+    def run(self, task, job):
+        try:
+            result = job(task)
+            task.check()
+            self.results.put(('done', task, result))
+        except Cancelled as e:
+            self.results.put(('cancelled', task, e))
+        except Exception as e:
+            self.results.put(('error', task, e))
+
+    def cancel(self):
+        if self.current is not None:
+            self.current.cancel()
+
+    def poll(self):
+        while True:
+            try:
+                kind, task, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            on_done, on_error, on_progress, on_finish = self.handlers.get(task, (None,) * 4)
+            if kind == 'progress':
+                if on_progress is not None:
+                    on_progress(task, *payload)
+                continue
+
+            self.handlers.pop(task, None)
+            if task is self.current:
+                self.current = None
+            if on_finish is not None:
+                on_finish(task)
+            if kind == 'done':
+                on_done(payload)
+            elif kind == 'error' and on_error is not None:
+                on_error(payload)
+
+        if self.current is not None:
+            self.root.after(POLL_INTERVAL_MS, self.poll)
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
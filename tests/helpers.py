@@ -0,0 +1,32 @@
+#helpers.py - общие данные проверок: путь к модулям проекта и случайные операции
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from models import Operation
+from storage import ImportBatch
+
+CATEGORIES = ('Продукты', 'Кафе', 'Транспорт', 'Зарплата')
+TYPES = ('income', 'expense')
+
+
+def random_operation(rng):
+    return Operation(round(rng.uniform(0.01, 5000), 2), rng.choice(CATEGORIES),
+                     f"2024-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+                     f"кофе {rng.randrange(100)}", rng.choice(TYPES))
+
+
+def random_batch(rng, count):
+    batch = ImportBatch()
+    for _ in range(count):
+        op = random_operation(rng)
+        batch.add(op.amount, op.category, op.date, op.comment, op.operation_type)
+    return batch
+
+
+def rows(db):
+    return [dict(op) for op in db.operations]
@@ -0,0 +1,87 @@
+#test_analysis.py - проверки сумм по периодам: поддерживаемые Rollups против полного пересчёта
+
+import random
+import unittest
+
+from helpers import CATEGORIES, TYPES, random_batch, random_operation, rows
+from analysis import Rollups, period_key
+from models import ImportResult
+from storage import Database
+
+
+def rebuilt(db, periods):
+    rollups = Rollups(periods)
+    rollups.build(db)
+    return rollups
+
+
+class RollupsTest(unittest.TestCase):
+    def check_random_changes(self, rebuild_after, seed):
+        rng = random.Random(seed)
+        db = Database()
+        for _ in range(30):
+            db.add_operation(random_operation(rng))
+        rollups = Rollups(rebuild_after=rebuild_after)
+        rollups.attach(db)
+        ids = [op['id'] for op in db.operations]
+        for step in range(300):
+            choice = rng.random()
+            if choice < 0.35 or not ids:
+                ids.append(db.add_operation(random_operation(rng)))
+            elif choice < 0.6:
+                # Правка может перенести строку в другой период, категорию и тип
+                fields = rng.choice(({'amount': round(rng.uniform(1, 100), 2)},
+                                     {'date': f"202{rng.randint(3, 5)}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}"},
+                                     {'category': rng.choice(CATEGORIES), 'operation_type': rng.choice(TYPES)},
+                                     {'comment': 'только комментарий'}))
+                self.assertTrue(db.update(rng.choice(ids), **fields))
+            elif choice < 0.8:
+                self.assertTrue(db.delete(ids.pop(rng.randrange(len(ids)))))
+            elif choice < 0.95:
+                self.assertTrue(db.import_batches([random_batch(rng, rng.randint(1, 40))], ImportResult()))
+                ids = [op['id'] for op in db.operations]
+            else:
+                # Полная замена списка операций: суммы перестраиваются при следующем отчёте
+                db.operations = rows(db)[::2]
+                ids = [op['id'] for op in db.operations]
+            if step % 7 == 0 or step == 299:
+                expected = rebuilt(db, rollups.periods)
+                rollups.refresh()
+                self.assertEqual(rollups.cube, expected.cube, f"шаг {step}")
+                self.assertEqual(rollups.totals, expected.totals, f"шаг {step}")
+                self.assertEqual(rollups.trend('week'), expected.trend('week'))
+
+    def test_incremental_updates_match_rebuild(self):
+        self.check_random_changes(rebuild_after=10 ** 6, seed=15)
+
+    def test_rebuild_after_many_changes_matches(self):
+        self.check_random_changes(rebuild_after=20, seed=16)
+
+    def test_reports(self):
+        db = Database()
+        rng = random.Random(17)
+        for _ in range(200):
+            db.add_operation(random_operation(rng))
+        rollups = Rollups()
+        rollups.attach(db)
+        db.import_batches([random_batch(rng, 30)], ImportResult())
+        for period in rollups.periods:
+            for label, income, expense in rollups.trend(period):
+                totals = {'income': 0, 'expense': 0}
+                for op in db.operations:
+                    if period_key(period, op['date']) == label:
+                        totals[op['operation_type']] += round(op['amount'] * 100)
+                self.assertEqual((round(income * 100), round(expense * 100)),
+                                 (totals['income'], totals['expense']), f"{period} {label}")
+        month = rollups.trend('month')[0][0]
+        expected = {}
+        for op in db.operations:
+            if op['date'][:7] == month:
+                sign = 1 if op['operation_type'] == 'income' else -1
+                expected[op['category']] = expected.get(op['category'], 0) + sign * round(op['amount'] * 100)
+        self.assertEqual({category: round(total * 100) for category, total
+                          in rollups.category_totals('month', month).items()}, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+#test_cli.py - проверки командной строки: конвертация базы с журналом
+
+import csv
+import os
+import random
+import tempfile
+import unittest
+
+from helpers import random_operation, rows
+import cli
+from storage import Database
+
+
+class ConvertLedgerTest(unittest.TestCase):
+    def test_convert_reads_the_journal(self):
+        rng = random.Random(13)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'ledger.json')
+            with cli.Ledger(path) as db:
+                for _ in range(5):
+                    db.add_operation(random_operation(rng))
+                # Снимок с пятью операциями, дальнейшие правки - только в журнале
+                self.assertTrue(db.export_to_json(path))
+                for _ in range(3):
+                    db.add_operation(random_operation(rng))
+                self.assertTrue(db.delete(2))
+                expected = rows(db)
+
+            target = os.path.join(folder, 'ledger.csv')
+            self.assertEqual(cli.main(['convert', path, target]), cli.EXIT_OK)
+            with open(target, 'r', encoding='utf-8', newline='') as file:
+                converted = list(csv.DictReader(file))
+            self.assertEqual([int(row['id']) for row in converted], [op['id'] for op in expected])
+
+            copy = os.path.join(folder, 'copy.json')
+            self.assertEqual(cli.main(['convert', path, copy]), cli.EXIT_OK)
+            loaded = Database()
+            self.assertTrue(loaded.load(copy))
+            self.assertEqual(rows(loaded), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,274 @@
+#test_import.py - проверки импорта: числовые категории, повторы, параллельный импорт папки, импорт в копии базы
+
+import json
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from helpers import random_batch, random_operation, rows
+import bulk_import
+from analysis import Rollups
+from journal import Journal
+from models import ImportResult
+from sqlite_storage import SQLiteDatabase
+from storage import Database, ImportBatch
+
+
+def import_in_thread(db, batches, journal=None):
+    # Как в gui.FinPlannerApp.import_job: копия наполняется в другом потоке,
+    # соединение копии SQLite закрывается там же
+    copy = db.import_copy()
+    done = []
+
+    def job():
+        try:
+            done.append(copy.import_batches(batches, ImportResult()))
+            copy.prepare_indexes(db)
+            if journal is not None:
+                journal.prepare(copy.events)
+        finally:
+            if not isinstance(copy, Database):
+                copy.close()
+    thread = threading.Thread(target=job)
+    thread.start()
+    thread.join()
+    return copy, done[0]
+
+
+def make_batch(*rows):
+    batch = ImportBatch()
+    for row in rows:
+        batch.add(*row)
+    return batch
+
+
+# В базе: две одинаковые операции A, операция B. В файле (две порции): A трижды, причём
+# комментарий отличается только регистром, ё и пробелами; A с другой категорией;
+# новая операция C дважды; B с другой суммой
+EXISTING = [
+    (250.0, 'Кафе', '2024-03-01', 'Ёлка  Маркет', 'expense'),
+    (250.0, 'Кафе', '2024-03-01', 'Ёлка  Маркет', 'expense'),
+    (1000.0, 'Зарплата', '2024-03-05', 'аванс', 'income'),
+]
+FILE_BATCHES = [
+    [(250.0, 'Кафе', '2024-03-01', 'елка маркет', 'expense'),
+     (250.0, 'Продукты', '2024-03-01', 'Ёлка  Маркет', 'expense'),
+     (75.5, 'Транспорт', '2024-03-02', 'такси', 'expense'),
+     (250.0, 'Кафе', '2024-03-01', ' ЁЛКА МАРКЕТ ', 'expense')],
+    [(75.5, 'Транспорт', '2024-03-02', 'Такси', 'expense'),
+     (250.0, 'Кафе', '2024-03-01', 'Ёлка Маркет', 'expense'),
+     (1000.01, 'Зарплата', '2024-03-05', 'аванс', 'income')],
+]
+
+
+class ImportCategoryTest(unittest.TestCase):
+    def test_numeric_category_is_a_string(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'numbers.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump([
+                    {'amount': 10, 'category': 5, 'date': '2024-01-01', 'comment': 'a', 'operation_type': 'expense'},
+                    {'amount': 11, 'category': '5', 'date': '2024-01-02', 'comment': 'b', 'operation_type': 'expense'},
+                ], file)
+            db = Database()
+            self.assertTrue(db.import_from_json(path))
+            self.assertEqual(db.get_category_totals(), {'5': -21.0})
+            self.assertEqual(len(db.search('5')), 2)
+            self.assertTrue(db.export_to_snapshot(os.path.join(folder, 'numbers.fpsnap')))
+            self.assertTrue(db.check_totals())
+
+
+class DuplicatesTest(unittest.TestCase):
+    def run_import(self, db, policy):
+        for row in EXISTING:
+            db.import_batches([make_batch(row)], ImportResult())
+        result = ImportResult()
+        self.assertTrue(db.import_batches([make_batch(*rows) for rows in FILE_BATCHES], result, duplicates=policy))
+        self.assertTrue(db.check_totals())
+        added = [(op['amount'], op['category'], op['comment']) for op in list(db.operations)[len(EXISTING):]]
+        return result, added
+
+    def check_policies(self, open_db):
+        # keep - всё; skip - ни одной строки, совпадающей с базой; merge - сверх числа уже
+        # имеющихся. Повторы внутри файла (C дважды) не трогаются ни одним режимом
+        expected = {
+            'keep': (0, [(250.0, 'Кафе', 'елка маркет'), (250.0, 'Продукты', 'Ёлка  Маркет'),
+                         (75.5, 'Транспорт', 'такси'), (250.0, 'Кафе', ' ЁЛКА МАРКЕТ '),
+                         (75.5, 'Транспорт', 'Такси'), (250.0, 'Кафе', 'Ёлка Маркет'),
+                         (1000.01, 'Зарплата', 'аванс')]),
+            'skip': (3, [(250.0, 'Продукты', 'Ёлка  Маркет'), (75.5, 'Транспорт', 'такси'),
+                         (75.5, 'Транспорт', 'Такси'), (1000.01, 'Зарплата', 'аванс')]),
+            # Третья A сверх двух в базе добавляется с комментарием из файла как есть
+            'merge': (2, [(250.0, 'Продукты', 'Ёлка  Маркет'), (75.5, 'Транспорт', 'такси'),
+                          (75.5, 'Транспорт', 'Такси'), (250.0, 'Кафе', 'Ёлка Маркет'),
+                          (1000.01, 'Зарплата', 'аванс')]),
+        }
+        for policy, (duplicates, added) in expected.items():
+            db = open_db()
+            try:
+                result, rows_added = self.run_import(db, policy)
+                self.assertEqual(result.duplicates, duplicates, policy)
+                self.assertEqual(result.added, len(added), policy)
+                self.assertEqual(rows_added, added, policy)
+                self.assertEqual([row['comment'] for row in result.duplicate_rows],
+                                 {'keep': [], 'skip': ['елка маркет', ' ЁЛКА МАРКЕТ ', 'Ёлка Маркет'],
+                                  'merge': ['елка маркет', ' ЁЛКА МАРКЕТ ']}[policy])
+                # Повторный импорт того же файла в режиме merge добавляет только то, чего
+                # в базе меньше, чем в файле (после skip - третью A)
+                again = ImportResult()
+                self.assertTrue(db.import_batches([make_batch(*rows) for rows in FILE_BATCHES], again,
+                                                  duplicates='merge'))
+                self.assertEqual(again.added, 1 if policy == 'skip' else 0, policy)
+            finally:
+                close = getattr(db, 'close', None)
+                if close is not None:
+                    close()
+
+    def test_database(self):
+        self.check_policies(Database)
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as folder:
+            paths = iter(os.path.join(folder, f"{number}.db") for number in range(3))
+            self.check_policies(lambda: SQLiteDatabase(next(paths)))
+
+    def test_unknown_policy(self):
+        db = Database()
+        result = db.import_batches([make_batch(*FILE_BATCHES[0])], ImportResult(), duplicates='drop')
+        self.assertFalse(result)
+        self.assertEqual(len(db.operations), 0)
+
+
+def write_statements(folder, seed):
+    # Папка выписок разных форматов, со вложенной папкой, ошибочными строками,
+    # нечитаемым файлом и пересекающимися выписками
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(folder, 'b', 'inner'))
+    shared = [random_operation(rng) for _ in range(15)]
+    for number, (name, export) in enumerate((('a.csv', Database.export_to_csv),
+                                             ('b/inner/c.json', Database.export_to_json),
+                                             ('b/d.ndjson', Database.export_to_ndjson),
+                                             ('e.csv', Database.export_to_csv))):
+        db = Database()
+        for op in shared[number * 5:number * 5 + 10] + [random_operation(rng) for _ in range(40)]:
+            db.add_operation(op)
+        export(db, os.path.join(folder, name))
+    with open(os.path.join(folder, 'e.csv'), 'a', encoding='utf-8') as file:
+        file.write('99,abc,Кафе,2024-01-01,expense,плохая сумма\n')
+    with open(os.path.join(folder, 'b', 'broken.json'), 'w', encoding='utf-8') as file:
+        file.write('[{"amount": 1, ')
+    with open(os.path.join(folder, 'notes.txt'), 'w', encoding='utf-8') as file:
+        file.write('не выписка')
+
+
+class BulkImportTest(unittest.TestCase):
+    def setUp(self):
+        # Маленькие файлы тоже разбираются в пуле процессов
+        self.parallel_min = bulk_import.PARALLEL_MIN_BYTES
+        bulk_import.PARALLEL_MIN_BYTES = 0
+
+    def tearDown(self):
+        bulk_import.PARALLEL_MIN_BYTES = self.parallel_min
+
+    def test_parallel_import_matches_sequential(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_statements(folder, 18)
+            for duplicates in ('keep', 'merge'):
+                imported = []
+                for workers in (1, 3):
+                    db = Database()
+                    db.add_operation(random_operation(random.Random(19)))
+                    results = bulk_import.import_statements(db, [folder], workers=workers, chunk_size=7,
+                                                            duplicates=duplicates)
+                    self.assertTrue(db.check_totals())
+                    imported.append((rows(db), db.next_id,
+                                     [(os.path.relpath(result.filename, folder), bool(result), result.added,
+                                       result.errors, result.duplicates) for result in results]))
+                self.assertEqual(imported[0], imported[1], duplicates)
+
+                # Тот же итог, что у импорта файлов по одному в порядке expand_paths
+                db = Database()
+                db.add_operation(random_operation(random.Random(19)))
+                for filename in bulk_import.expand_paths([folder]):
+                    if filename.endswith('.csv'):
+                        db.import_from_csv(filename, duplicates=duplicates)
+                    elif filename.endswith('.ndjson'):
+                        db.import_from_ndjson(filename, duplicates=duplicates)
+                    else:
+                        db.import_from_json(filename, duplicates=duplicates)
+                self.assertEqual(rows(db), imported[0][0], duplicates)
+                files = [name for name, ok, added, errors, skipped in imported[0][2]]
+                self.assertEqual(files, ['a.csv', os.path.join('b', 'broken.json'), os.path.join('b', 'd.ndjson'),
+                                         os.path.join('b', 'inner', 'c.json'), 'e.csv'])
+                self.assertEqual([ok for name, ok, added, errors, skipped in imported[0][2]],
+                                 [True, False, True, True, True])
+
+
+class ImportCopyTest(unittest.TestCase):
+    def test_database_copy_is_adopted(self):
+        rng = random.Random(8)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'data.json')
+            db = Database()
+            journal = Journal(db, path, fsync=False)
+            self.assertTrue(journal.open())
+            for _ in range(20):
+                db.add_operation(random_operation(rng))
+            rollups = Rollups()
+            rollups.attach(db)
+            self.assertEqual(len(db.search('кофе')), 20)
+            batches = [random_batch(rng, 30), random_batch(rng, 40)]
+
+            expected = Database()
+            expected.operations = rows(db)
+            self.assertTrue(expected.import_batches(batches, ImportResult()))
+
+            copy, result = import_in_thread(db, batches, journal)
+            self.assertTrue(result)
+            # До подмены база не видит строк импорта
+            self.assertEqual(len(db.operations), 20)
+            db.adopt(copy)
+            self.assertEqual(rows(db), rows(expected))
+            self.assertEqual(db.next_id, 91)
+            self.assertEqual(len(db.search('кофе')), 90)
+            self.assertTrue(db.check_totals())
+            self.assertEqual(rollups.trend('month'), self.rebuilt_trend(db))
+            journal.close()
+            with open(journal.journal_path, 'r', encoding='utf-8') as file:
+                self.assertEqual([json.loads(line)['op'] for line in file][-1], 'import')
+
+            reopened = Database()
+            journal = Journal(reopened, path, fsync=False)
+            self.assertTrue(journal.open())
+            self.assertEqual(rows(reopened), rows(expected))
+            journal.close()
+
+    def rebuilt_trend(self, db):
+        rollups = Rollups()
+        rollups.build(db)
+        return rollups.trend('month')
+
+    def test_sqlite_copy_is_adopted(self):
+        rng = random.Random(9)
+        with tempfile.TemporaryDirectory() as folder:
+            db = SQLiteDatabase(os.path.join(folder, 'ledger.db'))
+            try:
+                for _ in range(20):
+                    db.add_operation(random_operation(rng))
+                self.assertEqual(len(db.search('кофе')), 20)
+                copy, result = import_in_thread(db, [random_batch(rng, 30)])
+                self.assertTrue(result)
+                db.adopt(copy)
+                self.assertEqual(db.total(), 50)
+                self.assertEqual(db.next_id, 51)
+                self.assertEqual(len(db.search('кофе')), 50)
+                self.assertEqual(db.add_operation(random_operation(rng)), 51)
+                self.assertTrue(db.check_totals())
+            finally:
+                db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
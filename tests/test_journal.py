@@ -0,0 +1,117 @@
+#test_journal.py - проверки журнала: восстановление после аварийного завершения
+
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from helpers import random_batch, random_operation, rows
+from models import ImportResult
+from journal import Journal
+from storage import Database
+
+
+def open_journal(path):
+    db = Database()
+    journal = Journal(db, path, fsync=False)
+    return db, journal
+
+
+class JournalRecoveryTest(unittest.TestCase):
+    def test_partial_last_line_is_cut_off(self):
+        rng = random.Random(4)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'data.json')
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            for _ in range(3):
+                db.add_operation(random_operation(rng))
+            journal.close()
+            # Программа упала посреди записи четвёртой строки
+            with open(journal.journal_path, 'a', encoding='utf-8') as file:
+                file.write('{"op":"add","id":4,"amo')
+
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            self.assertEqual(len(db.operations), 3)
+            for _ in range(5):
+                db.add_operation(random_operation(rng))
+            expected = rows(db)
+            journal.close()
+
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            self.assertEqual(rows(db), expected)
+            self.assertEqual(len(db.operations), 8)
+            journal.close()
+
+    def test_damaged_line_in_the_middle_is_reported(self):
+        rng = random.Random(5)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'data.json')
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            for _ in range(3):
+                db.add_operation(random_operation(rng))
+            journal.close()
+            with open(journal.journal_path, 'r', encoding='utf-8') as file:
+                lines = file.readlines()
+            lines[1] = lines[1][:10] + '\n'
+            with open(journal.journal_path, 'w', encoding='utf-8') as file:
+                file.writelines(lines)
+            size = os.path.getsize(journal.journal_path)
+
+            db, journal = open_journal(path)
+            self.assertFalse(journal.open())
+            self.assertEqual(os.path.getsize(journal.journal_path), size)
+
+
+class JournalImportTest(unittest.TestCase):
+    def test_import_is_one_record(self):
+        rng = random.Random(6)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'data.json')
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            db.add_operation(random_operation(rng))
+            self.assertTrue(db.import_batches([random_batch(rng, 200), random_batch(rng, 100)], ImportResult()))
+            db.add_operation(random_operation(rng))
+            expected = rows(db)
+            journal.close()
+            with open(journal.journal_path, 'r', encoding='utf-8') as file:
+                events = [json.loads(line)['op'] for line in file]
+            self.assertEqual(events, ['add', 'import', 'add'])
+
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            self.assertEqual(rows(db), expected)
+            self.assertEqual(db.next_id, 303)
+            self.assertTrue(db.check_totals())
+            journal.close()
+
+    def test_import_replayed_over_snapshot(self):
+        # Снимок уже содержит импорт, часть строк которого затем удалена:
+        # повтор журнала поверх снимка должен дать то же состояние
+        rng = random.Random(7)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'data.json')
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            self.assertTrue(db.import_batches([random_batch(rng, 50)], ImportResult()))
+            for operation_id in range(1, 51, 3):
+                self.assertTrue(db.delete(operation_id))
+            self.assertTrue(db.update(2, comment='чай'))
+            expected = rows(db)
+            journal.close()
+            self.assertTrue(db.export_to_json(path))
+
+            db, journal = open_journal(path)
+            self.assertTrue(journal.open())
+            self.assertEqual(rows(db), expected)
+            self.assertTrue(db.check_totals())
+            journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#test_json.py - проверки потокового JSON и NDJSON: запись, чтение блоками, круговой перевод
+
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from helpers import random_operation, rows
+import storage
+from storage import Database, iter_json_array, write_json
+
+ODD_COMMENTS = ('', 'кофе "с собой"', 'строка\nвторая', 'таб\tи \\ слеш', '😀 эмодзи', '</script>', ' ' * 3)
+
+
+def sample_rows(count, seed):
+    rng = random.Random(seed)
+    db = Database()
+    for number in range(count):
+        op = random_operation(rng)
+        op.comment = ODD_COMMENTS[number % len(ODD_COMMENTS)] + op.comment
+        db.add_operation(op)
+    return rows(db)
+
+
+class WriteJsonTest(unittest.TestCase):
+    def test_indented_output_matches_json_dump(self):
+        # Прежний экспорт писал json.dump(список, ensure_ascii=False, indent=4)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'out.json')
+            for data in ([], sample_rows(1, 1), sample_rows(25, 2)):
+                for indent in (4, 2):
+                    write_json(path, iter(data), indent)
+                    with open(path, 'rb') as file:
+                        written = file.read()
+                    expected = json.dumps(data, ensure_ascii=False, indent=indent).encode('utf-8')
+                    self.assertEqual(written, expected, f"{len(data)} строк, indent={indent}")
+
+    def test_export_matches_json_dump(self):
+        db = Database()
+        db.operations = sample_rows(40, 3)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'out.json')
+            self.assertTrue(db.export_to_json(path))
+            with open(path, 'r', encoding='utf-8') as file:
+                self.assertEqual(file.read(), json.dumps(rows(db), ensure_ascii=False, indent=4))
+            self.assertTrue(db.export_to_json(path, indent=None))
+            with open(path, 'r', encoding='utf-8') as file:
+                self.assertEqual(json.load(file), rows(db))
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.read_size = storage.JSON_READ_SIZE
+
+    def tearDown(self):
+        storage.JSON_READ_SIZE = self.read_size
+
+    def test_items_crossing_read_blocks(self):
+        data = sample_rows(30, 4)
+        texts = [json.dumps(data, ensure_ascii=False, indent=4),
+                 json.dumps(data, ensure_ascii=False, separators=(',', ':')),
+                 ' \n [ ' + ' ,\n'.join(json.dumps(row, ensure_ascii=False) for row in data) + '\n ] \n']
+        for size in (1, 2, 3, 7, 64, 1000):
+            storage.JSON_READ_SIZE = size
+            for text in texts:
+                self.assertEqual(list(iter_json_array(io.StringIO(text))), data, f"блок {size}")
+
+    def test_item_crossing_default_block(self):
+        # Каждый элемент по очереди пересекает границу блока JSON_READ_SIZE
+        row = {'comment': 'x'}
+        base = len(json.dumps([row]))
+        for shift in range(-3, 4):
+            padding = storage.JSON_READ_SIZE - base // 2 + shift
+            data = [{'comment': 'я' * padding}, row, {'n': [1, 2, {'k': 'v'}]}]
+            text = json.dumps(data, ensure_ascii=False)
+            self.assertEqual(list(iter_json_array(io.StringIO(text))), data)
+
+    def test_empty_and_malformed_arrays(self):
+        storage.JSON_READ_SIZE = 3
+        self.assertEqual(list(iter_json_array(io.StringIO(' [ \n ] '))), [])
+        for text in ('', '{"a": 1}', '[1 2]', '[1, 2', '[{"a": 1}, {"a": ]'):
+            with self.assertRaises(ValueError, msg=repr(text)):
+                list(iter_json_array(io.StringIO(text)))
+
+
+class RoundTripTest(unittest.TestCase):
+    def test_json_and_ndjson_round_trips(self):
+        source = Database()
+        source.operations = sample_rows(120, 5)
+        with tempfile.TemporaryDirectory() as folder:
+            for name, export, load in (('out.json', Database.export_to_json, Database.import_from_json),
+                                       ('out.ndjson', Database.export_to_ndjson, Database.import_from_ndjson)):
+                path = os.path.join(folder, name)
+                self.assertTrue(export(source, path))
+                db = Database()
+                # Маленькие порции: строки файла проходят через несколько ImportBatch
+                result = load(db, path, chunk_size=17)
+                self.assertTrue(result, name)
+                self.assertEqual(result.added, 120)
+                self.assertEqual(rows(db), rows(source), name)
+                self.assertTrue(db.check_totals())
+
+    def test_ndjson_blank_and_bad_lines(self):
+        data = sample_rows(3, 6)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'in.ndjson')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(json.dumps(data[0], ensure_ascii=False) + '\n\n')
+                file.write('{"amount": 1, "category": \n')
+                file.write(json.dumps(data[1], ensure_ascii=False) + '\n   \n')
+                file.write(json.dumps(data[2], ensure_ascii=False))
+            db = Database()
+            result = db.import_from_ndjson(path)
+            self.assertTrue(result)
+            self.assertEqual(result.added, 3)
+            self.assertEqual([line for line, message in result.errors], [3])
+            self.assertEqual([op['comment'] for op in db.operations], [row['comment'] for row in data])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+#test_query.py - проверки выборок: запрос по датам и поиск против полного перебора
+
+import os
+import random
+import tempfile
+import unittest
+
+from helpers import CATEGORIES, TYPES, random_batch, random_operation, rows
+import storage
+from models import ImportResult, Operation
+from sqlite_storage import SQLiteDatabase
+from storage import Database, tokenize
+
+
+def random_bounds(rng):
+    def date():
+        return f"2024-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}"
+    start = rng.choice((None, date()))
+    end = rng.choice((None, date(), '2023-12-31'))
+    category = rng.choice((None, None) + CATEGORIES + ('Нет такой',))
+    operation_type = rng.choice((None, None) + TYPES)
+    return start, end, category, operation_type
+
+
+def brute_query(operations, start, end, category, operation_type):
+    # В порядке дат, внутри даты - по id
+    found = [op for op in operations
+             if (start is None or op['date'] >= start) and (end is None or op['date'] <= end)
+             and (category is None or op['category'] == category)
+             and (operation_type is None or op['operation_type'] == operation_type)]
+    return sorted(found, key=lambda op: (op['date'], op['id']))
+
+
+def random_text(rng):
+    # Начала слов категорий и комментариев, числа и слово, которого нет
+    words = [word[:rng.randint(1, len(word))] for word in tokenize(' '.join(CATEGORIES))]
+    words += ['коф', 'кофе', str(rng.randrange(100)), str(rng.randrange(10)), 'чай']
+    return ' '.join(rng.sample(words, rng.randint(1, 2)))
+
+
+def brute_search(operations, text):
+    # По возрастанию id: каждое слово запроса - начало слова комментария или категории
+    prefixes = tokenize(text)
+    found = []
+    for op in operations:
+        words = tokenize(op['category']) + tokenize(op['comment'])
+        if all(any(word.startswith(prefix) for word in words) for prefix in prefixes):
+            found.append(op)
+    return sorted(found, key=lambda op: op['id'])
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        # Уплотнение после удалений тоже попадает в проверку
+        self.compact_min = storage.COMPACT_MIN_DELETED
+        storage.COMPACT_MIN_DELETED = 16
+
+    def tearDown(self):
+        storage.COMPACT_MIN_DELETED = self.compact_min
+
+    def check(self, db, rng, step):
+        operations = rows(db)
+        for _ in range(5):
+            bounds = random_bounds(rng)
+            view = db.query(*bounds)
+            expected = brute_query(operations, *bounds)
+            self.assertEqual([dict(op) for op in view], expected, f"шаг {step}: {bounds}")
+            self.assertEqual(len(view), len(expected))
+            if expected:
+                index = rng.randrange(len(expected))
+                self.assertEqual(dict(view[index]), expected[index])
+                self.assertEqual(dict(view[-1]), expected[-1])
+            with self.assertRaises(IndexError):
+                view[len(expected)]
+
+    def run_changes(self, db, seed):
+        # Возвращает, сколько раз хранилище уплотнилось (у SQLite - 0)
+        rng = random.Random(seed)
+        for _ in range(100):
+            db.add_operation(random_operation(rng))
+        compactions = 0
+        for step in range(300):
+            ids = [op['id'] for op in db.operations]
+            choice = rng.random()
+            if choice < 0.2 or not ids:
+                db.add_operation(random_operation(rng))
+            elif choice < 0.45:
+                fields = rng.choice(({'date': random_operation(rng).date}, {'category': rng.choice(CATEGORIES)},
+                                     {'operation_type': rng.choice(TYPES), 'amount': 5.0}))
+                self.assertTrue(db.update(rng.choice(ids), **fields))
+            elif choice < 0.9:
+                self.assertTrue(db.delete(rng.choice(ids)))
+                # После удаления без уплотнения в хранилище остаётся хотя бы одна удалённая строка
+                if isinstance(db, Database) and not db.store.deleted:
+                    compactions += 1
+            else:
+                self.assertTrue(db.import_batches([random_batch(rng, rng.randint(1, 10))], ImportResult()))
+            self.check(db, rng, step)
+        return compactions
+
+    def test_database(self):
+        self.assertGreater(self.run_changes(Database(), 21), 0)
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as folder:
+            db = SQLiteDatabase(os.path.join(folder, 'ledger.db'))
+            try:
+                self.run_changes(db, 22)
+            finally:
+                db.close()
+
+    def test_iteration_while_editing(self):
+        # Обход выборки переживает добавление, правку даты и уплотнение:
+        # каждая строка, которая была в выборке и не удалена, выдаётся ровно один раз
+        rng = random.Random(23)
+        db = Database()
+        for _ in range(200):
+            db.add_operation(random_operation(rng))
+        before = {op['id'] for op in db.query('2024-03-01', '2024-09-30')}
+        seen = []
+        deleted = set()
+        for number, op in enumerate(db.query('2024-03-01', '2024-09-30')):
+            seen.append(op['id'])
+            if number % 10 == 0:
+                db.add_operation(random_operation(rng))
+            if number % 7 == 0:
+                victim = rng.choice([op['id'] for op in db.operations])
+                deleted.add(victim)
+                db.delete(victim)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertTrue(before - deleted <= set(seen))
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        self.compact_min = storage.COMPACT_MIN_DELETED
+        storage.COMPACT_MIN_DELETED = 16
+
+    def tearDown(self):
+        storage.COMPACT_MIN_DELETED = self.compact_min
+
+    def run_changes(self, db, seed):
+        rng = random.Random(seed)
+        for _ in range(100):
+            db.add_operation(random_operation(rng))
+        for step in range(200):
+            ids = [op['id'] for op in db.operations]
+            choice = rng.random()
+            if choice < 0.25 or not ids:
+                db.add_operation(random_operation(rng))
+            elif choice < 0.5:
+                fields = rng.choice(({'comment': random_operation(rng).comment},
+                                     {'category': rng.choice(CATEGORIES)}, {'comment': 'Ёлка'}))
+                self.assertTrue(db.update(rng.choice(ids), **fields))
+            elif choice < 0.9:
+                self.assertTrue(db.delete(rng.choice(ids)))
+            else:
+                self.assertTrue(db.import_batches([random_batch(rng, rng.randint(1, 10))], ImportResult()))
+            operations = rows(db)
+            for text in [random_text(rng) for _ in range(3)] + ['елк']:
+                expected = brute_search(operations, text)
+                view = db.search(text)
+                self.assertEqual([dict(op) for op in view], expected, f"шаг {step}: {text}")
+                self.assertEqual(len(view), len(expected))
+
+    def test_database(self):
+        self.run_changes(Database(), 31)
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as folder:
+            db = SQLiteDatabase(os.path.join(folder, 'ledger.db'))
+            try:
+                self.run_changes(db, 32)
+            finally:
+                db.close()
+
+    def test_ids_are_not_repeated_or_skipped(self):
+        db = Database()
+        for number in range(1, 11):
+            db.add_operation(Operation(1.0, 'Кафе', '2024-01-01', 'кофе' if number % 2 else 'чай', 'expense'))
+        found = []
+        for op in db.search('кофе'):
+            found.append(op['id'])
+            if op['id'] == 3:
+                # Вставка перед текущим местом обхода сдвигает массив индекса вправо
+                db.update(2, comment='кофе')
+            elif op['id'] == 5:
+                # Удаление до текущего места сдвигает его влево
+                db.delete(1)
+                db.update(8, comment='кофе')
+        self.assertEqual(found, [1, 3, 5, 7, 8, 9])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+#test_snapshot.py - проверки снимков: снимок на момент времени, запись .fpsnap поверх
+#отображённого файла, чтение .fpsnap прежней версии
+
+import os
+import random
+import tempfile
+import unittest
+from array import array
+
+from helpers import random_operation, rows
+import snapshot
+from storage import Database, OPERATION_TYPES
+from utils import date_to_ordinal
+
+
+def write_v1(filename, operations, next_id):
+    # Снимок версии 1, как его писала прежняя программа: суммы и итоги - float
+    names = []
+    for op in operations:
+        if op['category'] not in names:
+            names.append(op['category'])
+    income = [0.0] * len(names)
+    expense = [0.0] * len(names)
+    counts = [0] * len(names)
+    for op in operations:
+        code = names.index(op['category'])
+        if op['operation_type'] == 'income':
+            income[code] += op['amount']
+        else:
+            expense[code] += op['amount']
+        counts[code] += 1
+
+    def blob(texts):
+        offsets = array('q', [0])
+        data = b''
+        for text in texts:
+            data += text.encode('utf-8')
+            offsets.append(len(data))
+        return offsets, data
+
+    comment_offsets, comment_blob = blob(op['comment'] for op in operations)
+    name_offsets, name_blob = blob(names)
+    sections = {
+        'ids': array('q', (op['id'] for op in operations)),
+        'amounts': array('d', (op['amount'] for op in operations)),
+        'dates': array('i', (date_to_ordinal(op['date']) for op in operations)),
+        'categories': array('i', (names.index(op['category']) for op in operations)),
+        'types': array('b', (OPERATION_TYPES.index(op['operation_type']) for op in operations)),
+        'comment_offsets': comment_offsets,
+        'comment_blob': comment_blob,
+        'category_income': array('d', income),
+        'category_expense': array('d', expense),
+        'category_counts': array('q', counts),
+        'name_offsets': name_offsets,
+        'name_blob': name_blob,
+    }
+    with open(filename, 'wb') as file:
+        file.write(snapshot.HEADER_V1.pack(snapshot.MAGIC, 1, snapshot.FLAG_SORTED_IDS, len(operations),
+                                           next_id, len(names)))
+        table_position = file.tell()
+        file.write(b'\x00' * snapshot.SECTION_TABLE.size)
+        table = []
+        for name, typecode in snapshot.SECTIONS_V1:
+            file.write(b'\x00' * (-file.tell() % snapshot.ALIGNMENT))
+            start = file.tell()
+            data = sections[name]
+            file.write(data if isinstance(data, bytes) else data.tobytes())
+            table.extend((start, file.tell() - start))
+        file.seek(table_position)
+        file.write(snapshot.SECTION_TABLE.pack(*table))
+
+
+class SnapshotVersionTest(unittest.TestCase):
+    def test_version_1_snapshot_is_loaded(self):
+        operations = [
+            {'id': 1, 'amount': 0.1, 'category': 'Кафе', 'date': '2024-01-01', 'comment': 'кофе',
+             'operation_type': 'expense'},
+            {'id': 2, 'amount': 0.2, 'category': 'Кафе', 'date': '2024-01-02', 'comment': '',
+             'operation_type': 'expense'},
+            {'id': 4, 'amount': 1234567.89, 'category': 'Зарплата', 'date': '2024-02-01', 'comment': 'май',
+             'operation_type': 'income'},
+            {'id': 7, 'amount': 2.675, 'category': 'Транспорт', 'date': '2024-03-01', 'comment': 'такси',
+             'operation_type': 'expense'},
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'old.fpsnap')
+            write_v1(path, operations, 8)
+            db = Database()
+            self.assertTrue(db.load(path))
+            self.assertEqual(db.next_id, 8)
+            self.assertEqual(list(db.store.amounts), [10, 20, 123456789, 268])
+            self.assertEqual(db.get_category_totals(), {'Кафе': -0.3, 'Зарплата': 1234567.89, 'Транспорт': -2.68})
+            self.assertEqual(db.get_balance(), 1234564.91)
+            self.assertTrue(db.check_totals())
+            self.assertEqual([op['comment'] for op in db.operations], ['кофе', '', 'май', 'такси'])
+            self.assertEqual(db.get(4)['date'], '2024-02-01')
+            self.assertTrue(db.update(7, amount=3.5))
+            self.assertTrue(db.check_totals())
+
+            # Пересохранение пишет текущую версию
+            saved = os.path.join(folder, 'new.fpsnap')
+            self.assertTrue(db.export_to_snapshot(saved))
+            reloaded = Database()
+            self.assertTrue(reloaded.load(saved))
+            self.assertEqual(rows(reloaded), rows(db))
+
+
+class SnapshotFileTest(unittest.TestCase):
+    def test_export_onto_mapped_snapshot_is_refused(self):
+        rng = random.Random(1)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'ledger.fpsnap')
+            db = Database()
+            for _ in range(500):
+                db.add_operation(random_operation(rng))
+            self.assertTrue(db.export_to_snapshot(path))
+            size = os.path.getsize(path)
+
+            loaded = Database()
+            self.assertTrue(loaded.load(path))
+            balance = loaded.get_balance()
+            # Запись поверх отображённого файла обрезала бы его под mmap
+            self.assertFalse(loaded.export_to_snapshot(path))
+            self.assertFalse(loaded.snapshot().export_to_snapshot(path))
+            self.assertEqual(os.path.getsize(path), size)
+            self.assertEqual(loaded.get_balance(), balance)
+            self.assertEqual(len(loaded.operations), 500)
+
+            other = os.path.join(folder, 'copy.fpsnap')
+            self.assertTrue(loaded.export_to_snapshot(other))
+            self.assertEqual(sorted(os.listdir(folder)), ['copy.fpsnap', 'ledger.fpsnap'])
+            reloaded = Database()
+            self.assertTrue(reloaded.load(other))
+            self.assertEqual(reloaded.get_balance(), balance)
+            self.assertTrue(reloaded.check_totals())
+
+    def test_snapshot_is_point_in_time(self):
+        rng = random.Random(2)
+        db = Database()
+        for _ in range(300):
+            db.add_operation(random_operation(rng))
+        snapshot = db.snapshot()
+        expected = [op.to_dict() for op in snapshot.operations]
+        for op in list(db.operations)[:100]:
+            db.update(op['id'], comment='изменено', amount=1.0)
+        for op in list(db.operations)[100:150]:
+            db.delete(op['id'])
+        db.add_operation(random_operation(rng))
+        self.assertEqual([op.to_dict() for op in snapshot.operations], expected)
+        self.assertTrue(snapshot.check_totals())
+        self.assertTrue(db.check_totals())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#test_sqlite.py - проверки базы SQLite: соединения снимков, id операций
+
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from helpers import random_operation
+from sqlite_storage import SQLiteDatabase
+
+
+class SQLiteSnapshotTest(unittest.TestCase):
+    def test_snapshot_connection_does_not_write(self):
+        rng = random.Random(10)
+        with tempfile.TemporaryDirectory() as folder:
+            db = SQLiteDatabase(os.path.join(folder, 'ledger.db'))
+            snapshot = None
+            try:
+                for _ in range(10):
+                    db.add_operation(random_operation(rng))
+                snapshot = db.snapshot()
+                self.assertEqual(snapshot.total(), 10)
+                self.assertEqual(snapshot.conn.total_changes, 0)
+                # Снимок не держит блокировку записи: писатель продолжает работать
+                self.assertTrue(db.add_operation(random_operation(rng)))
+                self.assertEqual(len(snapshot.operations), 10)
+            finally:
+                if snapshot is not None:
+                    snapshot.close()
+                db.close()
+
+
+class SQLiteIdTest(unittest.TestCase):
+    def test_deleted_last_id_is_not_reused(self):
+        rng = random.Random(11)
+        with tempfile.TemporaryDirectory() as folder:
+            db = SQLiteDatabase(os.path.join(folder, 'ledger.db'))
+            try:
+                for _ in range(3):
+                    db.add_operation(random_operation(rng))
+                self.assertTrue(db.delete(3))
+                self.assertEqual(db.add_operation(random_operation(rng)), 4)
+                self.assertIsNone(db.get(3))
+                self.assertEqual([op['id'] for op in db.operations], [1, 2, 4])
+                self.assertTrue(db.check_totals())
+            finally:
+                db.close()
+
+
+class SQLiteMigrationTest(unittest.TestCase):
+    def test_real_amounts_are_converted(self):
+        # Файл прежней версии: суммы и итоги - REAL, таблицы настроек ещё нет
+        rows = [(1, 0.1, 'Кафе', '2024-01-01', 'a', 'expense'),
+                (2, 0.2, 'Кафе', '2024-01-02', 'b', 'expense'),
+                (3, 19.99, 'Зарплата', '2024-01-03', '', 'income'),
+                (4, 1234567.89, 'Зарплата', '2024-01-04', '', 'income'),
+                (5, 2.675, 'Транспорт', '2024-01-05', 'c', 'expense')]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'old.db')
+            connection = sqlite3.connect(path)
+            with connection:
+                connection.execute("CREATE TABLE operations (id INTEGER PRIMARY KEY, amount REAL NOT NULL, "
+                                   "category TEXT NOT NULL, date TEXT NOT NULL, comment TEXT NOT NULL DEFAULT '', "
+                                   "operation_type TEXT NOT NULL)")
+                connection.execute("CREATE TABLE category_totals (category TEXT PRIMARY KEY, first_id INTEGER NOT NULL, "
+                                   "income REAL NOT NULL DEFAULT 0, expense REAL NOT NULL DEFAULT 0, "
+                                   "count INTEGER NOT NULL DEFAULT 0)")
+                connection.executemany("INSERT INTO operations VALUES (?, ?, ?, ?, ?, ?)", rows)
+                connection.executemany(
+                    "INSERT INTO category_totals VALUES (?, ?, ?, ?, ?)",
+                    [('Кафе', 1, 0, 0.1 + 0.2, 2), ('Зарплата', 3, 19.99 + 1234567.89, 0, 2),
+                     ('Транспорт', 5, 0, 2.675, 1)])
+            connection.close()
+
+            db = SQLiteDatabase(path)
+            try:
+                self.assertEqual(db.raw("SELECT amount FROM operations ORDER BY id"),
+                                 [(10,), (20,), (1999,), (123456789,), (268,)])
+                self.assertEqual(db.raw("SELECT typeof(amount) FROM operations GROUP BY 1"), [('integer',)])
+                self.assertEqual(db.get_category_totals(), {'Кафе': -0.3, 'Зарплата': 1234587.88, 'Транспорт': -2.68})
+                self.assertEqual(db.get_balance(), 1234584.9)
+                self.assertTrue(db.check_totals())
+                self.assertEqual([op['amount'] for op in db.operations], [0.1, 0.2, 19.99, 1234567.89, 2.68])
+                self.assertEqual(db.total(), 5)
+                self.assertEqual(db.add_operation(random_operation(random.Random(14))), 6)
+                self.assertTrue(db.check_totals())
+            finally:
+                db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#test_storage.py - проверки хранилища: суммы после смешанных изменений, индексация списка операций
+#
+#   python -m pytest tests
+#   python -m unittest discover tests
+
+import os
+import random
+import tempfile
+import unittest
+
+from helpers import CATEGORIES, TYPES, random_batch, random_operation
+import storage
+from models import ImportResult
+from sqlite_storage import SQLiteDatabase
+from storage import Database
+
+
+def failing_batches(rng):
+    # Первая порция принимается, затем ошибка: импорт должен откатиться целиком
+    yield random_batch(rng, 20)
+    raise ValueError("обрыв файла")
+
+
+class TotalsTest(unittest.TestCase):
+    # Одинаковая последовательность изменений для обеих баз; после каждого шага
+    # поддерживаемые суммы должны точно совпадать с полным пересчётом
+    def setUp(self):
+        # Уплотнение после удалений тоже попадает в проверку
+        self.compact_min = storage.COMPACT_MIN_DELETED
+        storage.COMPACT_MIN_DELETED = 16
+
+    def tearDown(self):
+        storage.COMPACT_MIN_DELETED = self.compact_min
+
+    def run_changes(self, db):
+        rng = random.Random(3)
+        ids = []
+        for step in range(600):
+            choice = rng.random()
+            if choice < 0.4 or not ids:
+                ids.append(db.add_operation(random_operation(rng)))
+            elif choice < 0.6:
+                # Правка меняет и категорию, и тип: строка переходит между итогами
+                db.update(rng.choice(ids), amount=round(rng.uniform(1, 100), 2),
+                          category=rng.choice(CATEGORIES), operation_type=rng.choice(TYPES))
+            elif choice < 0.8:
+                operation_id = ids.pop(rng.randrange(len(ids)))
+                self.assertTrue(db.delete(operation_id))
+            elif choice < 0.9:
+                result = db.import_batches([random_batch(rng, rng.randint(1, 50))], ImportResult())
+                self.assertTrue(result)
+                ids = [op['id'] for op in db.operations]
+            else:
+                before = db.get_category_totals()
+                result = db.import_batches(failing_batches(rng), ImportResult())
+                self.assertFalse(result)
+                self.assertEqual(db.get_category_totals(), before)
+            self.assertTrue(db.check_totals(), f"шаг {step}")
+        self.assertEqual(len(db.operations), len(ids))
+
+    def test_column_store(self):
+        self.run_changes(Database())
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as folder:
+            db = SQLiteDatabase(os.path.join(folder, 'ledger.db'))
+            try:
+                self.run_changes(db)
+            finally:
+                db.close()
+
+
+class OperationsViewTest(unittest.TestCase):
+    def test_index_after_deletes_does_not_compact(self):
+        rng = random.Random(12)
+        db = Database()
+        for _ in range(50):
+            db.add_operation(random_operation(rng))
+        for operation_id in (1, 7, 8, 30, 50):
+            self.assertTrue(db.delete(operation_id))
+        store = db.store
+        ids = store.ids
+        expected = [op['id'] for op in db.operations]
+        view = db.operations
+        self.assertEqual([view[i]['id'] for i in range(len(view))], expected)
+        self.assertEqual([view[i]['id'] for i in range(-1, -len(view) - 1, -1)], expected[::-1])
+        self.assertEqual([op['id'] for op in view[3:20:4]], expected[3:20:4])
+        self.assertEqual([op['id'] for op in view[::-1]], expected[::-1])
+        with self.assertRaises(IndexError):
+            view[len(view)]
+        self.assertIs(store.ids, ids)
+        self.assertEqual(store.deleted, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#test_utils.py - проверки вспомогательных функций: разбор дат, суммы в младших единицах
+
+import datetime
+import random
+import unittest
+from decimal import Decimal
+
+import helpers  # корень проекта в sys.path
+import utils
+from utils import date_to_ordinal, ordinal_to_date, validate_date, to_minor, from_minor, format_minor
+
+
+def strptime_ordinal(text):
+    # Прежняя проверка даты: strptime и обратно в текст без изменений
+    try:
+        date = datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    except (ValueError, TypeError):
+        return None
+    return date.toordinal() if date.isoformat() == text else None
+
+
+def random_date_text(rng):
+    year = rng.choice((rng.randint(1900, 2100), rng.randint(1, 9999), 0))
+    month = rng.choice((rng.randint(1, 12), rng.randint(0, 13)))
+    day = rng.choice((rng.randint(1, 28), rng.randint(0, 32)))
+    text = f"{year:04}-{month:02}-{day:02}"
+    damage = rng.random()
+    if damage < 0.1:
+        text = f"{year}-{month}-{day}"
+    elif damage < 0.15:
+        text = ' ' + text
+    elif damage < 0.2:
+        text = text + '\n'
+    elif damage < 0.25:
+        text = text.replace('-', '/')
+    elif damage < 0.3:
+        text = text[:rng.randrange(len(text))]
+    elif damage < 0.33:
+        # Цифры не ASCII: \d без re.ASCII пропустил бы их
+        text = text.translate(str.maketrans('0123456789', '٠١٢٣٤٥٦٧٨٩'))
+    return text
+
+
+class DateParsingTest(unittest.TestCase):
+    def test_matches_strptime(self):
+        rng = random.Random(20)
+        texts = [random_date_text(rng) for _ in range(20000)]
+        texts += ['2024-02-29', '2023-02-29', '2000-02-29', '1900-02-29', '9999-12-31', '0001-01-01',
+                  '2024-04-31', '2024-12-32', '+024-01-01', '2024-01-1', '20240101', '']
+        for text in texts:
+            expected = strptime_ordinal(text)
+            self.assertEqual(validate_date(text), expected is not None, repr(text))
+            if expected is None:
+                with self.assertRaises(ValueError, msg=repr(text)):
+                    date_to_ordinal(text)
+            else:
+                self.assertEqual(date_to_ordinal(text), expected, repr(text))
+                self.assertEqual(ordinal_to_date(expected), text)
+        # Повторный разбор идёт через кеш и даёт то же самое
+        for text in texts[:500]:
+            self.assertEqual(validate_date(text), strptime_ordinal(text) is not None)
+        for value in (None, 20240101, datetime.date(2024, 1, 1)):
+            self.assertFalse(validate_date(value))
+
+    def test_cache_overflow(self):
+        size = utils.DATE_CACHE_SIZE
+        try:
+            utils.DATE_CACHE_SIZE = 10
+            start = datetime.date(2020, 1, 1).toordinal()
+            for ordinal in range(start, start + 50):
+                self.assertEqual(date_to_ordinal(ordinal_to_date(ordinal)), ordinal)
+            self.assertLessEqual(len(utils.parsed_dates), 10)
+        finally:
+            utils.DATE_CACHE_SIZE = size
+
+
+class ToMinorTest(unittest.TestCase):
+    def test_half_cent_rounds_half_up(self):
+        # Строки и float разбираются как десятичная запись: 1.005 - это 1.005, а не 1.00499...
+        for value, units in (('0.005', 1), ('0.015', 2), ('0.004', 0), ('1.005', 101), ('2.675', 268),
+                             (0.005, 1), (1.005, 101), (2.675, 268), (1.0049, 100),
+                             (Decimal('1.005'), 101), ('10.125', 1013)):
+            self.assertEqual(to_minor(value), units, repr(value))
+
+    def test_negative_amounts(self):
+        # Половина округляется от нуля, как у положительных сумм
+        for value, units in (('-0.005', -1), ('-1.005', -101), (-2.675, -268), ('-0.50', -50),
+                             ('-12', -1200), (-12.34, -1234), (-7, -700), ('-0', 0)):
+            self.assertEqual(to_minor(value), units, repr(value))
+
+    def test_strings_and_ints(self):
+        for value, units in (('12', 1200), ('12.3', 1230), ('12.30', 1230), (' 7.5 ', 750), ('.5', 50),
+                             ('1e2', 10000), (5, 500), (0, 0), (0.1 + 0.2, 30), (19.99, 1999)):
+            self.assertEqual(to_minor(value), units, repr(value))
+        for value in ('', 'abc', '1,5', 'nan', 'inf', '1.2.3'):
+            with self.assertRaises(ValueError, msg=repr(value)):
+                to_minor(value)
+        for value in (True, None, [1]):
+            with self.assertRaises(TypeError, msg=repr(value)):
+                to_minor(value)
+
+    def test_large_magnitudes(self):
+        largest = (1 << 63) - 1
+        self.assertEqual(to_minor('92233720368547758.07'), largest)
+        self.assertEqual(to_minor('-92233720368547758.08'), -largest - 1)
+        self.assertEqual(format_minor(largest), '92233720368547758.07')
+        for value in ('92233720368547758.08', '-92233720368547758.09', 10 ** 17, 1e19):
+            with self.assertRaises(ValueError, msg=repr(value)):
+                to_minor(value)
+        # Больше 2**53 младших единиц float уже не точен, но целые суммы переводятся без потерь
+        self.assertEqual(to_minor(1e15), 10 ** 17)
+        self.assertEqual(to_minor(12345678901234.56), 1234567890123456)
+        self.assertEqual(to_minor('123456789012345.675'), 12345678901234568)
+
+    def test_round_trip(self):
+        for units in (0, 1, -1, 5, -5, 99, 100, -100, 123456, -987654321, 10 ** 15 - 1):
+            self.assertEqual(to_minor(from_minor(units)), units)
+            self.assertEqual(to_minor(format_minor(units)), units)
+        self.assertEqual(format_minor(-5), '-0.05')
+
+    def test_other_digit_counts(self):
+        try:
+            utils.set_amount_digits(0)
+            self.assertEqual(to_minor('12.5'), 13)
+            self.assertEqual(to_minor(-12.5), -13)
+            self.assertEqual(format_minor(-13), '-13')
+            utils.set_amount_digits(3)
+            self.assertEqual(to_minor('1.0005'), 1001)
+            self.assertEqual(format_minor(1001), '1.001')
+        finally:
+            utils.set_amount_digits(2)
+
+
+if __name__ == "__main__":
+    unittest.main()
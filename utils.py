@@ -1,15 +1,136 @@
 #utils.py - вспомогательные функции
 
 import datetime
+import os
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+
+# Строгий формат даты: ровно ГГГГ-ММ-ДД, как после strptime + strftime
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}', re.ASCII)
+# Разобранные даты кешируются: в выписках банков одни и те же даты повторяются тысячи раз
+DATE_CACHE_SIZE = 1 << 16
+parsed_dates = {}
+
+def date_to_ordinal(date_text):
+    ordinal = parsed_dates.get(date_text)
+    if ordinal is None:
+        if not isinstance(date_text, str) or not DATE_PATTERN.fullmatch(date_text):
+            raise ValueError(f"Неверный формат даты: {date_text}")
+        ordinal = datetime.date(int(date_text[:4]), int(date_text[5:7]), int(date_text[8:])).toordinal()
+        if len(parsed_dates) >= DATE_CACHE_SIZE:
+            parsed_dates.clear()
+        parsed_dates[date_text] = ordinal
+    return ordinal
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def ordinal_to_date(ordinal):
+    return datetime.date.fromordinal(ordinal).isoformat()
 
 def validate_date(date_text):
     try:
-        if date_text != datetime.datetime.strptime(date_text, "%Y-%m-%d").strftime('%Y-%m-%d'):
-            raise ValueError
+        date_to_ordinal(date_text)
         return True
-    except ValueError:
+    except (ValueError, TypeError):
         return False
 
+# Суммы хранятся целым числом младших единиц валюты (копеек): сложение точное.
+# Число знаков после запятой задаётся при запуске (FINPLANNER_AMOUNT_DIGITS, ключ
+# --amount-digits) до открытия базы; снимки и SQLite помнят, с каким числом знаков записаны
+AMOUNT_DIGITS_VARIABLE = 'FINPLANNER_AMOUNT_DIGITS'
+MAX_AMOUNT_DIGITS = 6
+MINOR_LIMIT = 1 << 63
+# До 2**53 младших единиц float хранит любую сумму точно
+FLOAT_EXACT = float(1 << 53)
+AMOUNT_DIGITS = 2
+AMOUNT_SCALE = 100
+
+def set_amount_digits(digits):
+    global AMOUNT_DIGITS, AMOUNT_SCALE
+    digits = int(digits)
+    if not 0 <= digits <= MAX_AMOUNT_DIGITS:
+        raise ValueError(f"Число знаков суммы должно быть от 0 до {MAX_AMOUNT_DIGITS}")
+    AMOUNT_DIGITS = digits
+    AMOUNT_SCALE = 10 ** digits
+
+def check_minor(units):
+    if not -MINOR_LIMIT <= units < MINOR_LIMIT:
+        raise ValueError("Сумма вне допустимого диапазона")
+    return units
+
+def to_minor(value):
+    # Сумма из строки, числа или Decimal -> целое число младших единиц. Строки и float
+    # (через repr - кратчайшую запись) разбираются как десятичная запись, без ошибок
+    # двоичной дроби; лишние знаки округляются половиной вверх
+    if isinstance(value, str):
+        # Самый частый случай - ровно AMOUNT_DIGITS знаков после точки: целая часть и дробь
+        # склеиваются в одно целое ('-0' + '50' -> -50); до 12 знаков целой части
+        # результат заведомо помещается в int64
+        whole, point, fraction = value.partition('.')
+        if len(fraction) == AMOUNT_DIGITS and len(whole) <= 12 and fraction.isdigit():
+            try:
+                return int(whole + fraction)
+            except ValueError:
+                pass
+        text = value
+    elif isinstance(value, float):
+        # Обычный случай: float - ближайшее число к сумме с AMOUNT_DIGITS знаками
+        if -FLOAT_EXACT < value < FLOAT_EXACT:
+            units = round(value * AMOUNT_SCALE)
+            if units / AMOUNT_SCALE == value:
+                return units
+        text = repr(value)
+    elif isinstance(value, bool):
+        raise TypeError(f"Неверная сумма: {value}")
+    elif isinstance(value, int):
+        return check_minor(value * AMOUNT_SCALE)
+    elif isinstance(value, Decimal):
+        text = str(value)
+    else:
+        raise TypeError(f"Неверная сумма: {value!r}")
+    # Меньше знаков после точки или без точки: дробь дополняется нулями
+    whole, point, fraction = text.partition('.')
+    if len(fraction) <= AMOUNT_DIGITS and (fraction.isdigit() if fraction else whole[-1:].isdigit()):
+        try:
+            return check_minor(int(whole + fraction.ljust(AMOUNT_DIGITS, '0')))
+        except ValueError:
+            pass
+    try:
+        number = Decimal(text.strip())
+    except InvalidOperation:
+        raise ValueError(f"Неверная сумма: {value}")
+    if not number.is_finite():
+        raise ValueError(f"Неверная сумма: {value}")
+    return check_minor(int((number * AMOUNT_SCALE).to_integral_value(ROUND_HALF_UP)))
+
+def from_minor(units):
+    # Ближайшее к точной десятичной сумме число float: repr и формат с AMOUNT_DIGITS
+    # знаками выводят ровно исходные цифры, пока сумма меньше 10**15 младших единиц
+    return units / AMOUNT_SCALE
+
+def format_minor(units):
+    # Точная десятичная запись суммы в младших единицах: 12345 -> '123.45'
+    if not AMOUNT_DIGITS:
+        return str(units)
+    whole, fraction = divmod(abs(units), AMOUNT_SCALE)
+    return f"{'-' if units < 0 else ''}{whole}.{fraction:0{AMOUNT_DIGITS}d}"
+
+def format_amount(value):
+    return f"{value:.{AMOUNT_DIGITS}f}"
+
+def rescale_minor(units, digits):
+    # Перевод суммы, записанной с другим числом знаков, в текущие младшие единицы;
+    # если цифры потерялись бы, ValueError
+    if digits <= AMOUNT_DIGITS:
+        return units * 10 ** (AMOUNT_DIGITS - digits)
+    whole, rest = divmod(units, 10 ** (digits - AMOUNT_DIGITS))
+    if rest:
+        raise ValueError(f"Суммы записаны с точностью {digits} знаков, задано {AMOUNT_DIGITS}")
+    return whole
+
+if os.environ.get(AMOUNT_DIGITS_VARIABLE):
+    set_amount_digits(os.environ[AMOUNT_DIGITS_VARIABLE])
+
 def show_error(message):
     messagebox.showerror("Ошибка", message)
 